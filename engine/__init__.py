@@ -2,15 +2,26 @@
 Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
 """
 
-# for register purpose
-from . import optim
-from . import data
-from . import deim
+# registered modules are imported on first use from the manifest (engine/core/manifest.py),
+# the subpackages and backbones below are only loaded when accessed
+from .misc.lazy_loader import LazyLoader, lazy_attributes
 
-from .backbone import *
+optim = LazyLoader('optim', globals(), f'{__name__}.optim')
+data = LazyLoader('data', globals(), f'{__name__}.data')
+deim = LazyLoader('deim', globals(), f'{__name__}.deim')
 
-from .backbone import (
-    get_activation,
-    FrozenBatchNorm2d,
-    freeze_batch_norm2d,
-)
\ No newline at end of file
+__getattr__, __dir__ = lazy_attributes(globals(), {name: '.backbone' for name in (
+    'get_activation',
+    'FrozenBatchNorm2d',
+    'freeze_batch_norm2d',
+    'PResNet',
+    'MResNet',
+    'TimmModel',
+    'TorchVisionModel',
+    'CSPResNet',
+    'CSPDarkNet',
+    'CSPPAN',
+    'HGNetv2',
+    'HGNetv3',
+    'HGNetv2_PConv',
+)})
@@ -3,20 +3,23 @@ Copied from RT-DETR (https://github.com/lyuwenyu/RT-DETR)
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
-from .common import (
-    get_activation,
-    FrozenBatchNorm2d,
-    freeze_batch_norm2d,
-)
-from .presnet import PResNet
-from .test_resnet import MResNet
+from ..misc.lazy_loader import lazy_attributes
 
-from .timm_model import TimmModel
-from .torchvision_model import TorchVisionModel
+__getattr__, __dir__ = lazy_attributes(globals(), {
+    'get_activation': '.common',
+    'FrozenBatchNorm2d': '.common',
+    'freeze_batch_norm2d': '.common',
+    'PResNet': '.presnet',
+    'MResNet': '.test_resnet',
 
-from .csp_resnet import CSPResNet
-from .csp_darknet import CSPDarkNet, CSPPAN
+    'TimmModel': '.timm_model',
+    'TorchVisionModel': '.torchvision_model',
 
-from .hgnetv2 import HGNetv2
-from .hgnetv3 import HGNetv3
-from .hgnetv2_pconv import HGNetv2_PConv
\ No newline at end of file
+    'CSPResNet': '.csp_resnet',
+    'CSPDarkNet': '.csp_darknet',
+    'CSPPAN': '.csp_darknet',
+
+    'HGNetv2': '.hgnetv2',
+    'HGNetv3': '.hgnetv3',
+    'HGNetv2_PConv': '.hgnetv2_pconv',
+})
@@ -11,6 +11,7 @@ import torch.nn.functional as F
 import os
 from .common import FrozenBatchNorm2d
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 import logging
 from ..extre_module.custom_nn.attention.ema import EMA
 from ..extre_module.custom_nn.attention.simam import SimAM
@@ -471,10 +472,13 @@ class HGNetv2(nn.Module):
                  freeze_norm=True,
                  pretrained=True,
                  agg='se',
-                 local_model_dir='weight/hgnetv2/'):
+                 local_model_dir='weight/hgnetv2/',
+                 checkpoint_stages=None):
         super().__init__()
         self.use_lab = use_lab
         self.return_idx = return_idx
+        # activation checkpointing, True or list of stage indices to recompute in backward
+        self.checkpoint_stages = checkpoint_stages
 
         stem_channels = self.arch_configs[name]['stem_channels']
         stage_config = self.arch_configs[name]['stage_config']
@@ -568,7 +572,7 @@ class HGNetv2(nn.Module):
         x = self.stem(x)
         outs = []
         for idx, stage in enumerate(self.stages):
-            x = stage(x)
+            x = checkpoint_forward(stage, x, enabled=is_checkpointed(self.checkpoint_stages, idx))
             if idx in self.return_idx:
                 outs.append(x)
         return outs
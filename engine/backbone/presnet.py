@@ -11,6 +11,7 @@ from collections import OrderedDict
 from .common import get_activation, FrozenBatchNorm2d
 
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 import os
 
 
@@ -177,8 +178,11 @@ class PResNet(nn.Module):
         freeze_norm=True,
         pretrained=False,
         local_model_dir='weights/resnets',
+        checkpoint_stages=None,
         ):
         super().__init__()
+        # activation checkpointing, True or list of stage indices to recompute in backward
+        self.checkpoint_stages = checkpoint_stages
 
         block_nums = ResNet_cfg[depth]
         ch_in = 64
@@ -253,7 +257,7 @@ class PResNet(nn.Module):
         x = F.max_pool2d(conv1, kernel_size=3, stride=2, padding=1)
         outs = []
         for idx, stage in enumerate(self.res_layers):
-            x = stage(x)
+            x = checkpoint_forward(stage, x, enabled=is_checkpointed(self.checkpoint_stages, idx))
             if idx in self.return_idx:
                 outs.append(x)
         return outs
@@ -3,7 +3,7 @@ Copied from RT-DETR (https://github.com/lyuwenyu/RT-DETR)
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
-from .workspace import GLOBAL_CONFIG, register, create
+from .workspace import GLOBAL_CONFIG, register, create, import_registered
 from .yaml_utils import *
 from ._config import BaseConfig
 from .yaml_config import YAMLConfig
@@ -71,11 +71,21 @@ class BaseConfig(object):
         self.ema_warmups: int = 2000
         self.sync_bn :bool = False
         self.clip_max_norm : float = 0.
+        self.fast_step :bool = False
+        self.accumulate_steps :int = 1
+        self.compile :bool = False
+        self.compile_mode :str = 'default'
+        self.channels_last :bool = False
+        self.qat :bool = False
+        self.qat_skip :list = None
+        self.prune_spec :str = None
+        self.distill :dict = None
         self.find_unused_parameters :bool = None
 
         self.seed :int = None
         self.print_freq :int = None
         self.checkpoint_freq :int = 1
+        self.async_checkpoint :bool = False
         self.output_dir :str = None
         self.summary_dir :str = None
         self.device : str = ''
@@ -0,0 +1,107 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Manifest of registered modules, `name -> python module`, built by scanning the `engine` sources for
+`@register()` / `register()(...)` without importing them. `workspace` imports a module the first time
+one of its names is needed, so `import engine` does not pull in every backbone, timm, calflops, ...
+
+Regenerate after adding or renaming a registered module:
+
+    python -m engine.core.manifest
+"""
+
+import os
+import ast
+import json
+from typing import Dict
+
+
+__all__ = ['build_manifest', 'load_manifest', 'write_manifest', 'MANIFEST_FILE']
+
+
+ENGINE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANIFEST_FILE = os.path.join(ENGINE_ROOT, 'core', 'registry_manifest.json')
+
+
+def _register_call(node):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'register'
+
+
+def _name_kwarg(call):
+    for kw in call.keywords:
+        if kw.arg == 'name' and isinstance(kw.value, ast.Constant):
+            return kw.value.value
+    return None
+
+
+def _registered_names(tree):
+    names = []
+    for node in ast.walk(tree):
+        # @register() class / def
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            for deco in node.decorator_list:
+                if _register_call(deco):
+                    # functions are always registered by their own name
+                    name = _name_kwarg(deco) if isinstance(node, ast.ClassDef) else None
+                    names.append(name or node.name)
+
+        # X = register()(optim.X)
+        elif isinstance(node, ast.Call) and _register_call(node.func) and len(node.args) == 1:
+            arg = node.args[0]
+            name = _name_kwarg(node.func)
+            if name is None:
+                name = arg.attr if isinstance(arg, ast.Attribute) else getattr(arg, 'id', None)
+            if name is not None:
+                names.append(name)
+    return names
+
+
+def build_manifest(root: str=ENGINE_ROOT) -> Dict[str, str]:
+    """Scan the python files under `root` (the `engine` package), return `{registered name: module}`.
+    """
+    package_root = os.path.dirname(root)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(('.', '__')))
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            if 'register' not in source:
+                continue
+            try:
+                tree = ast.parse(source, filename=path)
+            except SyntaxError:
+                continue
+
+            module = os.path.relpath(path, package_root)[:-len('.py')].replace(os.sep, '.')
+            if module.endswith('.__init__'):
+                module = module[:-len('.__init__')]
+            for name in _registered_names(tree):
+                assert name not in manifest or manifest[name] == module, \
+                    f'{name} is registered in both {manifest[name]} and {module}'
+                manifest[name] = module
+    return manifest
+
+
+def load_manifest(path: str=MANIFEST_FILE) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return build_manifest()
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(path: str=MANIFEST_FILE) -> Dict[str, str]:
+    manifest = build_manifest()
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = write_manifest()
+    print(f'Write {len(manifest)} registered modules to {MANIFEST_FILE}')
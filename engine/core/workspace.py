@@ -10,7 +10,56 @@ from collections import defaultdict
 from typing import Any, Dict, Optional, List
 
 
-GLOBAL_CONFIG = defaultdict(dict)
+class _Registry(defaultdict):
+    """`defaultdict(dict)` importing the module of a missing registered name on lookup (see `import_registered`).
+    `in` does not import, so `register` still catches duplicates.
+    """
+    def __missing__(self, key):
+        if isinstance(key, str) and import_registered([key]) and key in self:
+            return dict.__getitem__(self, key)
+        return super().__missing__(key)
+
+
+GLOBAL_CONFIG = _Registry(dict)
+
+_MANIFEST = None
+
+
+def import_registered(names, rescan=False):
+    """Import the modules registering `names`, looked up in the generated manifest (engine/core/manifest.py).
+    Names already registered or unknown to the manifest are skipped.
+
+    Args:
+        names: iterable of (possibly) registered names
+        rescan: rebuild the manifest from the sources when a name is not in it (stale manifest)
+    Return:
+        bool, whether a module was imported
+    """
+    global _MANIFEST
+    from .manifest import load_manifest, build_manifest
+
+    if _MANIFEST is None:
+        _MANIFEST = load_manifest()
+
+    missing = [n for n in names if isinstance(n, str) and n not in GLOBAL_CONFIG]
+    if rescan and any(n not in _MANIFEST for n in missing):
+        _MANIFEST = build_manifest()
+
+    modules = {_MANIFEST[n] for n in missing if n in _MANIFEST}
+    for module in sorted(modules):
+        importlib.import_module(module)
+    return len(modules) > 0
+
+
+def _lookup(name, global_cfg):
+    """Whether `name` is in `global_cfg`, importing its module first. A merged config (`merge_config`)
+    is a copy taken before the import, the new schema is added to it as `merge_config` would.
+    """
+    if name not in global_cfg:
+        import_registered([name], rescan=True)
+        if global_cfg is not GLOBAL_CONFIG and name in GLOBAL_CONFIG:
+            global_cfg[name] = GLOBAL_CONFIG[name]
+    return name in global_cfg
 
 
 def register(dct :Any=GLOBAL_CONFIG, name=None, force=False):
@@ -97,15 +146,17 @@ def create(type_or_name, global_cfg=GLOBAL_CONFIG, **kwargs):
 
     name = type_or_name if isinstance(type_or_name, str) else type_or_name.__name__
 
-    if name in global_cfg:
+    if _lookup(name, global_cfg):
         if hasattr(global_cfg[name], '__dict__'):
             return global_cfg[name]
     else:
-        raise ValueError('The module {} is not registered'.format(name))
+        raise ValueError('The module {} is not registered, '
+                         'regenerate the manifest with `python -m engine.core.manifest`'.format(name))
 
     cfg = global_cfg[name]
 
     if isinstance(cfg, dict) and 'type' in cfg:
+        _lookup(cfg['type'], global_cfg)
         _cfg: dict = global_cfg[cfg['type']]
         # clean args
         _keys = [k for k in _cfg.keys() if not k.startswith('_')]
@@ -137,7 +188,7 @@ def create(type_or_name, global_cfg=GLOBAL_CONFIG, **kwargs):
             continue
 
         if isinstance(_k, str):
-            if _k not in global_cfg:
+            if not _lookup(_k, global_cfg):
                 raise ValueError(f'Missing inject config of {_k}.')
 
             _cfg = global_cfg[_k]
@@ -152,7 +203,7 @@ def create(type_or_name, global_cfg=GLOBAL_CONFIG, **kwargs):
                 raise ValueError('Missing inject for `type` style.')
 
             _type = str(_k['type'])
-            if _type not in global_cfg:
+            if not _lookup(_type, global_cfg):
                 raise ValueError(f'Missing {_type} in inspect stage.')
 
             # TODO
@@ -12,15 +12,14 @@ import re
 import copy
 
 from ._config import BaseConfig
-from .workspace import create
-from .yaml_utils import load_config, merge_config, merge_dict
+from .workspace import create, import_registered
+from .yaml_utils import resolve_config, merge_config, cache_call
 
 class YAMLConfig(BaseConfig):
     def __init__(self, cfg_path: str, **kwargs) -> None:
         super().__init__()
 
-        cfg = load_config(cfg_path)
-        cfg = merge_dict(cfg, kwargs)
+        cfg = resolve_config(cfg_path, kwargs)
 
         self.yaml_cfg = copy.deepcopy(cfg)
 
@@ -30,8 +29,28 @@ class YAMLConfig(BaseConfig):
 
     @property
     def global_cfg(self, ):
+        # registered modules are imported on demand, before their schemas are merged
+        import_registered(self._config_names(self.yaml_cfg))
         return merge_config(self.yaml_cfg, inplace=False, overwrite=False)
 
+    @staticmethod
+    def _config_names(cfg):
+        """All keys and string values of a (nested) config, candidates for registered names.
+        """
+        names = set()
+        def _walk(v):
+            if isinstance(v, dict):
+                names.update(k for k in v if isinstance(k, str))
+                for x in v.values():
+                    _walk(x)
+            elif isinstance(v, (list, tuple)):
+                for x in v:
+                    _walk(x)
+            elif isinstance(v, str):
+                names.add(v)
+        _walk(cfg)
+        return names
+
     @property
     def model(self, ) -> torch.nn.Module:
         if self._model is None and 'model' in self.yaml_cfg:
@@ -122,28 +141,44 @@ class YAMLConfig(BaseConfig):
 
         assert isinstance(cfg['params'], list), ''
 
+        # trainable parameter -> group assignment, computed once per (architecture, patterns)
+        named = [(k, v) for k, v in model.named_parameters() if v.requires_grad]
+        names = [k for k, _ in named]
+        patterns = [pg['params'] for pg in cfg['params']]
+        groups = cache_call('param_groups', (names, patterns),
+                            lambda: YAMLConfig.assign_param_groups(names, patterns))
+
         param_groups = []
-        visited = []
-        for pg in cfg['params']:
-            pattern = pg['params']
-            params = {k: v for k, v in model.named_parameters() if v.requires_grad and len(re.findall(pattern, k)) > 0}
-            pg['params'] = params.values()
+        for pg, indices in zip(cfg['params'], groups):
+            pg['params'] = [named[i][1] for i in indices]
             param_groups.append(pg)
-            visited.extend(list(params.keys()))
-            # print(params.keys())
 
-        names = [k for k, v in model.named_parameters() if v.requires_grad]
+        # parameters matching no pattern
+        if len(groups) > len(cfg['params']):
+            param_groups.append({'params': [named[i][1] for i in groups[-1]]})
+
+        return param_groups
+
+    @staticmethod
+    def assign_param_groups(names: list, patterns: list):
+        """Indices of `names` matched by each pattern, plus a last group of the unmatched names if any.
+        """
+        groups = []
+        visited = []
+        for pattern in patterns:
+            regex = re.compile(pattern)
+            indices = [i for i, k in enumerate(names) if regex.search(k) is not None]
+            groups.append(indices)
+            visited.extend(indices)
 
         if len(visited) < len(names):
-            unseen = set(names) - set(visited)
-            params = {k: v for k, v in model.named_parameters() if v.requires_grad and k in unseen}
-            param_groups.append({'params': params.values()})
-            visited.extend(list(params.keys()))
-            # print(params.keys())
+            unseen = set(range(len(names))) - set(visited)
+            groups.append(sorted(unseen))
+            visited.extend(unseen)
 
         assert len(visited) == len(names), ''
 
-        return param_groups
+        return groups
 
     @staticmethod
     def get_rank_batch_size(cfg):
@@ -169,6 +204,9 @@ class YAMLConfig(BaseConfig):
         if 'total_batch_size' in global_cfg[name]:
             # pop unexpected key for dataloader init
             _ = global_cfg[name].pop('total_batch_size')
+        if not global_cfg[name].get('num_workers', 0):
+            # torch rejects persistent workers without workers, e.g. `-u train_dataloader.num_workers=0`
+            global_cfg[name]['persistent_workers'] = False
         print(f'building {name} with batch_size={bs}...')
         loader = create(name, global_cfg, batch_size=bs)
         loader.shuffle = self.yaml_cfg[name].get('shuffle', False)
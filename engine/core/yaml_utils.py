@@ -5,7 +5,10 @@ Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 
 import os
 import copy
+import json
 import yaml
+import pickle
+import hashlib
 from typing import Any, Dict, Optional, List
 
 from .workspace import GLOBAL_CONFIG
@@ -15,20 +18,33 @@ __all__ = [
     'merge_config',
     'merge_dict',
     'parse_cli',
+    'resolve_config',
+    'cache_call',
 ]
 
 
 INCLUDE_KEY = '__include__'
 
+# resolved configs / param groups, `DEIM_CONFIG_CACHE=` (empty) disables the cache
+CACHE_DIR = os.environ.get('DEIM_CONFIG_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'deim'))
 
-def load_config(file_path, cfg=dict()):
+# libyaml when available, same constructors as yaml.Loader
+YAML_LOADER = getattr(yaml, 'CLoader', yaml.Loader)
+
+
+def load_config(file_path, cfg=dict(), files: List[str]=None):
     """load config
+
+    files: if given, every yaml file read (`file_path` and its `__include__` chain) is appended
     """
     _, ext = os.path.splitext(file_path)
     assert ext in ['.yml', '.yaml'], "only support yaml files"
 
+    if files is not None:
+        files.append(os.path.abspath(file_path))
+
     with open(file_path) as f:
-        file_cfg = yaml.load(f, Loader=yaml.Loader)
+        file_cfg = yaml.load(f, Loader=YAML_LOADER)
         if file_cfg is None:
             return {}
 
@@ -42,7 +58,7 @@ def load_config(file_path, cfg=dict()):
                 base_yaml = os.path.join(os.path.dirname(file_path), base_yaml)
 
             with open(base_yaml) as f:
-                base_cfg = load_config(base_yaml, cfg)
+                base_cfg = load_config(base_yaml, cfg, files)
                 merge_dict(cfg, base_cfg)
 
     return merge_dict(cfg, file_cfg)
@@ -85,12 +101,93 @@ def parse_cli(nargs: List[str]) -> Dict:
     for s in nargs:
         s = s.strip()
         k, v = s.split('=', 1)
-        d = dictify(k, yaml.load(v, Loader=yaml.Loader))
+        d = dictify(k, yaml.load(v, Loader=YAML_LOADER))
         cfg = merge_dict(cfg, d)
 
     return cfg
 
 
+def _hash(*items) -> str:
+    m = hashlib.sha1()
+    for item in items:
+        m.update(item if isinstance(item, bytes) else json.dumps(item, sort_keys=True, default=repr).encode())
+    return m.hexdigest()
+
+
+def _file_hash(path) -> str:
+    with open(path, 'rb') as f:
+        return _hash(path, f.read())
+
+
+def _read_cache(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def _write_cache(path, obj):
+    """Write through a temporary file, concurrent jobs never read a partial cache.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def cache_call(namespace: str, key: Any, fn):
+    """Return `fn()`, pickled in CACHE_DIR/namespace keyed by the hash of `key` (json-able).
+    """
+    if not CACHE_DIR:
+        return fn()
+    path = os.path.join(CACHE_DIR, namespace, f'{_hash(key)}.pkl')
+    value = _read_cache(path)
+    if value is None:
+        value = fn()
+        _write_cache(path, value)
+    return value
+
+
+def resolve_config(file_path, overrides: Dict=None) -> Dict:
+    """`load_config(file_path)` with its `__include__` chain, then `overrides` (e.g. cli `-u`) merged in.
+
+    The result is cached in CACHE_DIR/configs, keyed by the content hashes of all included yaml
+    files and the overrides. The included files of `file_path` are listed in an index next to it,
+    editing any of them (or the include chain) changes the key.
+    """
+    overrides = {} if overrides is None else overrides
+
+    def _resolve():
+        files = []
+        cfg = load_config(file_path, {}, files)
+        return files, merge_dict(cfg, copy.deepcopy(overrides))
+
+    if not CACHE_DIR:
+        return _resolve()[1]
+
+    cache_dir = os.path.join(CACHE_DIR, 'configs')
+    index_file = os.path.join(cache_dir, f'{_hash(os.path.abspath(file_path))}.index')
+    files = _read_cache(index_file)
+    if files is not None:
+        try:
+            key = _hash([_file_hash(f) for f in files], overrides)
+            cfg = _read_cache(os.path.join(cache_dir, f'{key}.pkl'))
+            if cfg is not None:
+                return cfg
+        except OSError:
+            pass
+
+    files, cfg = _resolve()
+    key = _hash([_file_hash(f) for f in files], overrides)
+    _write_cache(index_file, files)
+    _write_cache(os.path.join(cache_dir, f'{key}.pkl'), cfg)
+    return cfg
+
 
 def merge_config(cfg, another_cfg=GLOBAL_CONFIG, inplace: bool=False, overwrite: bool=False):
     """
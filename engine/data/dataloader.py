@@ -19,6 +19,7 @@ import random
 from functools import partial
 
 from ..core import register
+from .dataset._dataset import SharedEpoch
 torchvision.disable_beta_transforms_warning()
 from copy import deepcopy
 from PIL import Image, ImageDraw
@@ -37,6 +38,12 @@ __all__ = [
 class DataLoader(data.DataLoader):
     __inject__ = ['dataset', 'collate_fn']
 
+    def __iter__(self):
+        # shared epoch state has to exist before the (persistent) workers copy dataset and collate_fn
+        for obj in (self.dataset, self.collate_fn):
+            getattr(obj, 'shared_epoch', None)
+        return super().__iter__()
+
     def __repr__(self) -> str:
         format_string = self.__class__.__name__ + "("
         for n in ['dataset', 'batch_size', 'num_workers', 'drop_last', 'collate_fn']:
@@ -72,12 +79,19 @@ def batch_image_collate_fn(items):
 
 
 class BaseCollateFunction(object):
+    @property
+    def shared_epoch(self) -> SharedEpoch:
+        # collate_fn runs in the workers, see DetDataset.shared_epoch
+        if '_shared_epoch' not in self.__dict__:
+            self._shared_epoch = SharedEpoch()
+        return self._shared_epoch
+
     def set_epoch(self, epoch):
-        self._epoch = epoch
+        self.shared_epoch.value = epoch
 
     @property
     def epoch(self):
-        return self._epoch if hasattr(self, '_epoch') else -1
+        return self.shared_epoch.value
 
     def __call__(self, items):
         raise NotImplementedError('')
@@ -154,6 +168,10 @@ class BatchImageCollateFunction(BaseCollateFunction):
                 updated_targets[i]['boxes'] = torch.cat([targets[i]['boxes'], shifted_targets[i]['boxes']], dim=0)
                 updated_targets[i]['labels'] = torch.cat([targets[i]['labels'], shifted_targets[i]['labels']], dim=0)
                 updated_targets[i]['area'] = torch.cat([targets[i]['area'], shifted_targets[i]['area']], dim=0)
+                # cached teacher outputs of both images (TeacherCocoDetection)
+                for k in ('teacher_boxes', 'teacher_logits', 'teacher_corners'):
+                    if k in targets[i]:
+                        updated_targets[i][k] = torch.cat([targets[i][k], shifted_targets[i][k]], dim=0)
 
                 # Add mixup ratio to targets
                 updated_targets[i]['mixup'] = torch.tensor(
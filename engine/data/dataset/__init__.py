@@ -12,5 +12,6 @@ from .coco_dataset import (
 )
 from .coco_eval import CocoEvaluator
 from .coco_utils import get_coco_api_from_dataset
+from .teacher_cache import TeacherCache, TeacherCacheWriter, TeacherCocoDetection
 from .voc_detection import VOCDetection
 from .voc_eval import VOCEvaluator
@@ -3,9 +3,28 @@ Copied from RT-DETR (https://github.com/lyuwenyu/RT-DETR)
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
+import multiprocessing as mp
+
 import torch
 import torch.utils.data as data
 
+
+class SharedEpoch(object):
+    """Epoch in shared memory. Persistent dataloader workers keep the copy of the dataset / collate_fn
+    they were started with, a plain attribute set by `set_epoch` in the main process never reaches them.
+    """
+    def __init__(self, epoch: int=-1):
+        self._value = mp.Value('i', epoch, lock=False)
+
+    @property
+    def value(self) -> int:
+        return self._value.value
+
+    @value.setter
+    def value(self, epoch: int):
+        self._value.value = epoch
+
+
 class DetDataset(data.Dataset):
     def __getitem__(self, index):
         img, target = self.load_item(index)
@@ -16,9 +35,16 @@ class DetDataset(data.Dataset):
     def load_item(self, index):
         raise NotImplementedError("Please implement this function to return item before `transforms`.")
 
+    @property
+    def shared_epoch(self) -> SharedEpoch:
+        # created on first use, the dataloader touches it before starting its workers
+        if '_shared_epoch' not in self.__dict__:
+            self._shared_epoch = SharedEpoch()
+        return self._shared_epoch
+
     def set_epoch(self, epoch) -> None:
-        self._epoch = epoch
+        self.shared_epoch.value = epoch
 
     @property
     def epoch(self):
-        return self._epoch if hasattr(self, '_epoch') else -1
+        return self.shared_epoch.value
@@ -0,0 +1,218 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Columnar cache of a COCO annotation json (Objects365-scale), so datasets do not hold a `COCO` object:
+the json is parsed once, later runs, ranks and dataloader workers memory-map the arrays.
+
+Store layout, one directory of .npy files, images sorted by id (the order of CocoDetection.ids),
+annotations grouped by image:
+    meta.json           source json path / size / mtime, num_images, num_annotations, categories
+    image_ids.npy       int64 [N]
+    image_sizes.npy     int32 [N, 2], width / height
+    file_names.npy      bytes [N], utf-8
+    ann_offsets.npy     int64 [N + 1], annotations of image i are ann_offsets[i]: ann_offsets[i + 1]
+    ann_ids.npy         int64 [A]
+    category_ids.npy    int64 [A]
+    bboxes.npy          float32 [A, 4], xywh
+    areas.npy           float32 [A]
+    iscrowd.npy         uint8 [A]
+
+Segmentations and keypoints are not cached, use the json for masks.
+
+Build ahead of a distributed run:
+
+    python -m engine.data.dataset.coco_cache /datasets/objects365/annotations/zhiyuan_objv2_train.json
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import torch.distributed as dist
+from faster_coco_eval import COCO
+
+from ...core.yaml_utils import CACHE_DIR
+from ...misc import dist_utils
+
+
+__all__ = ['CocoAnnotationCache', 'CachedCOCO']
+
+
+_VERSION = 1
+_ARRAYS = ('image_ids', 'image_sizes', 'file_names', 'ann_offsets', 'ann_ids', 'category_ids', 'bboxes',
+           'areas', 'iscrowd')
+
+
+def default_cache_dir(ann_file):
+    ann_file = os.path.abspath(ann_file)
+    if not CACHE_DIR:
+        return ann_file + '.cache'
+    return os.path.join(CACHE_DIR, 'coco', hashlib.sha1(ann_file.encode()).hexdigest()[:16])
+
+
+def _source_meta(ann_file):
+    stat = os.stat(ann_file)
+    return {'source': os.path.abspath(ann_file), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime,
+            'version': _VERSION}
+
+
+def _is_valid(cache_dir, ann_file):
+    meta_file = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        return False
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    return all(meta.get(k) == v for k, v in _source_meta(ann_file).items())
+
+
+def build_cache(ann_file, cache_dir):
+    """Parse `ann_file` and write the arrays to `cache_dir`. The store is written to a temporary directory
+    and renamed into place; a valid cache published meanwhile (another node) is kept, never replaced.
+    """
+    with open(ann_file, 'r') as f:
+        dataset = json.load(f)
+
+    images = sorted(dataset['images'], key=lambda x: x['id'])
+    image_ids = np.array([img['id'] for img in images], dtype=np.int64)
+    anns = dataset.get('annotations', [])
+    ann_image_ids = np.array([ann['image_id'] for ann in anns], dtype=np.int64)
+
+    # annotations -> image index, dropping the ones of unknown images, grouped by image
+    pos = np.searchsorted(image_ids, ann_image_ids).clip(max=max(len(image_ids) - 1, 0))
+    known = np.flatnonzero(image_ids[pos] == ann_image_ids) if len(image_ids) else np.zeros(0, dtype=np.int64)
+    order = known[np.argsort(pos[known], kind='stable')]
+    counts = np.bincount(pos[known], minlength=len(image_ids))
+
+    arrays = {
+        'image_ids': image_ids,
+        'image_sizes': np.array([[img['width'], img['height']] for img in images], dtype=np.int32).reshape(-1, 2),
+        'file_names': np.array([img['file_name'].encode('utf-8') for img in images], dtype=np.bytes_),
+        'ann_offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'ann_ids': np.array([anns[i].get('id', i) for i in order], dtype=np.int64),
+        'category_ids': np.array([anns[i]['category_id'] for i in order], dtype=np.int64),
+        'bboxes': np.array([anns[i]['bbox'] for i in order], dtype=np.float32).reshape(-1, 4),
+        'areas': np.array([anns[i].get('area', 0.) for i in order], dtype=np.float32),
+        'iscrowd': np.array([anns[i].get('iscrowd', 0) for i in order], dtype=np.uint8),
+    }
+    meta = dict(_source_meta(ann_file), num_images=len(images), num_annotations=len(order),
+                categories=dataset.get('categories', []))
+
+    tmp_dir = f'{cache_dir}.tmp{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for k, v in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{k}.npy'), v)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    if _is_valid(cache_dir, ann_file):
+        # published while we were parsing, it may already be open
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+
+    # a stale cache is moved aside first, nothing removes a directory at the published path
+    if os.path.exists(cache_dir):
+        stale_dir = f'{cache_dir}.stale{os.getpid()}'
+        try:
+            os.rename(cache_dir, stale_dir)
+            shutil.rmtree(stale_dir, ignore_errors=True)
+        except OSError:
+            pass
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # another process published first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class CachedCOCO(COCO):
+    """COCO api materialized from a CocoAnnotationCache for evaluation. No dataset reads it, so
+    CocoEvaluator shares it as is instead of deep-copying.
+    """
+
+
+class CocoAnnotationCache(object):
+    """Read-only view of the cache, indexed like CocoDetection.ids. The memmaps are opened lazily in
+    each dataloader worker.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self._arrays = None
+
+    @classmethod
+    def from_json(cls, ann_file, cache_dir=None):
+        """Open the cache of `ann_file`, (re)building it when missing or older than the json.
+        In distributed runs only local rank 0 parses the json, the other ranks wait at a barrier.
+        """
+        cache_dir = cache_dir or default_cache_dir(ann_file)
+        # only local rank 0 decides, every rank reaches the barrier so the collectives stay paired
+        if int(os.getenv('LOCAL_RANK', 0)) == 0 and not _is_valid(cache_dir, ann_file):
+            print(f'Building annotation cache of {ann_file} in {cache_dir}')
+            build_cache(ann_file, cache_dir)
+        if dist_utils.is_dist_available_and_initialized():
+            dist.barrier()
+        assert _is_valid(cache_dir, ann_file), f'Annotation cache {cache_dir} was not built'
+        return cls(cache_dir)
+
+    def __getstate__(self, ):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self, ):
+        return self.meta['num_images']
+
+    @property
+    def arrays(self, ):
+        if self._arrays is None:
+            self._arrays = {k: np.load(os.path.join(self.cache_dir, f'{k}.npy'), mmap_mode='r') for k in _ARRAYS}
+        return self._arrays
+
+    @property
+    def image_ids(self) -> np.ndarray:
+        return self.arrays['image_ids']
+
+    @property
+    def categories(self):
+        return self.meta['categories']
+
+    def image_info(self, idx):
+        w, h = self.arrays['image_sizes'][idx]
+        return {'id': int(self.arrays['image_ids'][idx]), 'file_name': self.arrays['file_names'][idx].decode('utf-8'),
+                'width': int(w), 'height': int(h)}
+
+    def annotations(self, idx):
+        """Annotations of the idx-th image, as the dicts of the json (without segmentation).
+        """
+        a = self.arrays
+        start, end = int(a['ann_offsets'][idx]), int(a['ann_offsets'][idx + 1])
+        image_id = int(a['image_ids'][idx])
+        return [{'id': i, 'image_id': image_id, 'category_id': c, 'bbox': b, 'area': s, 'iscrowd': z}
+                for i, c, b, s, z in zip(a['ann_ids'][start: end].tolist(), a['category_ids'][start: end].tolist(),
+                                         a['bboxes'][start: end].tolist(), a['areas'][start: end].tolist(),
+                                         a['iscrowd'][start: end].tolist())]
+
+    def to_coco(self, ) -> CachedCOCO:
+        coco = CachedCOCO()
+        coco.dataset = {
+            'images': [self.image_info(i) for i in range(len(self))],
+            'annotations': [ann for i in range(len(self)) for ann in self.annotations(i)],
+            'categories': self.categories,
+        }
+        coco.createIndex()
+        return coco
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ann_file', type=str)
+    parser.add_argument('--cache-dir', type=str, default=None)
+    args = parser.parse_args()
+
+    cache = CocoAnnotationCache.from_json(args.ann_file, args.cache_dir)
+    print(f'{cache.cache_dir}: {cache.meta["num_images"]} images, {cache.meta["num_annotations"]} annotations')
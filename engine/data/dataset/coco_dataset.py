@@ -5,6 +5,8 @@ Mostly copy-paste from https://github.com/pytorch/vision/blob/13b35ff/references
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
+import os
+
 import torch
 import torch.utils.data
 
@@ -14,6 +16,7 @@ from PIL import Image
 import faster_coco_eval
 import faster_coco_eval.core.mask as coco_mask
 from ._dataset import DetDataset
+from .coco_cache import CocoAnnotationCache
 from .._misc import convert_to_tv_tensor
 from ...core import register
 
@@ -29,8 +32,22 @@ class CocoDetection(torchvision.datasets.CocoDetection, DetDataset):
     __inject__ = ['transforms', ]
     __share__ = ['remap_mscoco_category']
 
-    def __init__(self, img_folder, ann_file, transforms, return_masks=False, remap_mscoco_category=False):
-        super(CocoDetection, self).__init__(img_folder, ann_file)
+    def __init__(self, img_folder, ann_file, transforms, return_masks=False, remap_mscoco_category=False,
+                 ann_cache=False):
+        """
+        Args:
+            ann_cache: read the annotations from a memory-mapped columnar cache of `ann_file` (built on
+                first use, see coco_cache.py) instead of holding a COCO object. True for the default
+                location, or the cache directory.
+        """
+        self.ann_index = None
+        if ann_cache:
+            assert not return_masks, 'the annotation cache does not keep segmentations'
+            torchvision.datasets.VisionDataset.__init__(self, img_folder)
+            self.ann_index = CocoAnnotationCache.from_json(ann_file, ann_cache if isinstance(ann_cache, str) else None)
+            self.ids = self.ann_index.image_ids
+        else:
+            super(CocoDetection, self).__init__(img_folder, ann_file)
         self._transforms = transforms
         self.prepare = ConvertCocoPolysToMask(return_masks)
         self.img_folder = img_folder
@@ -45,8 +62,13 @@ class CocoDetection(torchvision.datasets.CocoDetection, DetDataset):
         return img, target
 
     def load_item(self, idx):
-        image, target = super(CocoDetection, self).__getitem__(idx)
-        image_id = self.ids[idx]
+        if self.ann_index is None:
+            image, target = super(CocoDetection, self).__getitem__(idx)
+        else:
+            info = self.ann_index.image_info(idx)
+            image = Image.open(os.path.join(self.root, info['file_name'])).convert('RGB')
+            target = self.ann_index.annotations(idx)
+        image_id = int(self.ids[idx])
         target = {'image_id': image_id, 'annotations': target}
 
         if self.remap_mscoco_category:
@@ -75,6 +97,8 @@ class CocoDetection(torchvision.datasets.CocoDetection, DetDataset):
 
     @property
     def categories(self, ):
+        if self.ann_index is not None:
+            return self.ann_index.categories
         return self.coco.dataset['categories']
 
     @property
@@ -13,6 +13,7 @@ import torch
 
 from faster_coco_eval import COCO, COCOeval_faster
 import faster_coco_eval.core.mask as mask_util
+from .coco_cache import CachedCOCO
 from ...core import register
 from ...misc import dist_utils
 __all__ = ['CocoEvaluator',]
@@ -22,7 +23,9 @@ __all__ = ['CocoEvaluator',]
 class CocoEvaluator(object):
     def __init__(self, coco_gt, iou_types):
         assert isinstance(iou_types, (list, tuple))
-        coco_gt = copy.deepcopy(coco_gt)
+        # a COCO object shared with the dataset is copied, one built from the annotation cache is not
+        if not isinstance(coco_gt, CachedCOCO):
+            coco_gt = copy.deepcopy(coco_gt)
         self.coco_gt : COCO = coco_gt
         self.iou_types = iou_types
 
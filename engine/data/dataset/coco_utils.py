@@ -187,6 +187,8 @@ def get_coco_api_from_dataset(dataset):
             break
         if isinstance(dataset, torch.utils.data.Subset):
             dataset = dataset.dataset
+    if getattr(dataset, 'ann_index', None) is not None:
+        return dataset.ann_index.to_coco()
     if isinstance(dataset, torchvision.datasets.CocoDetection):
         return dataset.coco
     return convert_to_coco_api(dataset)
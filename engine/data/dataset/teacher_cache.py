@@ -0,0 +1,185 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Offline teacher outputs (tools/dataset/build_teacher_cache.py) for distillation and pseudo-labelling.
+
+Store layout, one directory of memory-mapped .npy files, rows grouped by image:
+    meta.json           num_rows, topk, num_classes, reg_max, teacher config / checkpoint
+    image_ids.npy       int64 [N]
+    offsets.npy         int64 [N + 1], rows of image i are offsets[i]: offsets[i + 1]
+    boxes.npy           float16 [R, 4], normalized cxcywh of the untransformed image
+    logits.npy          float16 [R, num_classes]
+    corners.npy         float16 [R, 4 * (reg_max + 1)], left / top / right / bottom distributions
+"""
+
+import os
+import json
+
+import numpy as np
+import torch
+
+from .coco_dataset import CocoDetection
+from .._misc import convert_to_tv_tensor
+from ...core import register
+
+
+__all__ = ['TeacherCache', 'TeacherCacheWriter', 'TeacherCocoDetection']
+
+
+_ARRAYS = ('boxes', 'logits', 'corners')
+
+
+class TeacherCacheWriter(object):
+    """Rows go into memmaps preallocated for `topk` rows per image, `close` writes the index and `num_rows`.
+    """
+    def __init__(self, cache_dir, num_images, topk, num_classes, reg_max, meta=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        max_rows = num_images * topk
+        dims = {'boxes': 4, 'logits': num_classes, 'corners': 4 * (reg_max + 1)}
+        self.arrays = {k: np.lib.format.open_memmap(os.path.join(cache_dir, f'{k}.npy'), mode='w+',
+                                                    dtype=np.float16, shape=(max_rows, dims[k])) for k in _ARRAYS}
+        self.image_ids, self.offsets = [], [0]
+        self.meta = dict(meta or {}, topk=topk, num_classes=num_classes, reg_max=reg_max)
+
+    def append(self, image_id, boxes, logits, corners):
+        start, end = self.offsets[-1], self.offsets[-1] + len(boxes)
+        for k, v in zip(_ARRAYS, (boxes, logits, corners)):
+            self.arrays[k][start: end] = v
+        self.image_ids.append(int(image_id))
+        self.offsets.append(end)
+
+    def close(self, ):
+        for v in self.arrays.values():
+            v.flush()
+        np.save(os.path.join(self.cache_dir, 'image_ids.npy'), np.array(self.image_ids, dtype=np.int64))
+        np.save(os.path.join(self.cache_dir, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        self.meta.update(num_rows=int(self.offsets[-1]), num_images=len(self.image_ids))
+        with open(os.path.join(self.cache_dir, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+
+class TeacherCache(object):
+    """Read-only view keyed by image_id. The memmaps are opened lazily in each dataloader worker.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        image_ids = np.load(os.path.join(cache_dir, 'image_ids.npy'))
+        offsets = np.load(os.path.join(cache_dir, 'offsets.npy'))
+        self.index = {int(i): (int(s), int(e)) for i, s, e in zip(image_ids, offsets[:-1], offsets[1:])}
+        self._arrays = None
+
+    def __getstate__(self, ):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    @property
+    def arrays(self, ):
+        if self._arrays is None:
+            self._arrays = {k: np.load(os.path.join(self.cache_dir, f'{k}.npy'), mmap_mode='r') for k in _ARRAYS}
+        return self._arrays
+
+    @property
+    def reg_max(self) -> int:
+        # teacher_corners are 4 * (reg_max + 1) wide, compared with the student by the Distiller
+        return self.meta['reg_max']
+
+    def rows(self, image_id):
+        return self.index.get(int(image_id), (0, 0))
+
+    def read(self, key, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return torch.from_numpy(self.arrays[key][np.sort(rows)][np.argsort(np.argsort(rows))].astype(np.float32))
+
+
+def _center_x_func(fmt):
+    name = getattr(fmt, 'name', str(fmt)).upper()
+    if 'CXCYWH' in name:
+        return lambda b: b[:, 0]
+    if 'XYWH' in name:
+        return lambda b: b[:, 0] + b[:, 2] / 2
+    return lambda b: (b[:, 0] + b[:, 2]) / 2
+
+
+@register()
+class TeacherCocoDetection(CocoDetection):
+    """CocoDetection with cached teacher outputs in the targets, as `teacher_boxes`, `teacher_logits`
+    and `teacher_corners` (read by engine/solver/distill.py).
+
+    Teacher boxes travel through `Compose` appended to the gt boxes, tagged by negative labels
+    `-1 - 2 * row`, so every geometric transform, Mosaic and SanitizeBoundingBoxes treat them like
+    gt. The left half of each box rides along (`-2 - 2 * row`) to detect horizontal flips, which swap
+    the left / right corner distributions.
+
+    pseudo_label_thrh: teacher boxes scoring above it are added to the gt (semi-supervised training)
+    """
+    __inject__ = ['transforms', ]
+    __share__ = ['remap_mscoco_category']
+
+    def __init__(self, img_folder, ann_file, transforms, cache_dir, return_masks=False,
+                 remap_mscoco_category=False, pseudo_label_thrh=None, ann_cache=False):
+        super().__init__(img_folder, ann_file, transforms, return_masks, remap_mscoco_category, ann_cache)
+        self.cache = TeacherCache(cache_dir)
+        self.pseudo_label_thrh = pseudo_label_thrh
+
+    def load_item(self, idx):
+        image, target = super().load_item(idx)
+        start, end = self.cache.rows(target['image_id'])
+        if end == start:
+            return image, target
+
+        w, h = image.size
+        cxcywh = self.cache.read('boxes', range(start, end))
+        x1y1 = (cxcywh[:, :2] - cxcywh[:, 2:] / 2) * torch.tensor([w, h])
+        x2y2 = (cxcywh[:, :2] + cxcywh[:, 2:] / 2) * torch.tensor([w, h])
+        full = torch.cat([x1y1, x2y2], dim=-1)
+        half = full.clone()
+        half[:, 2] = (full[:, 0] + full[:, 2]) / 2
+
+        rows = torch.arange(start, end)
+        target['boxes'] = convert_to_tv_tensor(torch.cat([target['boxes'], full, half]), key='boxes',
+                                               spatial_size=image.size[::-1])
+        target['labels'] = torch.cat([target['labels'], -1 - 2 * rows, -2 - 2 * rows])
+        return image, target
+
+    def __getitem__(self, idx):
+        img, target = super().__getitem__(idx)
+        return img, self.split_teacher(target)
+
+    def split_teacher(self, target):
+        labels = target['labels']
+        mask = labels < 0
+        boxes = target['boxes']
+        center_x = _center_x_func(getattr(boxes, 'format', None))
+        target['boxes'], target['labels'] = boxes[~mask], labels[~mask]
+
+        code = -1 - labels[mask]
+        rows, is_half, t_boxes = code // 2, code % 2 == 1, boxes[mask]
+        full_rows, full_boxes = rows[~is_half], t_boxes[~is_half]
+
+        # all teacher boxes of a sample share one flip state, vote over the surviving (full, half) pairs
+        half_cx = dict(zip(rows[is_half].tolist(), center_x(t_boxes[is_half]).tolist()))
+        votes = [half_cx[r] > cx for r, cx in zip(full_rows.tolist(), center_x(full_boxes).tolist()) if r in half_cx]
+        flipped = sum(votes) * 2 > len(votes)
+
+        reg_max = self.cache.reg_max
+        logits = self.cache.read('logits', full_rows.tolist())
+        corners = self.cache.read('corners', full_rows.tolist()).reshape(-1, 4, reg_max + 1)
+        if flipped:
+            corners = corners[:, [2, 1, 0, 3]]
+
+        # same format as the gt boxes, normalized cxcywh after `ConvertBoxes`
+        target['teacher_boxes'] = full_boxes.as_subclass(torch.Tensor).float()
+        target['teacher_logits'] = logits
+        target['teacher_corners'] = corners.flatten(1)
+
+        if self.pseudo_label_thrh is not None and len(logits) > 0:
+            scores, classes = logits.sigmoid().max(-1)
+            keep = scores > self.pseudo_label_thrh
+            target['boxes'] = torch.cat([target['boxes'], target['teacher_boxes'][keep]])
+            target['labels'] = torch.cat([target['labels'], classes[keep]])
+        return target
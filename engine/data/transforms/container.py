@@ -18,6 +18,7 @@ from ._transforms import EmptyTransform
 from ...core import register, GLOBAL_CONFIG
 torchvision.disable_beta_transforms_warning()
 import random
+import multiprocessing as mp
 
 
 @register()
@@ -51,8 +52,46 @@ class Compose(T.Compose):
                 print("     ### Mosaic with Prob.@{} and ZoomOut/IoUCrop existed ### ".format(self.mosaic_prob))
             print("     ### ImgTransforms Epochs: {} ### ".format(policy['epoch']))
             print('     ### Policy_ops@{} ###'.format(policy['ops']))
-        self.global_samples = 0
         self.policy = policy
+        self._epoch = None
+        self._branches = None
+
+        if policy['name'] == 'stop_sample':
+            # sample count shared by the dataloader workers, each one holds a copy of the transforms
+            self._num_samples = mp.Value('q', 0)
+            self._reduced = [t for t in self.transforms if type(t).__name__ not in policy['ops']]
+
+    @property
+    def global_samples(self) -> int:
+        return self._num_samples.value if hasattr(self, '_num_samples') else 0
+
+    def set_epoch(self, epoch) -> None:
+        """Resolve the `stop_epoch` policy for `epoch` into the transforms that run, once per epoch
+        instead of per sample: `(mosaic branch, plain branch, mosaic active)`.
+        """
+        self._epoch = epoch
+        if self.policy['name'] != 'stop_epoch':
+            return
+
+        policy_ops = self.policy['ops']
+        policy_epoch = self.policy['epoch']
+        names = [type(t).__name__ for t in self.transforms]
+
+        if isinstance(policy_epoch, list) and len(policy_epoch) == 3:     # 4-stages
+            # first and last stage: NoAug
+            no_aug = epoch < policy_epoch[0] or epoch >= policy_epoch[-1]
+            active = [(n, t) for n, t in zip(names, self.transforms) if not (no_aug and n in policy_ops)]
+            # Using Mosaic for [policy_epoch[0], policy_epoch[1]] with probability
+            with_mosaic = policy_epoch[0] <= epoch < policy_epoch[1]
+            # Mosaic and Zoomout/IoUCrop can not be co-existed in the same sample
+            mosaic = [t for n, t in active if n not in ('RandomZoomOut', 'RandomIoUCrop')]
+            plain = [t for n, t in active if n != 'Mosaic']
+        else:   # the default data scheduler
+            no_aug = epoch >= policy_epoch
+            plain = [t for n, t in zip(names, self.transforms) if not (no_aug and n in policy_ops)]
+            mosaic, with_mosaic = None, False
+
+        self._branches = (mosaic, plain, with_mosaic)
 
     def forward(self, *inputs: Any) -> Any:
         return self.get_forward(self.policy['name'])(*inputs)
@@ -65,63 +104,35 @@ class Compose(T.Compose):
         }
         return forwards[name]
 
-    def default_forward(self, *inputs: Any) -> Any:
-        sample = inputs if len(inputs) > 1 else inputs[0]
-        for transform in self.transforms:
+    @staticmethod
+    def _apply(transforms, sample):
+        for transform in transforms:
             sample = transform(sample)
         return sample
 
-    def stop_epoch_forward(self, *inputs: Any):
+    def default_forward(self, *inputs: Any) -> Any:
         sample = inputs if len(inputs) > 1 else inputs[0]
-        dataset = sample[-1]
-        cur_epoch = dataset.epoch
-        policy_ops = self.policy['ops']
-        policy_epoch = self.policy['epoch']
+        return self._apply(self.transforms, sample)
 
-        if isinstance(policy_epoch, list) and len(policy_epoch) == 3:     # 4-stages
-            if policy_epoch[0] <= cur_epoch < policy_epoch[1]:
-                with_mosaic = random.random() <= self.mosaic_prob       # Probility for Mosaic
-            else:
-                with_mosaic = False
-            for transform in self.transforms:
-                # TODO print the transform to get the order
-                if (type(transform).__name__ in policy_ops and cur_epoch < policy_epoch[0]):   # first stage: NoAug
-                    pass
-                elif (type(transform).__name__ in policy_ops and cur_epoch >= policy_epoch[-1]):    # last stage: NoAug
-                    pass
-                else:
-                    # Using Mosaic for [policy_epoch[0], policy_epoch[1]] with probability
-                    if (type(transform).__name__ == 'Mosaic' and not with_mosaic):      
-                        pass
-                    # Mosaic and Zoomout/IoUCrop can not be co-existed in the same sample
-                    elif (type(transform).__name__ == 'RandomZoomOut' or type(transform).__name__ == 'RandomIoUCrop') and with_mosaic:      
-                        pass
-                    else:
-                        sample = transform(sample)
-        else:   # the default data scheduler
-            for transform in self.transforms:
-                if type(transform).__name__ in policy_ops and cur_epoch >= policy_epoch:
-                    pass
-                else:
-                    sample = transform(sample)
-
-        return sample
+    def stop_epoch_forward(self, *inputs: Any):
+        sample = inputs if len(inputs) > 1 else inputs[0]
+        # workers hold their own copy, follow the epoch of the dataset they were given
+        cur_epoch = sample[-1].epoch
+        if cur_epoch != self._epoch:
+            self.set_epoch(cur_epoch)
 
+        mosaic, plain, with_mosaic = self._branches
+        # Probility for Mosaic
+        if with_mosaic and random.random() <= self.mosaic_prob:
+            return self._apply(mosaic, sample)
+        return self._apply(plain, sample)
 
     def stop_sample_forward(self, *inputs: Any):
         sample = inputs if len(inputs) > 1 else inputs[0]
-        dataset = sample[-1]
-
-        cur_epoch = dataset.epoch
-        policy_ops = self.policy['ops']
-        policy_sample = self.policy['sample']
+        with self._num_samples.get_lock():
+            num_samples = self._num_samples.value
+            self._num_samples.value += 1
 
-        for transform in self.transforms:
-            if type(transform).__name__ in policy_ops and self.global_samples >= policy_sample:
-                pass
-            else:
-                sample = transform(sample)
-
-        self.global_samples += 1
-
-        return sample
+        if num_samples >= self.policy['sample']:
+            return self._apply(self._reduced, sample)
+        return self._apply(self.transforms, sample)
@@ -6,14 +6,18 @@ Modified from RT-DETR (https://github.com/lyuwenyu/RT-DETR)
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
+from ..misc.lazy_loader import lazy_attributes
 
-from .deim import DEIM
+__getattr__, __dir__ = lazy_attributes(globals(), {
+    'DEIM': '.deim',
 
-from .matcher import HungarianMatcher
-from .hybrid_encoder import HybridEncoder
-from .dfine_decoder import DFINETransformer
-from .rtdetrv2_decoder import RTDETRTransformerv2
+    'HungarianMatcher': '.matcher',
+    'HybridEncoder': '.hybrid_encoder',
+    'DFINETransformer': '.dfine_decoder',
+    'RTDETRTransformerv2': '.rtdetrv2_decoder',
 
-from .postprocessor import PostProcessor
-from .deim_criterion import DEIMCriterion
-from .hybrid_encoder_cgfm import HybridEncoder_CGFM
\ No newline at end of file
+    'PostProcessor': '.postprocessor',
+    'SlicedInference': '.sliced_inference',
+    'DEIMCriterion': '.deim_criterion',
+    'HybridEncoder_CGFM': '.hybrid_encoder_cgfm',
+})
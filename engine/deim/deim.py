@@ -2,6 +2,7 @@
 Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
 """
 
+import torch
 import torch.nn as nn
 from ..core import register
 
@@ -22,17 +23,45 @@ class DEIM(nn.Module):
         self.backbone = backbone
         self.decoder = decoder
         self.encoder = encoder
+        self.channels_last = False
 
     def forward(self, x, targets=None):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         x = self.backbone(x)
         x = self.encoder(x)
         x = self.decoder(x, targets)
 
         return x
 
-    def deploy(self, ):
+    def compile_modules(self, mode='default', **kwargs):
+        """Compile backbone, encoder and decoder layers in place (keeps state_dict keys).
+        Denoising group building, dict outputs and the criterion stay eager.
+        """
+        self.backbone.compile(mode=mode, **kwargs)
+        self.encoder.compile(mode=mode, **kwargs)
+        # decoder layers, inputs have static shapes with `denoising_max_gt_num`
+        decoder = getattr(self.decoder, 'decoder', self.decoder)
+        decoder.compile(mode=mode, **kwargs)
+        return self
+
+    def to_channels_last(self, ):
+        """NHWC conv weights, the input is converted once in `forward`. Backbone and encoder then keep
+        NHWC end to end, the encoder flatten / unflatten around its transformer layers are views.
+        """
+        self.channels_last = True
+        return self.to(memory_format=torch.channels_last)
+
+    def deploy(self, fuse: bool=True):
+        """Re-parameterise multi-branch blocks, then fold the remaining conv-bn(-affine) chains
+        (engine/misc/fuse_utils.py) unless `fuse=False`.
+        """
         self.eval()
         for m in self.modules():
-            if hasattr(m, 'convert_to_deploy'):
+            # `deployed` blocks were already re-parameterised, e.g. by `prepare_qat`
+            if hasattr(m, 'convert_to_deploy') and not getattr(m, 'deployed', False):
                 m.convert_to_deploy()
+        if fuse:
+            from ..misc.fuse_utils import fuse_model
+            fuse_model(self)
         return self
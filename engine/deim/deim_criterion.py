@@ -26,6 +26,9 @@ class DEIMCriterion(nn.Module):
     """
     __share__ = ['num_classes', ]
     __inject__ = ['matcher', ]
+    # losses averaged within the batch instead of divided by `num_boxes`, with gradient accumulation
+    # (`train_one_epoch`) the micro-batch values are scaled by 1 / accumulate_steps (prefix match)
+    batch_mean_losses = ('loss_ddf', )
 
     def __init__(self, \
         matcher,
@@ -293,19 +296,28 @@ class DEIMCriterion(nn.Module):
             indices_go = self._get_go_indices(indices, indices_aux_list)
 
             num_boxes_go = sum(len(x[0]) for x in indices_go)
-            num_boxes_go = torch.as_tensor([num_boxes_go], dtype=torch.float, device=next(iter(outputs.values())).device)
-            if is_dist_available_and_initialized():
-                torch.distributed.all_reduce(num_boxes_go)
-            num_boxes_go = torch.clamp(num_boxes_go / get_world_size(), min=1).item()
+            if kwargs.get('num_boxes', None) is not None:
+                # micro-batch, rescale by the same ratio as the full-batch `num_boxes`. An approximation:
+                # the union of matched queries is taken per micro-batch, not over the full batch
+                num_boxes_go = max(num_boxes_go * kwargs['num_boxes'] / max(sum(len(t["labels"]) for t in targets), 1), 1)
+            else:
+                num_boxes_go = torch.as_tensor([num_boxes_go], dtype=torch.float, device=next(iter(outputs.values())).device)
+                if is_dist_available_and_initialized():
+                    torch.distributed.all_reduce(num_boxes_go)
+                num_boxes_go = torch.clamp(num_boxes_go / get_world_size(), min=1).item()
         else:
             assert 'aux_outputs' in outputs, ''
 
         # Compute the average number of target boxes accross all nodes, for normalization purposes
-        num_boxes = sum(len(t["labels"]) for t in targets)
-        num_boxes = torch.as_tensor([num_boxes], dtype=torch.float, device=next(iter(outputs.values())).device)
-        if is_dist_available_and_initialized():
-            torch.distributed.all_reduce(num_boxes)
-        num_boxes = torch.clamp(num_boxes / get_world_size(), min=1).item()
+        # `num_boxes` is given for micro-batches (gradient accumulation), it's computed over the full batch
+        if kwargs.get('num_boxes', None) is not None:
+            num_boxes = kwargs['num_boxes']
+        else:
+            num_boxes = sum(len(t["labels"]) for t in targets)
+            num_boxes = torch.as_tensor([num_boxes], dtype=torch.float, device=next(iter(outputs.values())).device)
+            if is_dist_available_and_initialized():
+                torch.distributed.all_reduce(num_boxes)
+            num_boxes = torch.clamp(num_boxes / get_world_size(), min=1).item()
 
         # Compute all the requested losses, main loss
         losses = {}
@@ -15,17 +15,21 @@ def get_contrastive_denoising_training_group(targets,
                                              class_embed,
                                              num_denoising=100,
                                              label_noise_ratio=0.5,
-                                             box_noise_scale=1.0,):
-    """cnd"""
+                                             box_noise_scale=1.0,
+                                             max_gt_num=None,):
+    """cnd
+    max_gt_num: pad gts to a fixed number instead of the batch max, so denoising
+        queries and attn_mask keep static shapes across steps (e.g. for torch.compile)
+    """
     if num_denoising <= 0:
         return None, None, None, None
 
     num_gts = [len(t['labels']) for t in targets]
     device = targets[0]['labels'].device
 
-    max_gt_num = max(num_gts)
-    if max_gt_num == 0:
+    if max(num_gts) == 0:
         return None, None, None, None
+    max_gt_num = max(num_gts) if max_gt_num is None else max(max(num_gts), max_gt_num)
 
     num_group = num_denoising // max_gt_num
     num_group = 1 if num_group == 0 else num_group
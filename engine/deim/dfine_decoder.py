@@ -22,6 +22,7 @@ from .denoising import get_contrastive_denoising_training_group
 from .utils import deformable_attention_core_func_v2, get_activation, inverse_sigmoid
 from .utils import bias_init_with_prob
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 
 __all__ = ['DFINETransformer']
 
@@ -306,6 +307,8 @@ class TransformerDecoder(nn.Module):
         self.layers = nn.ModuleList([copy.deepcopy(decoder_layer) for _ in range(self.eval_idx + 1)] \
                     + [copy.deepcopy(decoder_layer_wide) for _ in range(num_layers - self.eval_idx - 1)])
         self.lqe_layers = nn.ModuleList([copy.deepcopy(LQE(4, 64, 2, reg_max, act=act)) for _ in range(num_layers)])
+        # activation checkpointing, True or list of layer indices to recompute in backward
+        self.checkpoint_layers = None
 
     def value_op(self, memory, value_proj, value_scale, memory_mask, memory_spatial_shapes):
         """
@@ -365,7 +368,8 @@ class TransformerDecoder(nn.Module):
                 output = F.interpolate(output, size=query_pos_embed.shape[-1])
                 output_detach = output.detach()
 
-            output = layer(output, ref_points_input, value, spatial_shapes, attn_mask, query_pos_embed)
+            output = checkpoint_forward(layer, output, ref_points_input, value, spatial_shapes, attn_mask, query_pos_embed,
+                enabled=is_checkpointed(self.checkpoint_layers, i))
 
             if i == 0 :
                 # Initial bounding box predictions with inverse sigmoid refinement
@@ -428,6 +432,8 @@ class DFINETransformer(nn.Module):
                  reg_scale=4.,
                  layer_scale=1,
                  mlp_act='relu',
+                 denoising_max_gt_num=None,
+                 checkpoint_layers=None,
                  ):
         super().__init__()
         assert len(feat_channels) <= num_levels
@@ -466,10 +472,13 @@ class DFINETransformer(nn.Module):
             activation, num_levels, num_points, cross_attn_method=cross_attn_method, layer_scale=layer_scale)
         self.decoder = TransformerDecoder(hidden_dim, decoder_layer, decoder_layer_wide, num_layers, nhead,
                                           reg_max, self.reg_scale, self.up, eval_idx, layer_scale, act=activation)
+        self.decoder.checkpoint_layers = checkpoint_layers
       # denoising
         self.num_denoising = num_denoising
         self.label_noise_ratio = label_noise_ratio
         self.box_noise_scale = box_noise_scale
+        # pad denoising gts to a fixed number for static shapes (torch.compile)
+        self.denoising_max_gt_num = denoising_max_gt_num
         if num_denoising > 0:
             self.denoising_class_embed = nn.Embedding(num_classes+1, hidden_dim, padding_idx=num_classes)
             init.normal_(self.denoising_class_embed.weight[:-1])
@@ -515,7 +524,8 @@ class DFINETransformer(nn.Module):
         # init encoder output anchors and valid_mask
         if self.eval_spatial_size:
             self.anchors, self.valid_mask = self._generate_anchors()
-
+        # anchors for training shapes (multi-scale), generated once per spatial shape
+        self._anchors_cache = {}
 
         self._reset_parameters(feat_channels)
 
@@ -629,6 +639,12 @@ class DFINETransformer(nn.Module):
         return anchors, valid_mask
 
 
+    def _get_cached_anchors(self, spatial_shapes, device):
+        key = (tuple(tuple(int(v) for v in shape) for shape in spatial_shapes), str(device))
+        if key not in self._anchors_cache:
+            self._anchors_cache[key] = self._generate_anchors(spatial_shapes, device=device)
+        return self._anchors_cache[key]
+
     def _get_decoder_input(self,
                            memory: torch.Tensor,
                            spatial_shapes,
@@ -636,13 +652,13 @@ class DFINETransformer(nn.Module):
                            denoising_bbox_unact=None):
 
         # prepare input for decoder
-        if self.training or self.eval_spatial_size is None:
-            anchors, valid_mask = self._generate_anchors(spatial_shapes, device=memory.device)
+        # eval inputs at another resolution than `eval_spatial_size` (e.g. a distillation teacher on training batches)
+        if self.training or self.eval_spatial_size is None or memory.shape[1] != self.anchors.shape[1]:
+            anchors, valid_mask = self._get_cached_anchors(spatial_shapes, device=memory.device)
         else:
             anchors = self.anchors
             valid_mask = self.valid_mask
-        if memory.shape[0] > 1:
-            anchors = anchors.repeat(memory.shape[0], 1, 1)
+        anchors = anchors.expand(memory.shape[0], -1, -1)
 
         # memory = torch.where(valid_mask, memory, 0)
         # TODO fix type error for onnx export
@@ -716,6 +732,7 @@ class DFINETransformer(nn.Module):
                     num_denoising=self.num_denoising,
                     label_noise_ratio=self.label_noise_ratio,
                     box_noise_scale=1.0,
+                    max_gt_num=self.denoising_max_gt_num,
                     )
         else:
             denoising_logits, denoising_bbox_unact, attn_mask, dn_meta = None, None, None, None
@@ -755,7 +772,8 @@ class DFINETransformer(nn.Module):
             out = {'pred_logits': out_logits[-1], 'pred_boxes': out_bboxes[-1], 'pred_corners': out_corners[-1],
                    'ref_points': out_refs[-1], 'up': self.up, 'reg_scale': self.reg_scale}
         else:
-            out = {'pred_logits': out_logits[-1], 'pred_boxes': out_bboxes[-1]}
+            # corners of the eval layer are only read by distillation, unused outputs are dropped on export
+            out = {'pred_logits': out_logits[-1], 'pred_boxes': out_bboxes[-1], 'pred_corners': out_corners[-1]}
 
         if self.training and self.aux_loss:
             out['aux_outputs'] = self._set_aux_loss2(out_logits[:-1], out_bboxes[:-1], out_corners[:-1], out_refs[:-1],
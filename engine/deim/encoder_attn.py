@@ -0,0 +1,164 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Self-attention options of the HybridEncoder (AIFI) layer, `HybridEncoder.encoder_attn`:
+
+    mha         nn.MultiheadAttention, full softmax attention, O(N^2) (default)
+    linear      LinearAttention, elu + 1 kernel attention, O(N)
+    window      WindowAttention, softmax attention inside non-overlapping windows, O(N * window_size^2)
+    biformer    extre_module BiLevelRoutingAttention_nchw
+    cascaded    extre_module CascadedGroupAttention (EfficientViT local window attention)
+
+`linear` and `window` keep the parameters of nn.MultiheadAttention (`in_proj_weight`, `in_proj_bias`,
+`out_proj`), a checkpoint trained with `mha` loads into them for fine-tuning.
+
+All options are called as `attn(query, key, value, spatial_shape=(h, w))` and return [B, N, C].
+"""
+
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+__all__ = ['build_encoder_attn', 'LinearAttention', 'WindowAttention', 'NCHWAttention']
+
+
+class _InProjAttention(nn.Module):
+    """q / k / v / out projections laid out like nn.MultiheadAttention.
+    """
+    def __init__(self, embed_dim, num_heads, dropout=0.):
+        super().__init__()
+        assert embed_dim % num_heads == 0, 'embed_dim must be divisible by num_heads'
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_dim = embed_dim // num_heads
+        self.dropout = dropout
+
+        self.in_proj_weight = nn.Parameter(torch.empty(3 * embed_dim, embed_dim))
+        self.in_proj_bias = nn.Parameter(torch.empty(3 * embed_dim))
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+        self._reset_parameters()
+
+    def _reset_parameters(self):
+        nn.init.xavier_uniform_(self.in_proj_weight)
+        nn.init.constant_(self.in_proj_bias, 0.)
+        nn.init.constant_(self.out_proj.bias, 0.)
+
+    def _project(self, query, key, value):
+        """[B, N, C] x 3 -> [B, num_heads, N, head_dim] x 3
+        """
+        w_q, w_k, w_v = self.in_proj_weight.chunk(3)
+        b_q, b_k, b_v = self.in_proj_bias.chunk(3)
+        B, N, _ = query.shape
+        return [F.linear(x, w, b).reshape(B, N, self.num_heads, self.head_dim).transpose(1, 2)
+                for x, w, b in ((query, w_q, b_q), (key, w_k, b_k), (value, w_v, b_v))]
+
+
+class LinearAttention(_InProjAttention):
+    """Kernelized attention, softmax(QK^T)V ~ phi(Q)(phi(K)^T V) / phi(Q) sum(phi(K)), phi = elu + 1
+    (Katharopoulos et al. 2020). Resolution free, works with multi-scale training.
+    """
+    def __init__(self, embed_dim, num_heads, dropout=0., eps=1e-6):
+        super().__init__(embed_dim, num_heads, dropout)
+        self.eps = eps
+
+    def forward(self, query, key, value, spatial_shape=None):
+        B, N, C = query.shape
+        q, k, v = self._project(query, key, value)
+        # sums over all tokens, fp32 under amp
+        q, k, v = F.elu(q.float()) + 1, F.elu(k.float()) + 1, v.float()
+
+        kv = k.transpose(-2, -1) @ v
+        z = 1. / (q @ k.sum(dim=-2, keepdim=True).transpose(-2, -1) + self.eps)
+        out = (q @ kv) * z
+
+        out = out.to(query.dtype).transpose(1, 2).reshape(B, N, C)
+        out = F.dropout(out, self.dropout, self.training)
+        return self.out_proj(out)
+
+
+class WindowAttention(_InProjAttention):
+    """Softmax attention inside non-overlapping `window_size` x `window_size` windows of the h x w
+    token grid, the grid is padded to a multiple of the window and padded keys are masked.
+    """
+    def __init__(self, embed_dim, num_heads, dropout=0., window_size=10):
+        super().__init__(embed_dim, num_heads, dropout)
+        self.window_size = window_size
+
+    def _partition(self, x, h, w):
+        """[B, num_heads, h * w, d] -> [B * num_windows, num_heads, ws * ws, d]
+        """
+        B, H, _, d = x.shape
+        ws = self.window_size
+        x = x.reshape(B, H, h, w, d)
+        x = F.pad(x, (0, 0, 0, (-w) % ws, 0, (-h) % ws))
+        nh, nw = x.shape[2] // ws, x.shape[3] // ws
+        x = x.reshape(B, H, nh, ws, nw, ws, d).permute(0, 2, 4, 1, 3, 5, 6)
+        return x.reshape(B * nh * nw, H, ws * ws, d)
+
+    def forward(self, query, key, value, spatial_shape=None):
+        assert spatial_shape is not None, 'WindowAttention needs the (h, w) of the tokens'
+        h, w = spatial_shape
+        B, N, C = query.shape
+        ws = self.window_size
+        nh, nw = math.ceil(h / ws), math.ceil(w / ws)
+
+        q, k, v = (self._partition(x, h, w) for x in self._project(query, key, value))
+
+        mask = None
+        if h % ws or w % ws:
+            valid = torch.ones(1, 1, h * w, 1, dtype=torch.bool, device=query.device)
+            # [num_windows, 1, ws * ws] -> [B * num_windows, 1, 1, ws * ws]
+            mask = self._partition(valid, h, w)[..., 0].repeat(B, 1, 1).unsqueeze(2)
+
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask,
+                                             dropout_p=self.dropout if self.training else 0.)
+
+        # [B * num_windows, num_heads, ws * ws, d] -> [B, h * w, C]
+        out = out.reshape(B, nh, nw, self.num_heads, ws, ws, self.head_dim).permute(0, 1, 4, 2, 5, 3, 6)
+        out = out.reshape(B, nh * ws, nw * ws, C)[:, :h, :w].reshape(B, N, C)
+        return self.out_proj(out)
+
+
+class NCHWAttention(nn.Module):
+    """Token attention from an NCHW extre_module block, which computes q / k / v from one input:
+    the positional query `query` (= src + pos_embed) is its input, `key` / `value` are unused.
+    """
+    def __init__(self, module: nn.Module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, query, key, value, spatial_shape=None):
+        assert spatial_shape is not None, f'{type(self.module).__name__} needs the (h, w) of the tokens'
+        h, w = spatial_shape
+        B, N, C = query.shape
+        x = query.transpose(1, 2).reshape(B, C, h, w)
+        return self.module(x).flatten(2).transpose(1, 2)
+
+
+def build_encoder_attn(cfg, embed_dim: int, num_heads: int, dropout: float=0.) -> nn.Module:
+    """
+    Args:
+        cfg: None / 'mha' / 'linear' / 'window' / 'biformer' / 'cascaded', or a dict with `type`
+            and the keyword arguments of the attention, e.g. {'type': 'window', 'window_size': 10}
+    """
+    cfg = {'type': cfg or 'mha'} if not isinstance(cfg, dict) else dict(cfg)
+    name = cfg.pop('type', 'mha')
+
+    if name == 'mha':
+        return nn.MultiheadAttention(embed_dim, num_heads, dropout, batch_first=True, **cfg)
+    if name == 'linear':
+        return LinearAttention(embed_dim, num_heads, dropout, **cfg)
+    if name == 'window':
+        return WindowAttention(embed_dim, num_heads, dropout, **cfg)
+    if name == 'biformer':
+        from ..extre_module.custom_nn.transformer.biformer import BiLevelRoutingAttention_nchw
+        return NCHWAttention(BiLevelRoutingAttention_nchw(embed_dim, num_heads=num_heads, **cfg))
+    if name == 'cascaded':
+        from ..extre_module.custom_nn.transformer.CascadedGroupAttention import CascadedGroupAttention
+        cfg.setdefault('kernels', [5] * num_heads)
+        return NCHWAttention(CascadedGroupAttention(embed_dim, num_heads=num_heads, **cfg))
+    raise ValueError(f'Unknown encoder_attn {name}')
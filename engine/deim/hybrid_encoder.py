@@ -14,8 +14,10 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from .utils import get_activation
+from .encoder_attn import build_encoder_attn
 
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 from engine.extre_module.custom_nn.upsample.eucb import EUCB
 __all__ = ['HybridEncoder']
 
@@ -231,11 +233,13 @@ class TransformerEncoderLayer(nn.Module):
                  dim_feedforward=2048,
                  dropout=0.1,
                  activation="relu",
-                 normalize_before=False):
+                 normalize_before=False,
+                 attn=None):
         super().__init__()
         self.normalize_before = normalize_before
 
-        self.self_attn = nn.MultiheadAttention(d_model, nhead, dropout, batch_first=True)
+        # nn.MultiheadAttention by default, see encoder_attn.py for linear / windowed options
+        self.self_attn = build_encoder_attn(attn, d_model, nhead, dropout)
 
         self.linear1 = nn.Linear(d_model, dim_feedforward)
         self.dropout = nn.Dropout(dropout)
@@ -251,13 +255,16 @@ class TransformerEncoderLayer(nn.Module):
     def with_pos_embed(tensor, pos_embed):
         return tensor if pos_embed is None else tensor + pos_embed
 
-    def forward(self, src, src_mask=None, pos_embed=None) -> torch.Tensor:
+    def forward(self, src, src_mask=None, pos_embed=None, spatial_shape=None) -> torch.Tensor:
         # print('!!!!!!!!!!!!!!!!!!!!', src.size())
         residual = src
         if self.normalize_before:
             src = self.norm1(src)
         q = k = self.with_pos_embed(src, pos_embed)
-        src, _ = self.self_attn(q, k, value=src, attn_mask=src_mask)
+        if isinstance(self.self_attn, nn.MultiheadAttention):
+            src, _ = self.self_attn(q, k, value=src, attn_mask=src_mask)
+        else:
+            src = self.self_attn(q, k, src, spatial_shape=spatial_shape)
 
         src = residual + self.dropout1(src)
         if not self.normalize_before:
@@ -282,10 +289,10 @@ class TransformerEncoder(nn.Module):
         self.num_layers = num_layers
         self.norm = norm
 
-    def forward(self, src, src_mask=None, pos_embed=None) -> torch.Tensor:
+    def forward(self, src, src_mask=None, pos_embed=None, spatial_shape=None) -> torch.Tensor:
         output = src
         for layer in self.layers:
-            output = layer(output, src_mask=src_mask, pos_embed=pos_embed)
+            output = layer(output, src_mask=src_mask, pos_embed=pos_embed, spatial_shape=spatial_shape)
 
         if self.norm is not None:
             output = self.norm(output)
@@ -313,9 +320,13 @@ class HybridEncoder(nn.Module):
                  act='silu',
                  eval_spatial_size=None,
                  version='dfine',
+                 checkpoint_modules=None,
+                 encoder_attn=None,
                  ):
         super().__init__()
         self.in_channels = in_channels
+        # activation checkpointing, True or subset of ['encoder', 'fpn_blocks', 'pan_blocks']
+        self.checkpoint_modules = checkpoint_modules
         self.feat_strides = feat_strides
         self.hidden_dim = hidden_dim
         self.use_encoder_idx = use_encoder_idx
@@ -342,7 +353,8 @@ class HybridEncoder(nn.Module):
             nhead=nhead,
             dim_feedforward=dim_feedforward,
             dropout=dropout,
-            activation=enc_act
+            activation=enc_act,
+            attn=encoder_attn,
             )
 
         self.encoder = nn.ModuleList([
@@ -425,16 +437,24 @@ class HybridEncoder(nn.Module):
         if self.num_encoder_layers > 0:
             for i, enc_ind in enumerate(self.use_encoder_idx):
                 h, w = proj_feats[enc_ind].shape[2:]
+                # keep the input layout, with channels_last (`DEIM.to_channels_last`) the flatten is a view
+                memory_format = torch.channels_last if not proj_feats[enc_ind].is_contiguous() and \
+                    proj_feats[enc_ind].is_contiguous(memory_format=torch.channels_last) else torch.contiguous_format
                 # flatten [B, C, H, W] to [B, HxW, C]
                 src_flatten = proj_feats[enc_ind].flatten(2).permute(0, 2, 1)
-                if self.training or self.eval_spatial_size is None:
+                # eval inputs at another resolution than `eval_spatial_size` (e.g. a distillation teacher on training batches)
+                if self.training or self.eval_spatial_size is None or \
+                        src_flatten.shape[1] != getattr(self, f'pos_embed{enc_ind}').shape[1]:
                     pos_embed = self.build_2d_sincos_position_embedding(
                         w, h, self.hidden_dim, self.pe_temperature).to(src_flatten.device)
                 else:
                     pos_embed = getattr(self, f'pos_embed{enc_ind}', None).to(src_flatten.device)
 
-                memory :torch.Tensor = self.encoder[i](src_flatten, pos_embed=pos_embed)
-                proj_feats[enc_ind] = memory.permute(0, 2, 1).reshape(-1, self.hidden_dim, h, w).contiguous()
+                memory :torch.Tensor = checkpoint_forward(self.encoder[i], src_flatten, pos_embed=pos_embed,
+                    spatial_shape=(h, w), enabled=is_checkpointed(self.checkpoint_modules, 'encoder'))
+                # [B, HxW, C] -> [B, C, H, W] is already a channels_last view, only NCHW needs a copy
+                proj_feats[enc_ind] = memory.permute(0, 2, 1).reshape(-1, self.hidden_dim, h, w) \
+                    .contiguous(memory_format=memory_format)
 
         # fpn融合：自顶向下融合高层特征到低层特征
         inner_outs = [proj_feats[-1]]
@@ -447,7 +467,8 @@ class HybridEncoder(nn.Module):
             # 修改上采样部分, 取对应的列表下标！
             # upsample_feat = F.interpolate(feat_heigh, scale_factor=2., mode='nearest')
             upsample_feat = self.fpn_upsample_blocks[len(self.in_channels) - 1 - idx](feat_heigh)
-            inner_out = self.fpn_blocks[len(self.in_channels)-1-idx](torch.concat([upsample_feat, feat_low], dim=1))
+            inner_out = checkpoint_forward(self.fpn_blocks[len(self.in_channels)-1-idx], torch.concat([upsample_feat, feat_low], dim=1),
+                enabled=is_checkpointed(self.checkpoint_modules, 'fpn_blocks'))
             inner_outs.insert(0, inner_out)
 
         # PAN 融合：自底向上融合低层特征到高层特征 
@@ -458,7 +479,8 @@ class HybridEncoder(nn.Module):
             downsample_feat = self.downsample_convs[idx](feat_low)
             # 通道数是 hidden_dim*2
             # [batch, channel, height, width]  dim=1 按照channel维度拼接！
-            out = self.pan_blocks[idx](torch.concat([downsample_feat, feat_height], dim=1))
+            out = checkpoint_forward(self.pan_blocks[idx], torch.concat([downsample_feat, feat_height], dim=1),
+                enabled=is_checkpointed(self.checkpoint_modules, 'pan_blocks'))
             outs.append(out)
 
         return outs
@@ -9,6 +9,7 @@ from .utils import get_activation
 from engine.extre_module.custom_nn.featurefusion.cgfm import ContextGuideFusionModule
 from engine.deim.hybrid_encoder import HybridEncoder
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 __all__ = ['HybridEncoder_CGFM']
 
 
@@ -16,8 +17,8 @@ __all__ = ['HybridEncoder_CGFM']
 class HybridEncoder_CGFM(HybridEncoder):
     __share__ = ['eval_spatial_size', ]
     
-    def __init__(self, in_channels=..., feat_strides=..., hidden_dim=256, nhead=8, dim_feedforward=1024, dropout=0, enc_act='gelu', use_encoder_idx=..., num_encoder_layers=1, pe_temperature=10000, expansion=1, depth_mult=1, act='silu', eval_spatial_size=None, version='dfine'):
-        super().__init__(in_channels, feat_strides, hidden_dim, nhead, dim_feedforward, dropout, enc_act, use_encoder_idx, num_encoder_layers, pe_temperature, expansion, depth_mult, act, eval_spatial_size, version)
+    def __init__(self, in_channels=..., feat_strides=..., hidden_dim=256, nhead=8, dim_feedforward=1024, dropout=0, enc_act='gelu', use_encoder_idx=..., num_encoder_layers=1, pe_temperature=10000, expansion=1, depth_mult=1, act='silu', eval_spatial_size=None, version='dfine', checkpoint_modules=None, encoder_attn=None):
+        super().__init__(in_channels, feat_strides, hidden_dim, nhead, dim_feedforward, dropout, enc_act, use_encoder_idx, num_encoder_layers, pe_temperature, expansion, depth_mult, act, eval_spatial_size, version, checkpoint_modules=checkpoint_modules, encoder_attn=encoder_attn)
         # fpn
         self.fpn_feat_fusion_blocks = nn.ModuleList()
         for _ in range(len(in_channels) - 1, 0, -1):
@@ -41,16 +42,24 @@ class HybridEncoder_CGFM(HybridEncoder):
         if self.num_encoder_layers > 0:
             for i, enc_ind in enumerate(self.use_encoder_idx):
                 h, w = proj_feats[enc_ind].shape[2:]
+                # keep the input layout, with channels_last (`DEIM.to_channels_last`) the flatten is a view
+                memory_format = torch.channels_last if not proj_feats[enc_ind].is_contiguous() and \
+                    proj_feats[enc_ind].is_contiguous(memory_format=torch.channels_last) else torch.contiguous_format
                 # flatten [B, C, H, W] to [B, HxW, C]
                 src_flatten = proj_feats[enc_ind].flatten(2).permute(0, 2, 1)
-                if self.training or self.eval_spatial_size is None:
+                # eval inputs at another resolution than `eval_spatial_size` (e.g. a distillation teacher on training batches)
+                if self.training or self.eval_spatial_size is None or \
+                        src_flatten.shape[1] != getattr(self, f'pos_embed{enc_ind}').shape[1]:
                     pos_embed = self.build_2d_sincos_position_embedding(
                         w, h, self.hidden_dim, self.pe_temperature).to(src_flatten.device)
                 else:
                     pos_embed = getattr(self, f'pos_embed{enc_ind}', None).to(src_flatten.device)
 
-                memory :torch.Tensor = self.encoder[i](src_flatten, pos_embed=pos_embed)
-                proj_feats[enc_ind] = memory.permute(0, 2, 1).reshape(-1, self.hidden_dim, h, w).contiguous()
+                memory :torch.Tensor = checkpoint_forward(self.encoder[i], src_flatten, pos_embed=pos_embed,
+                    spatial_shape=(h, w), enabled=is_checkpointed(self.checkpoint_modules, 'encoder'))
+                # [B, HxW, C] -> [B, C, H, W] is already a channels_last view, only NCHW needs a copy
+                proj_feats[enc_ind] = memory.permute(0, 2, 1).reshape(-1, self.hidden_dim, h, w) \
+                    .contiguous(memory_format=memory_format)
 
         # broadcasting and fusion
         inner_outs = [proj_feats[-1]]
@@ -63,10 +72,13 @@ class HybridEncoder_CGFM(HybridEncoder):
             upsample_feat = F.interpolate(feat_heigh, scale_factor=2., mode='nearest')
             # 把通道拼接换成fusion_blocks
             # inner_out = self.fpn_blocks[len(self.in_channels)-1-idx](torch.concat([upsample_feat, feat_low], dim=1))
-            inner_out = self.fpn_blocks[len(self.in_channels)-1-idx](
+            # fusion and csp block are recomputed together with 'fpn_blocks'
+            enabled = is_checkpointed(self.checkpoint_modules, 'fpn_blocks')
+            inner_out = checkpoint_forward(self.fpn_blocks[len(self.in_channels)-1-idx],
                 #                                            hidden_dim 参数在构造的时候已经确定了, 故此处无需再次传入
-                self.fpn_feat_fusion_blocks[len(self.in_channels)-1-idx]([upsample_feat, feat_low])
-                )
+                checkpoint_forward(self.fpn_feat_fusion_blocks[len(self.in_channels)-1-idx], [upsample_feat, feat_low],
+                    enabled=enabled),
+                enabled=enabled)
             inner_outs.insert(0, inner_out)
 
         outs = [inner_outs[0]]
@@ -78,9 +90,10 @@ class HybridEncoder_CGFM(HybridEncoder):
             # [batch, channel, height, width]  dim=1 按照channel维度拼接！
             # 把通道拼接换成fusion_blocks
             # out = self.pan_blocks[idx](torch.concat([downsample_feat, feat_height], dim=1))
-            out = self.pan_blocks[idx](
-                self.pan_feat_fusion_blocks[idx]([downsample_feat, feat_height])
-            )
+            enabled = is_checkpointed(self.checkpoint_modules, 'pan_blocks')
+            out = checkpoint_forward(self.pan_blocks[idx],
+                checkpoint_forward(self.pan_feat_fusion_blocks[idx], [downsample_feat, feat_height], enabled=enabled),
+                enabled=enabled)
             outs.append(out)
 
         return outs
@@ -18,6 +18,7 @@ from .utils import bias_init_with_prob, get_activation, inverse_sigmoid
 from .utils import deformable_attention_core_func_v2
 
 from ..core import register
+from ..misc.grad_checkpoint import is_checkpointed, checkpoint_forward
 
 __all__ = ['RTDETRTransformerv2']
 
@@ -247,6 +248,8 @@ class TransformerDecoder(nn.Module):
         self.hidden_dim = hidden_dim
         self.num_layers = num_layers
         self.eval_idx = eval_idx if eval_idx >= 0 else num_layers + eval_idx
+        # activation checkpointing, True or list of layer indices to recompute in backward
+        self.checkpoint_layers = None
 
     def forward(self,
                 target,
@@ -267,7 +270,8 @@ class TransformerDecoder(nn.Module):
             ref_points_input = ref_points_detach.unsqueeze(2)
             query_pos_embed = query_pos_head(ref_points_detach)
 
-            output = layer(output, ref_points_input, memory, memory_spatial_shapes, attn_mask, memory_mask, query_pos_embed)
+            output = checkpoint_forward(layer, output, ref_points_input, memory, memory_spatial_shapes, attn_mask,
+                memory_mask, query_pos_embed, enabled=is_checkpointed(self.checkpoint_layers, i))
 
             inter_ref_bbox = F.sigmoid(bbox_head[i](output) + inverse_sigmoid(ref_points_detach))
 
@@ -319,6 +323,7 @@ class RTDETRTransformerv2(nn.Module):
                  value_shape='reshape',
                  mlp_act='relu',
                  query_pos_method='default',
+                 checkpoint_layers=None,
                  ):
         super().__init__()
         assert len(feat_channels) <= num_levels
@@ -350,6 +355,7 @@ class RTDETRTransformerv2(nn.Module):
         decoder_layer = TransformerDecoderLayer(hidden_dim, nhead, dim_feedforward, dropout, \
             activation, num_levels, num_points, cross_attn_method=cross_attn_method, value_shape=value_shape)
         self.decoder = TransformerDecoder(hidden_dim, decoder_layer, num_layers, eval_idx)
+        self.decoder.checkpoint_layers = checkpoint_layers
 
         # denoising
         self.num_denoising = num_denoising
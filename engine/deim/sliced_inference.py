@@ -0,0 +1,183 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Sliced inference for images much larger than the model input (aerial, VisDrone, ...): the image is cut
+into overlapping tiles, the tiles (and optionally the whole downscaled image) go through the deploy
+model in batches, boxes are shifted back to image coordinates and duplicates along the tile seams are
+merged with a class-aware NMS or weighted box fusion.
+
+    sliced = SlicedInference(cfg.model.deploy(), cfg.postprocessor, tile_size=640, overlap=0.2)
+    results = sliced([image])   # [3, H, W] in [0, 1] -> [dict(labels, boxes, scores)], boxes xyxy in pixels
+"""
+
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision
+
+
+__all__ = ['SlicedInference', 'get_slices', 'merge_detections']
+
+
+def _starts(size: int, tile: int, stride: int) -> List[int]:
+    if size <= tile:
+        return [0]
+    # the last tile is aligned to the image border instead of being padded
+    return list(range(0, size - tile, stride)) + [size - tile]
+
+
+def get_slices(height: int, width: int, tile_size: int=640, overlap: float=0.2) -> torch.Tensor:
+    """Tile windows [T, 4] (x0, y0, x1, y1) covering a height x width image, neighbours overlap by
+    `overlap` of the tile size. Tiles are clipped to the image, which may be smaller than a tile.
+    """
+    assert 0 <= overlap < 1, 'overlap must be in [0, 1)'
+    stride = max(int(tile_size * (1 - overlap)), 1)
+    ys = torch.tensor(_starts(height, tile_size, stride))
+    xs = torch.tensor(_starts(width, tile_size, stride))
+    y0, x0 = torch.meshgrid(ys, xs, indexing='ij')
+    x0, y0 = x0.flatten(), y0.flatten()
+    return torch.stack([x0, y0, (x0 + tile_size).clamp(max=width), (y0 + tile_size).clamp(max=height)], dim=-1)
+
+
+def merge_detections(labels: torch.Tensor, boxes: torch.Tensor, scores: torch.Tensor, method: str='nms',
+                     iou_threshold: float=0.5) -> Dict[str, torch.Tensor]:
+    """Class-aware merge of overlapping detections, sorted by score.
+
+    nms: greedy NMS (torchvision batched_nms).
+    wbf: every box joins the highest scoring kept box it overlaps, kept boxes become the score-weighted
+        mean of their cluster and keep the cluster max score.
+    """
+    keep = torchvision.ops.batched_nms(boxes.float(), scores.float(), labels, iou_threshold)
+    if method == 'nms' or keep.numel() == 0:
+        return dict(labels=labels[keep], boxes=boxes[keep], scores=scores[keep])
+    assert method == 'wbf', f'Unknown merge method {method}'
+
+    # same trick as batched_nms, boxes of different classes never overlap
+    offsets = labels.to(boxes) * (boxes.max() + 1)
+    shifted = boxes + offsets[:, None]
+    overlap = torchvision.ops.box_iou(shifted[keep], shifted) > iou_threshold
+    # kept boxes are sorted by score, the first match is the box that suppressed it in nms
+    cluster = overlap.int().argmax(dim=0)
+    weights = torch.zeros_like(overlap, dtype=scores.dtype)
+    weights[cluster, torch.arange(boxes.shape[0], device=boxes.device)] = scores
+    merged = (weights @ boxes) / weights.sum(dim=1, keepdim=True)
+    return dict(labels=labels[keep], boxes=merged, scores=scores[keep])
+
+
+class SlicedInference(nn.Module):
+    """
+    Args:
+        model: deploy mode DEIM, takes [N, 3, input_size, input_size] images in [0, 1]
+        postprocessor: PostProcessor, train or deploy mode
+        tile_size: tile side in image pixels, tiles are resized to `input_size`
+        overlap: overlap of neighbouring tiles, fraction of `tile_size`
+        full_image: also run the whole image resized to `input_size`, finds objects larger than a tile
+        batch_size: tiles per model call, None sizes it to the free device memory (see `auto_batch_size`)
+        merge: 'nms' or 'wbf'
+        max_det: detections kept per image after merging
+    """
+    def __init__(self, model: nn.Module, postprocessor: nn.Module, tile_size: int=640, overlap: float=0.2,
+                 input_size: int=640, full_image: bool=True, batch_size: int=None, merge: str='nms',
+                 iou_threshold: float=0.5, score_threshold: float=0.01, max_det: int=300,
+                 memory_fraction: float=0.6):
+        super().__init__()
+        assert merge in ('nms', 'wbf'), f'Unknown merge method {merge}'
+        self.model = model
+        self.postprocessor = postprocessor
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.input_size = input_size
+        self.full_image = full_image
+        self.batch_size = batch_size
+        self.merge = merge
+        self.iou_threshold = iou_threshold
+        self.score_threshold = score_threshold
+        self.max_det = max_det
+        self.memory_fraction = memory_fraction
+
+    def extra_repr(self) -> str:
+        return f'tile_size={self.tile_size}, overlap={self.overlap}, input_size={self.input_size}, ' \
+            f'full_image={self.full_image}, merge={self.merge}'
+
+    @torch.no_grad()
+    def auto_batch_size(self, device: torch.device, max_batch_size: int=64) -> int:
+        """Largest tile batch that fits `memory_fraction` of the free CUDA memory, measured from the
+        peak memory of a single tile. 8 on CPU.
+        """
+        if device.type != 'cuda':
+            return 8
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        x = torch.rand(1, 3, self.input_size, self.input_size, device=device)
+        self._postprocess(self.model(x), torch.tensor([[self.input_size, self.input_size]], device=device))
+        per_tile = max(torch.cuda.max_memory_allocated(device) - base, 1)
+        free, _ = torch.cuda.mem_get_info(device)
+        return int(min(max(free * self.memory_fraction // per_tile, 1), max_batch_size))
+
+    def _postprocess(self, outputs, sizes: torch.Tensor):
+        outputs = self.postprocessor(outputs, sizes)
+        if isinstance(outputs, (list, tuple)) and isinstance(outputs[0], dict):
+            return [torch.stack([o[k] for o in outputs]) for k in ('labels', 'boxes', 'scores')]
+        return outputs
+
+    def _resize(self, x: torch.Tensor):
+        if x.shape[-2:] == (self.input_size, self.input_size):
+            return x
+        return F.interpolate(x, size=(self.input_size, self.input_size), mode='bilinear', align_corners=False)
+
+    def _crops(self, image: torch.Tensor):
+        """(resized crop [1, 3, s, s], window [4]) of every tile and of the full image.
+        """
+        H, W = image.shape[-2:]
+        windows = get_slices(H, W, self.tile_size, self.overlap).tolist()
+        if self.full_image and len(windows) > 1:
+            windows.append([0, 0, W, H])
+        for x0, y0, x1, y1 in windows:
+            yield self._resize(image[None, :, y0:y1, x0:x1]), (x0, y0, x1, y1)
+
+    @torch.no_grad()
+    def forward(self, images) -> List[Dict[str, torch.Tensor]]:
+        """images: [B, 3, H, W] or a list of [3, H, W] of any size, in [0, 1]
+        """
+        device = images[0].device
+        if self.batch_size is None:
+            self.batch_size = self.auto_batch_size(device)
+        batch_size = self.batch_size
+
+        # tiles of all images share the model calls
+        owners, windows, crops, dets = [], [], [], []
+
+        def flush():
+            if not crops:
+                return
+            sizes = torch.tensor([[x1 - x0, y1 - y0] for x0, y0, x1, y1 in windows[-len(crops):]], device=device)
+            dets.append(self._postprocess(self.model(torch.cat(crops)), sizes))
+            crops.clear()
+
+        for i, image in enumerate(images):
+            for crop, window in self._crops(image):
+                owners.append(i)
+                windows.append(window)
+                crops.append(crop)
+                if len(crops) == batch_size:
+                    flush()
+        flush()
+
+        labels, boxes, scores = (torch.cat(x) for x in zip(*dets))
+        # tile -> image coordinates
+        offsets = torch.tensor([[x0, y0, x0, y0] for x0, y0, _, _ in windows], device=device)
+        boxes = boxes + offsets[:, None].to(boxes.dtype)
+        owners = torch.tensor(owners, device=device)
+
+        results = []
+        for i in range(len(images)):
+            m = owners == i
+            lab, box, sco = labels[m].flatten(), boxes[m].flatten(0, 1), scores[m].flatten()
+            valid = sco > self.score_threshold
+            res = merge_detections(lab[valid], box[valid], sco[valid], self.merge, self.iou_threshold)
+            results.append({k: v[:self.max_det] for k, v in res.items()})
+        return results
@@ -216,7 +216,9 @@ class FDPN(nn.Module):
                 # 将特征图展平并调整维度：[B, C, H, W] -> [B, H*W, C]
                 src_flatten = proj_feats[enc_ind].flatten(2).permute(0, 2, 1)
                 # 根据训练或评估模式选择位置编码     
-                if self.training or self.eval_spatial_size is None:
+                # eval inputs at another resolution than `eval_spatial_size` (e.g. a distillation teacher on training batches)
+                if self.training or self.eval_spatial_size is None or \
+                        src_flatten.shape[1] != getattr(self, f'pos_embed{enc_ind}').shape[1]:
                     # 训练时动态生成位置编码
                     pos_embed = self.build_2d_sincos_position_embedding(
                         w, h, self.hidden_dim, self.pe_temperature).to(src_flatten.device)   
@@ -225,7 +227,7 @@ class FDPN(nn.Module):
                     pos_embed = getattr(self, f'pos_embed{enc_ind}', None).to(src_flatten.device)  
      
                 # Transformer 编码器处理 
-                memory = self.encoder[i](src_flatten, pos_embed=pos_embed)  
+                memory = self.encoder[i](src_flatten, pos_embed=pos_embed, spatial_shape=(h, w))  
                 # 将输出重塑回特征图形状：[B, H*W, C] -> [B, C, H, W]
                 proj_feats[enc_ind] = memory.permute(0, 2, 1).reshape(-1, self.hidden_dim, h, w).contiguous()
 
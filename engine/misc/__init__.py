@@ -3,7 +3,16 @@ Copied from RT-DETR (https://github.com/lyuwenyu/RT-DETR)
 Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 """
 
-from .logger import *
-from .visualizer import *
-from .dist_utils import setup_seed, setup_print
-from .profiler_utils import stats
+from .lazy_loader import lazy_attributes
+
+# dist_utils pulls in engine.data, profiler_utils calflops, load them on first use
+__getattr__, __dir__ = lazy_attributes(globals(), {
+    'SmoothedValue': '.logger',
+    'MetricLogger': '.logger',
+    'all_gather': '.logger',
+    'reduce_dict': '.logger',
+    'show_sample': '.visualizer',
+    'setup_seed': '.dist_utils',
+    'setup_print': '.dist_utils',
+    'stats': '.profiler_utils',
+})
@@ -0,0 +1,143 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+"""
+
+import os
+import shutil
+import threading
+import queue
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import torch
+
+from .dist_utils import is_main_process
+
+
+__all__ = ['AsyncCheckpointWriter', ]
+
+
+class AsyncCheckpointWriter(object):
+    """Write checkpoints from a background thread.
+
+    `save` copies every tensor of the state into reusable (pinned) CPU buffers and
+    returns; serialisation and file IO happen on a worker thread. Files are written
+    to `<path>.tmp` first and moved with `os.replace`, so a crash never leaves a
+    truncated checkpoint behind.
+
+    Saves sharing the same `tag` (e.g. `last.pth`, `checkpoint0011.pth` and
+    `best_stg1.pth` of the same epoch) reuse a single snapshot: the payload is
+    serialised once and the other paths are copied from the first file.
+
+    Only the main process writes, other ranks return immediately.
+    """
+    def __init__(self, enabled: bool=True, pin_memory: bool=True) -> None:
+        self.enabled = enabled
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self._last_tag = None
+        self._last_path: Optional[Path] = None
+        self._error: Optional[BaseException] = None
+
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def save(self, state: Any, path, tag=None):
+        """Snapshot `state` and schedule it to be written to `path`.
+        """
+        if not is_main_process():
+            return
+
+        path = Path(path)
+        if not self.enabled:
+            torch.save(state, path)
+            return
+
+        self._raise_error()
+        self._start()
+
+        if tag is not None and tag == self._last_tag and self._last_path is not None:
+            if self._last_path != path:
+                self._queue.put(('copy', self._last_path, path))
+            return
+
+        # buffers are reused, the previous payload must be on disk before overwriting them
+        self.wait()
+
+        snapshot = self._snapshot(state, prefix='')
+        if self.pin_memory:
+            torch.cuda.synchronize()
+
+        self._last_tag = tag
+        self._last_path = path
+        self._queue.put(('save', snapshot, path))
+
+    def wait(self):
+        """Block until all scheduled checkpoints are on disk.
+        """
+        if self._thread is not None:
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread is not None:
+            self.wait()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name='checkpoint-writer', daemon=True)
+            self._thread.start()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Asynchronous checkpoint writing failed') from error
+
+    def _snapshot(self, obj, prefix: str):
+        if isinstance(obj, torch.Tensor):
+            return self._copy_tensor(obj, prefix)
+        elif isinstance(obj, dict):
+            return type(obj)((k, self._snapshot(v, f'{prefix}.{k}')) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v, f'{prefix}.{i}') for i, v in enumerate(obj))
+        return obj
+
+    def _copy_tensor(self, tensor: torch.Tensor, key: str):
+        tensor = tensor.detach()
+        if not tensor.is_cuda:
+            return tensor.clone()
+
+        buffer = self._buffers.get(key, None)
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            buffer = torch.empty(tensor.shape, dtype=tensor.dtype, device='cpu', pin_memory=self.pin_memory)
+            self._buffers[key] = buffer
+
+        buffer.copy_(tensor, non_blocking=self.pin_memory)
+        return buffer
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            try:
+                if job[0] == 'save':
+                    _, snapshot, path = job
+                    tmp = path.with_name(path.name + '.tmp')
+                    torch.save(snapshot, tmp)
+                    os.replace(tmp, path)
+                else:
+                    _, src, dst = job
+                    tmp = dst.with_name(dst.name + '.tmp')
+                    shutil.copyfile(src, tmp)
+                    os.replace(tmp, dst)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
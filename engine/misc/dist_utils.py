@@ -144,10 +144,36 @@ def warp_model(
             raise AttributeError('')
 
     if compile:
-        model = torch.compile(model, mode=compile_mode)
+        model = compile_model(model, mode=compile_mode)
 
     return model
 
+
+def compile_model(model: torch.nn.Module, mode: str='default', **kwargs):
+    """torch.compile, models implementing `compile_modules` (e.g. DEIM) only compile
+    their static-shape parts in place, the others are wrapped as a whole.
+    """
+    import torch._dynamo
+    # multi-scale training compiles one graph per input size
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 32)
+
+    module = de_parallel(model)
+    if hasattr(module, 'compile_modules'):
+        module.compile_modules(mode=mode, **kwargs)
+        return model
+
+    return torch.compile(model, mode=mode, **kwargs)
+
+
+def reset_compiled_modules(model: torch.nn.Module):
+    """drop forwards compiled by `nn.Module.compile`, needed on deep copies of a compiled
+    model as they still point to the compiled forward of the original modules.
+    """
+    for m in model.modules():
+        if getattr(m, '_compiled_call_impl', None) is not None:
+            m._compiled_call_impl = None
+    return model
+
 def de_model(model):
     return de_parallel(de_complie(model))
 
@@ -161,7 +187,9 @@ def warp_loader(loader, shuffle=False):
                             drop_last=loader.drop_last,
                             collate_fn=loader.collate_fn,
                             pin_memory=loader.pin_memory,
-                            num_workers=loader.num_workers)
+                            num_workers=loader.num_workers,
+                            persistent_workers=loader.persistent_workers and loader.num_workers > 0,
+                            prefetch_factor=loader.prefetch_factor)
     return loader
 
 
@@ -0,0 +1,198 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Graph-level conv-bn fusion for deploy. Each module is symbolically traced (torch.fx), modules that
+do not trace are handled through their children. On the traced graphs every chain
+
+    Conv2d -> BatchNorm2d / FrozenBatchNorm2d [-> Identity / ReLU -> LearnableAffineBlock]
+
+whose intermediate results have no other user is folded into the conv, in place: the BatchNorm
+(and a foldable LearnableAffineBlock) become Identity, module names and attributes are kept.
+"""
+
+import time
+from typing import Dict, List, Tuple
+
+import torch
+import torch.nn as nn
+import torch.fx as fx
+
+
+__all__ = ['fold_bn', 'fuse_model', 'verify_fused', ]
+
+
+# custom modules kept as call_module nodes, so they can be matched on the graph
+_LEAF_MODULES = ('LearnableAffineBlock', 'FrozenBatchNorm2d', )
+
+
+class _Tracer(fx.Tracer):
+    def is_leaf_module(self, m: nn.Module, module_qualified_name: str) -> bool:
+        return type(m).__name__ in _LEAF_MODULES or super().is_leaf_module(m, module_qualified_name)
+
+
+class ScalarBias(nn.Module):
+    """`x + bias`, what is left of a LearnableAffineBlock behind a ReLU once its scale is folded.
+    """
+    def __init__(self, bias: torch.Tensor):
+        super().__init__()
+        self.bias = nn.Parameter(bias.detach().clone(), requires_grad=False)
+
+    def forward(self, x):
+        return x + self.bias
+
+
+@torch.no_grad()
+def fold_bn(conv: nn.Conv2d, bn: nn.BatchNorm2d):
+    """conv <- bn(conv), eval-mode statistics. Also takes FrozenBatchNorm2d (affine buffers, no `affine`).
+    """
+    affine = getattr(bn, 'affine', True)
+    std = (bn.running_var + bn.eps).sqrt()
+    t = bn.weight / std if affine else 1. / std
+    shift = bn.bias if affine else torch.zeros_like(bn.running_mean)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    conv.weight.data.mul_(t.reshape(-1, 1, 1, 1).to(conv.weight.dtype))
+    conv.bias = nn.Parameter((shift + (bias - bn.running_mean) * t).detach().to(conv.weight.dtype))
+
+
+@torch.no_grad()
+def _fold_affine(conv: nn.Conv2d, scale: torch.Tensor, bias: torch.Tensor=None):
+    conv.weight.data.mul_(scale.to(conv.weight.dtype))
+    conv.bias.data.mul_(scale.to(conv.bias.dtype))
+    if bias is not None:
+        conv.bias.data.add_(bias.to(conv.bias.dtype))
+
+
+def _is_foldable_bn(m: nn.Module) -> bool:
+    if type(m) is nn.BatchNorm2d:
+        return m.track_running_stats
+    return type(m).__name__ == 'FrozenBatchNorm2d'
+
+
+def _single_user(node: fx.Node):
+    return next(iter(node.users)) if len(node.users) == 1 else None
+
+
+def _module_of(node: fx.Node, modules: Dict[str, nn.Module]):
+    return modules.get(node.target) if node is not None and node.op == 'call_module' else None
+
+
+def _find_chains(root: nn.Module, graph: fx.Graph, shared: set) -> List[Tuple[str, str, str, str]]:
+    """(conv, bn, act, lab) qualified names relative to `root`, act / lab may be None.
+    """
+    modules = dict(root.named_modules())
+    calls = {}
+    for node in graph.nodes:
+        if node.op == 'call_module':
+            calls[node.target] = calls.get(node.target, 0) + 1
+
+    chains = []
+    for node in graph.nodes:
+        conv = _module_of(node, modules)
+        if type(conv) is not nn.Conv2d or id(conv) in shared or calls[node.target] > 1:
+            continue
+        bn_node = _single_user(node)
+        bn = _module_of(bn_node, modules)
+        if not _is_foldable_bn(bn) or calls[bn_node.target] > 1 or bn_node.args[0] is not node:
+            continue
+
+        act_name, lab_name = None, None
+        act_node = _single_user(bn_node)
+        act = _module_of(act_node, modules)
+        if type(act) in (nn.Identity, nn.ReLU) and calls[act_node.target] == 1:
+            lab_node = _single_user(act_node)
+            lab = _module_of(lab_node, modules)
+            if type(lab).__name__ == 'LearnableAffineBlock' and calls[lab_node.target] == 1:
+                act_name, lab_name = act_node.target, lab_node.target
+        chains.append((node.target, bn_node.target, act_name, lab_name))
+    return chains
+
+
+def _replace(root: nn.Module, name: str, module: nn.Module):
+    parent, _, attr = name.rpartition('.')
+    setattr(root.get_submodule(parent) if parent else root, attr, module)
+
+
+def _fuse_chain(root: nn.Module, conv_name, bn_name, act_name, lab_name):
+    conv, bn = root.get_submodule(conv_name), root.get_submodule(bn_name)
+    fold_bn(conv, bn)
+    _replace(root, bn_name, nn.Identity())
+    if lab_name is None:
+        return
+
+    lab = root.get_submodule(lab_name)
+    scale, bias = lab.scale.detach(), lab.bias.detach()
+    if isinstance(root.get_submodule(act_name), nn.Identity):
+        _fold_affine(conv, scale, bias)
+        _replace(root, lab_name, nn.Identity())
+    # relu(x) * s == relu(x * s) for s > 0, the bias stays behind the relu
+    elif bool((scale > 0).all()):
+        _fold_affine(conv, scale)
+        _replace(root, lab_name, ScalarBias(bias))
+
+
+def _fuse(module: nn.Module, shared: set) -> int:
+    try:
+        graph = _Tracer().trace(module)
+    except Exception:
+        return sum(_fuse(child, shared) for child in module.children())
+
+    chains = _find_chains(module, graph, shared)
+    for chain in chains:
+        _fuse_chain(module, *chain)
+    return len(chains)
+
+
+def fuse_model(model: nn.Module) -> int:
+    """Fold every traceable conv -> bn (-> affine) chain of an eval-mode model in place,
+    return the number of fused convs. Run after `convert_to_deploy` (see `DEIM.deploy`).
+    """
+    assert not model.training, 'conv-bn fusion uses running statistics, call eval() first'
+    counts = {}
+    for m in model.modules(remove_duplicate=False):
+        counts[id(m)] = counts.get(id(m), 0) + 1
+    shared = {k for k, v in counts.items() if v > 1}
+    return _fuse(model, shared)
+
+
+def _flatten(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return [outputs]
+    if isinstance(outputs, dict):
+        return [t for k in sorted(outputs) for t in _flatten(outputs[k])]
+    if isinstance(outputs, (list, tuple)):
+        return [t for x in outputs for t in _flatten(x)]
+    return []
+
+
+@torch.no_grad()
+def _latency(model, inputs, iters, warmup):
+    times = []
+    for i in range(warmup + iters):
+        if inputs.is_cuda:
+            torch.cuda.synchronize()
+        t = time.perf_counter()
+        model(inputs)
+        if inputs.is_cuda:
+            torch.cuda.synchronize()
+        if i >= warmup:
+            times.append(time.perf_counter() - t)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+@torch.no_grad()
+def verify_fused(reference: nn.Module, fused: nn.Module, inputs: torch.Tensor, atol: float=1e-3,
+                 rtol: float=1e-3, iters: int=20, warmup: int=5) -> Dict:
+    """Compare outputs of the unfused and fused models, and their p50 latency in ms.
+    """
+    ref_out, out = _flatten(reference(inputs)), _flatten(fused(inputs))
+    assert len(ref_out) == len(out), 'fused model returns different outputs'
+    max_diff = max([(a.float() - b.float()).abs().max().item() for a, b in zip(ref_out, out)] + [0.])
+    close = all(torch.allclose(a.float(), b.float(), atol=atol, rtol=rtol) for a, b in zip(ref_out, out))
+    return {
+        'max_abs_diff': max_diff,
+        'passed': close,
+        'latency_before': _latency(reference, inputs, iters, warmup),
+        'latency_after': _latency(fused, inputs, iters, warmup),
+    }
@@ -0,0 +1,57 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+"""
+
+import torch
+import torch.nn as nn
+import torch.utils.checkpoint
+
+
+__all__ = ['is_checkpointed', 'checkpoint_forward', ]
+
+
+def is_checkpointed(policy, key) -> bool:
+    """
+    policy:
+        bool, recompute all (True) or none (False/None) of the modules
+        list, stage / layer indices or module names to recompute, e.g. [2, 3] or ['fpn_blocks']
+    """
+    if policy is None or isinstance(policy, bool):
+        return bool(policy)
+    return key in policy
+
+
+def _bn_stats(module: nn.Module):
+    return [(m, [b.clone() for b in (m.running_mean, m.running_var, m.num_batches_tracked) if b is not None])
+            for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+
+
+def _restore_bn_stats(stats):
+    with torch.no_grad():
+        for m, saved in stats:
+            for b, v in zip([b for b in (m.running_mean, m.running_var, m.num_batches_tracked) if b is not None], saved):
+                b.copy_(v)
+
+
+def checkpoint_forward(module: nn.Module, *args, enabled: bool=True, **kwargs):
+    """Run `module` with activation checkpointing (recompute in backward) during training.
+
+    BatchNorm running stats are updated by the forward only, the recompute in backward runs on the
+    same batch and its update is undone.
+    """
+    if enabled and module.training and torch.is_grad_enabled():
+        called = []
+
+        def run(*args, **kwargs):
+            if not called:
+                called.append(True)
+                return module(*args, **kwargs)
+            stats = _bn_stats(module)
+            try:
+                return module(*args, **kwargs)
+            finally:
+                _restore_bn_stats(stats)
+
+        return torch.utils.checkpoint.checkpoint(run, *args, use_reentrant=False, **kwargs)
+    return module(*args, **kwargs)
@@ -62,6 +62,30 @@ class LazyLoader(types.ModuleType):
     return dir(module)
 
 
+def lazy_attributes(parent_module_globals, attributes):
+  """Module level `__getattr__` and `__dir__` (PEP 562) for a package exporting
+  `attributes`, `{name: relative submodule}`. The submodule is imported the first
+  time `name` is looked up, and `name` is then cached in the package globals.
+
+  E.g. in a package `__init__.py`:
+    __getattr__, __dir__ = lazy_attributes(globals(), {'HGNetv2': '.hgnetv2'})
+  """
+  package = parent_module_globals['__name__']
+
+  def __getattr__(name):
+    if name not in attributes:
+      raise AttributeError(f"module '{package}' has no attribute '{name}'")
+    module = importlib.import_module(attributes[name], package)
+    value = getattr(module, name)
+    parent_module_globals[name] = value
+    return value
+
+  def __dir__():
+    return sorted(set(parent_module_globals) | set(attributes))
+
+  return __getattr__, __dir__
+
+
 # import paddle.nn as nn
 # nn = LazyLoader("nn", globals(), "paddle.nn")
 
@@ -160,6 +160,18 @@ class MetricLogger(object):
             assert isinstance(v, (float, int))
             self.meters[k].update(v)
 
+    def update_n(self, n, **kwargs):
+        """update meters with values averaged over `n` steps,
+        tensors are read back with a single device sync
+        """
+        tensors = {k: v for k, v in kwargs.items() if isinstance(v, torch.Tensor)}
+        if tensors:
+            values = torch.stack([v.detach().float() for v in tensors.values()]).tolist()
+            kwargs.update(zip(tensors.keys(), values))
+        for k, v in kwargs.items():
+            assert isinstance(v, (float, int))
+            self.meters[k].update(v, n=n)
+
     def __getattr__(self, attr):
         if attr in self.meters:
             return self.meters[attr]
@@ -3,17 +3,19 @@ Copyright (c) 2024 The D-FINE Authors. All Rights Reserved.
 """
 
 import copy
-from calflops import calculate_flops
 from typing import Tuple
 
+from .dist_utils import reset_compiled_modules
+
 def stats(
     cfg,
     input_shape: Tuple=(1, 3, 640, 640), ) -> Tuple[int, dict]:
+    from calflops import calculate_flops
 
     base_size = cfg.train_dataloader.collate_fn.base_size
     input_shape = (1, 3, base_size, base_size)
 
-    model_for_info = copy.deepcopy(cfg.model).deploy()
+    model_for_info = reset_compiled_modules(copy.deepcopy(cfg.model)).deploy()
 
     flops, macs, _ = calculate_flops(model=model_for_info,
                                         input_shape=input_shape,
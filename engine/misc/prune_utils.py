@@ -0,0 +1,335 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Structured channel pruning for HGNetv2 and HybridEncoder.
+
+Channels are pruned per dependency group: every conv producing the channels (and its BN),
+depthwise / square convs that carry them through, and every conv consuming them, at their
+offset inside a concatenation. Groups covered:
+    HG_Block        output of each layer (next layer + aggregation concat), se squeeze
+    HG_Stage        stage output, tied through residuals, next stage and encoder `input_proj`
+    CSPLayer        hidden channels (conv1 + conv2 + bottleneck sum)
+    RepNCSPELAN4    CSP hidden channels and the cv2 / cv3 outputs (cv4 concat)
+"""
+
+import json
+from collections import OrderedDict
+from typing import Dict, List, Union
+
+import torch
+import torch.nn as nn
+
+
+__all__ = ['build_groups', 'prune_model', 'apply_pruning_spec', 'load_pruning_spec', 'bn_importance', 'taylor_importance', ]
+
+
+def _conv(m: nn.Module) -> nn.Conv2d:
+    """The nn.Conv2d of ConvBNAct / ConvNormLayer(_fuse) blocks (`padding='same'` wraps it in a Sequential).
+    """
+    conv = m.conv
+    return conv[-1] if isinstance(conv, nn.Sequential) else conv
+
+
+def _bn(m: nn.Module) -> nn.BatchNorm2d:
+    return m.bn if hasattr(m, 'bn') else m.norm
+
+
+def _param(t: torch.Tensor, requires_grad: bool):
+    return nn.Parameter(t.clone(), requires_grad=requires_grad)
+
+
+def _prune_out(conv: nn.Conv2d, keep):
+    conv.weight = _param(conv.weight.data[keep], conv.weight.requires_grad)
+    if conv.bias is not None:
+        conv.bias = _param(conv.bias.data[keep], conv.bias.requires_grad)
+    conv.out_channels = len(keep)
+
+
+def _prune_in(conv: nn.Conv2d, offset: int, size: int, keep):
+    assert conv.groups == 1, 'grouped convs can only be pruned as depthwise producers'
+    idx = torch.cat([torch.arange(offset), keep + offset, torch.arange(offset + size, conv.in_channels)])
+    conv.weight = _param(conv.weight.data[:, idx], conv.weight.requires_grad)
+    conv.in_channels = len(idx)
+
+
+def _prune_bn(bn: nn.BatchNorm2d, keep):
+    bn.weight = _param(bn.weight.data[keep], bn.weight.requires_grad)
+    bn.bias = _param(bn.bias.data[keep], bn.bias.requires_grad)
+    bn.running_mean = bn.running_mean[keep].clone()
+    bn.running_var = bn.running_var[keep].clone()
+    bn.num_features = len(keep)
+
+
+class ChannelGroup(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.producers = []     # conv-bn blocks producing the channels
+        self.depthwise = []     # depthwise conv-bn blocks, in == out == groups
+        self.square = []        # 1x1 convs mapping the channels onto themselves (EseModule)
+        self.consumers = []     # (conv, offset_fn) reading the channels at `offset_fn()` of their input
+
+    @property
+    def size(self, ):
+        return _conv(self.producers[0]).out_channels
+
+    def bns(self, ):
+        return [_bn(m) for m in self.producers + self.depthwise]
+
+    def prune(self, keep: torch.Tensor):
+        keep = keep.sort().values
+        size = self.size
+        # offsets are read before any module of this group changes, they depend on other groups only
+        consumers = [(conv, offset_fn()) for conv, offset_fn in self.consumers]
+        for conv, offset in consumers:
+            _prune_in(conv, offset, size, keep)
+        for m in self.producers:
+            _prune_out(_conv(m), keep)
+            _prune_bn(_bn(m), keep)
+        for m in self.depthwise:
+            conv = _conv(m)
+            _prune_out(conv, keep)
+            conv.in_channels = conv.groups = len(keep)
+            _prune_bn(_bn(m), keep)
+        for conv in self.square:
+            _prune_out(conv, keep)
+            _prune_in(conv, 0, size, keep)
+
+    def __repr__(self, ):
+        return f'ChannelGroup({self.name}, size={self.size}, producers={len(self.producers)}, consumers={len(self.consumers)})'
+
+
+def _const(v):
+    return lambda: v
+
+
+def _input_convs(layer):
+    """Convs reading the input of an HG_Block layer (ConvBNAct or LightConvBNAct).
+    """
+    return _conv(layer.conv1) if hasattr(layer, 'conv1') else _conv(layer)
+
+
+def _hg_layer_groups(name, block) -> List[ChannelGroup]:
+    from ..backbone.hgnetv2 import LightConvBNAct
+
+    groups = []
+    layers = block.layers
+    agg_conv = _conv(block.aggregation[0])
+
+    for i, layer in enumerate(layers):
+        g = ChannelGroup(f'{name}.layers.{i}')
+        if isinstance(layer, LightConvBNAct):
+            g.producers.append(layer.conv1)
+            g.depthwise.append(layer.conv2)
+        else:
+            g.producers.append(layer)
+        if i + 1 < len(layers):
+            g.consumers.append((_input_convs(layers[i + 1]), _const(0)))
+
+        def offset(i=i):
+            # block input + outputs of the previous layers, read from the current (possibly pruned) modules
+            return _input_convs(layers[0]).in_channels + sum(_conv(l.conv2 if hasattr(l, 'conv2') else l).out_channels
+                                                              for l in layers[:i])
+        g.consumers.append((agg_conv, offset))
+        groups.append(g)
+
+    # se aggregation: squeeze conv -> excitation conv
+    if len(block.aggregation) == 2 and type(block.aggregation[1]).__name__ == 'ConvBNAct':
+        g = ChannelGroup(f'{name}.aggregation.0')
+        g.producers.append(block.aggregation[0])
+        g.consumers.append((_conv(block.aggregation[1]), _const(0)))
+        groups.append(g)
+
+    return groups
+
+
+def _stage_output_producers(block):
+    """(conv-bn producers, square convs) of an HG_Block output, None for unsupported aggregations.
+    """
+    agg = block.aggregation
+    kind = type(agg[1]).__name__
+    if kind == 'ConvBNAct':     # se
+        return [agg[1]], []
+    if kind == 'EseModule':
+        return [agg[0]], [agg[1].conv]
+    return None
+
+
+def _hgnetv2_groups(backbone, encoder=None) -> List[ChannelGroup]:
+    groups = []
+    stages = backbone.stages
+    for s, stage in enumerate(stages):
+        for b, block in enumerate(stage.blocks):
+            groups.extend(_hg_layer_groups(f'backbone.stages.{s}.blocks.{b}', block))
+
+    for s, stage in enumerate(stages):
+        outs = [_stage_output_producers(block) for block in stage.blocks]
+        if any(o is None for o in outs):
+            continue
+
+        g = ChannelGroup(f'backbone.stages.{s}')
+        for (producers, square) in outs:
+            g.producers.extend(producers)
+            g.square.extend(square)
+
+        # residual blocks read the stage output: first layer and the identity slice of the concat
+        readers = list(stage.blocks[1:])
+        if s + 1 < len(stages):
+            nxt = stages[s + 1]
+            if type(nxt.downsample).__name__ == 'ConvBNAct':
+                g.depthwise.append(nxt.downsample)
+            readers.append(nxt.blocks[0])
+        for block in readers:
+            g.consumers.append((_input_convs(block.layers[0]), _const(0)))
+            g.consumers.append((_conv(block.aggregation[0]), _const(0)))
+
+        if s in backbone.return_idx:
+            if encoder is None:
+                continue
+            proj = encoder.input_proj[backbone.return_idx.index(s)]
+            g.consumers.append((proj.conv, _const(0)))
+        groups.append(g)
+
+    return groups
+
+
+def _csp_hidden_group(name, csp, consumers) -> ChannelGroup:
+    """conv1 / conv2 outputs and every bottleneck (VGGBlock) are summed, one group.
+    """
+    g = ChannelGroup(f'{name}.hidden')
+    g.producers.extend([csp.conv1, csp.conv2])
+    for vgg in csp.bottlenecks:
+        assert not hasattr(vgg, 'conv'), 'prune before convert_to_deploy'
+        g.producers.extend([vgg.conv1, vgg.conv2])
+        g.consumers.extend([(vgg.conv1.conv, _const(0)), (vgg.conv2.conv, _const(0))])
+    g.consumers.extend(consumers)
+    return g
+
+
+def _encoder_groups(encoder) -> List[ChannelGroup]:
+    from ..deim.hybrid_encoder import CSPLayer, RepNCSPELAN4
+
+    groups = []
+    for prefix in ('fpn_blocks', 'pan_blocks'):
+        for i, block in enumerate(getattr(encoder, prefix)):
+            name = f'encoder.{prefix}.{i}'
+            if isinstance(block, RepNCSPELAN4):
+                c3 = _conv(block.cv1).out_channels
+                cv4 = _conv(block.cv4)
+                for j, branch in ((2, block.cv2), (3, block.cv3)):
+                    csp, tail = branch[0], branch[1]
+                    # CSPLayer(expansion=1) has no conv3, its hidden channels are the branch output
+                    groups.append(_csp_hidden_group(f'{name}.cv{j}.0', csp, [(_conv(tail), _const(0))]))
+
+                g2 = ChannelGroup(f'{name}.cv2.1')
+                g2.producers.append(block.cv2[1])
+                g2.consumers.extend([(_conv(block.cv3[0].conv1), _const(0)), (_conv(block.cv3[0].conv2), _const(0)),
+                                     (cv4, _const(c3))])
+                g3 = ChannelGroup(f'{name}.cv3.1')
+                g3.producers.append(block.cv3[1])
+                g3.consumers.append((cv4, lambda block=block, c3=c3: c3 + _conv(block.cv2[1]).out_channels))
+                groups.extend([g2, g3])
+
+            elif isinstance(block, CSPLayer) and not isinstance(block.conv3, nn.Identity):
+                groups.append(_csp_hidden_group(name, block, [(_conv(block.conv3), _const(0))]))
+
+    return groups
+
+
+def build_groups(model: nn.Module) -> List[ChannelGroup]:
+    """Dependency groups of a DEIM model, or of a bare HGNetv2 / HybridEncoder.
+    """
+    from ..backbone.hgnetv2 import HGNetv2
+    from ..deim.hybrid_encoder import HybridEncoder
+
+    backbone = getattr(model, 'backbone', model)
+    encoder = getattr(model, 'encoder', model)
+    groups = []
+    if isinstance(backbone, HGNetv2):
+        groups.extend(_hgnetv2_groups(backbone, encoder if isinstance(encoder, HybridEncoder) else None))
+    if isinstance(encoder, HybridEncoder):
+        groups.extend(_encoder_groups(encoder))
+    return groups
+
+
+def _sync_attrs(model: nn.Module):
+    # attributes used by convert_to_deploy
+    for m in model.modules():
+        name = type(m).__name__
+        if name == 'ConvNormLayer_fuse' and hasattr(m, 'conv'):
+            m.ch_in, m.ch_out = m.conv.in_channels, m.conv.out_channels
+        elif name == 'VGGBlock' and hasattr(m, 'conv1'):
+            m.ch_in, m.ch_out = m.conv1.conv.in_channels, m.conv1.conv.out_channels
+
+
+def bn_importance(group: ChannelGroup) -> torch.Tensor:
+    return sum(bn.weight.detach().abs() for bn in group.bns())
+
+
+@torch.no_grad()
+def _taylor_scores(bns: List[nn.BatchNorm2d]):
+    return {bn: (bn.weight * bn.weight.grad + bn.bias * bn.bias.grad).abs() for bn in bns}
+
+
+def taylor_importance(model: nn.Module, criterion: nn.Module, batches, device, groups: List[ChannelGroup]) -> Dict[str, torch.Tensor]:
+    """First-order Taylor importance |gamma * dL/dgamma + beta * dL/dbeta| of the BNs in each group,
+    accumulated over `batches` of (samples, targets).
+    """
+    bns = list({bn for g in groups for bn in g.bns()})
+    scores = {bn: torch.zeros_like(bn.weight) for bn in bns}
+    model.train()
+    for i, (samples, targets) in enumerate(batches):
+        samples = samples.to(device)
+        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+        model.zero_grad()
+        outputs = model(samples, targets=targets)
+        loss = sum(criterion(outputs, targets, epoch=0, step=i, global_step=i).values())
+        loss.backward()
+        for bn, s in _taylor_scores(bns).items():
+            scores[bn] += s
+    model.zero_grad()
+    return {g.name: sum(scores[bn] for bn in g.bns()) for g in groups}
+
+
+def _num_keep(size, ratio, round_to):
+    n = int(round(size * (1 - ratio) / round_to)) * round_to
+    return min(size, max(round_to, n))
+
+
+def prune_model(model: nn.Module, ratio: float, importance: Dict[str, torch.Tensor]=None, round_to: int=8,
+                groups: List[ChannelGroup]=None) -> Dict[str, int]:
+    """Remove `ratio` of the channels of every group (rounded to `round_to`), lowest importance first.
+    `importance` defaults to BN gamma. Returns the pruning spec {group name: kept channels}.
+    """
+    groups = build_groups(model) if groups is None else groups
+    spec = OrderedDict()
+    for g in groups:
+        score = importance[g.name] if importance is not None else bn_importance(g)
+        n = _num_keep(g.size, ratio, round_to)
+        if n < g.size:
+            g.prune(score.topk(n).indices.cpu())
+        spec[g.name] = g.size
+    _sync_attrs(model)
+    return spec
+
+
+def apply_pruning_spec(model: nn.Module, spec: Union[str, Dict[str, int]]):
+    """Shrink a freshly built model to the shapes of a pruned checkpoint, weights are loaded afterwards.
+    """
+    spec = load_pruning_spec(spec)
+    groups = {g.name: g for g in build_groups(model)}
+    for name, n in spec.items():
+        assert name in groups, f'unknown pruning group {name}'
+        if n < groups[name].size:
+            groups[name].prune(torch.arange(n))
+    _sync_attrs(model)
+    return model
+
+
+def load_pruning_spec(spec: Union[str, Dict[str, int]]) -> Dict[str, int]:
+    """`spec`: json file written by tools/deployment/prune_model.py, or the dict itself.
+    """
+    if isinstance(spec, str):
+        with open(spec, 'r') as f:
+            spec = json.load(f)
+    return spec
@@ -0,0 +1,134 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+"""
+
+import re
+from typing import List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.ao.quantization as tq
+
+from .fuse_utils import fold_bn
+
+
+__all__ = ['prepare_qat', ]
+
+
+class _FakeQuantMixin(object):
+    """Fake-quantize the input activation and the weight, the same tensors ONNX Runtime
+    quantizes in QDQ format, so the exported graph runs with int8 Conv / Gemm / MatMul kernels.
+    """
+    def _init_fake_quant(self, qconfig):
+        self.act_fake_quant = qconfig.activation()
+        self.weight_fake_quant = qconfig.weight()
+
+    def train(self, mode: bool=True):
+        # observers are frozen outside training, validation data must not move the ranges
+        super().train(mode)
+        for fq in (self.act_fake_quant, self.weight_fake_quant):
+            fq.enable_observer(mode)
+        return self
+
+
+class QATConv2d(_FakeQuantMixin, nn.Conv2d):
+    @classmethod
+    def from_float(cls, mod: nn.Conv2d, qconfig):
+        qat = cls(mod.in_channels, mod.out_channels, mod.kernel_size, mod.stride, mod.padding, mod.dilation,
+                  mod.groups, mod.bias is not None, mod.padding_mode, device=mod.weight.device, dtype=mod.weight.dtype)
+        # share parameters, state_dict keys stay the same
+        qat.weight, qat.bias = mod.weight, mod.bias
+        qat._init_fake_quant(qconfig)
+        return qat.train(mod.training)
+
+    def forward(self, x):
+        return self._conv_forward(self.act_fake_quant(x), self.weight_fake_quant(self.weight), self.bias)
+
+
+class QATLinear(_FakeQuantMixin, nn.Linear):
+    @classmethod
+    def from_float(cls, mod: nn.Linear, qconfig):
+        qat = cls(mod.in_features, mod.out_features, mod.bias is not None, device=mod.weight.device, dtype=mod.weight.dtype)
+        qat.weight, qat.bias = mod.weight, mod.bias
+        qat._init_fake_quant(qconfig)
+        return qat.train(mod.training)
+
+    def forward(self, x):
+        return F.linear(self.act_fake_quant(x), self.weight_fake_quant(self.weight), self.bias)
+
+
+# modules whose forward is `act(bn(conv(x)))`, (conv attribute, bn attribute)
+_CONV_BN_PAIRS = {
+    'ConvBNAct': ('conv', 'bn'),
+    'ConvNormLayer': ('conv', 'norm'),
+    'ConvNormLayer_fuse': ('conv', 'norm'),
+}
+
+
+def fuse_conv_bn(model: nn.Module):
+    """Fold BatchNorm into the preceding conv of the known conv-bn blocks (BN is frozen afterwards).
+    """
+    for m in model.modules():
+        pair = _CONV_BN_PAIRS.get(type(m).__name__, None)
+        if pair is None or not hasattr(m, pair[0]) or not isinstance(getattr(m, pair[1], None), nn.BatchNorm2d):
+            continue
+        conv = getattr(m, pair[0])
+        # `padding='same'` in ConvBNAct wraps the conv in Sequential(ZeroPad2d, Conv2d)
+        conv = conv[-1] if isinstance(conv, nn.Sequential) else conv
+        fold_bn(conv, getattr(m, pair[1]))
+        setattr(m, pair[1], nn.Identity())
+    return model
+
+
+def fuse_rep_branches(model: nn.Module):
+    """Re-parameterise multi-branch blocks (VGGBlock, DBB variants, ...) into single convs.
+    Must run before conv-bn folding and fake-quant insertion, the branches are quantized as one conv.
+    """
+    for m in model.modules():
+        if hasattr(m, 'convert_to_deploy') and not getattr(m, 'deployed', False):
+            m.convert_to_deploy()
+            m.deployed = True
+    return model
+
+
+def insert_fake_quant(model: nn.Module, skip: List[str], backend: str='x86', prefix: str=''):
+    """Swap nn.Conv2d / nn.Linear for fake-quant versions, except modules whose name matches `skip`.
+    """
+    # version 0 is FakeQuantize + MovingAverage observers, which export as QuantizeLinear / DequantizeLinear,
+    # the fused FusedMovingAvgObsFakeQuantize of the default version has no ONNX symbolic
+    qconfig = tq.get_default_qat_qconfig(backend, version=0)
+    # x86 activations use reduce_range (0..127), exported as uint8 QuantizeLinear they would clip at 255
+    # instead, train on the full 0..255 range that ONNX Runtime runs
+    qconfig = tq.QConfig(activation=tq.FakeQuantize.with_args(observer=tq.MovingAverageMinMaxObserver,
+                                                               quant_min=0, quant_max=255, dtype=torch.quint8,
+                                                               qscheme=torch.per_tensor_affine, reduce_range=False),
+                         weight=qconfig.weight)
+    regex = [re.compile(p) for p in skip]
+    for name, child in model.named_children():
+        full_name = f'{prefix}.{name}' if prefix else name
+        if any(r.search(full_name) for r in regex):
+            continue
+        if type(child) is nn.Conv2d:
+            setattr(model, name, QATConv2d.from_float(child, qconfig))
+        elif type(child) is nn.Linear:
+            setattr(model, name, QATLinear.from_float(child, qconfig))
+        else:
+            insert_fake_quant(child, skip, backend, full_name)
+    return model
+
+
+def prepare_qat(model: nn.Module, skip: List[str]=None, backend: str='x86'):
+    """Prepare DEIM for quantization-aware training, in place:
+        1. fuse re-parameterisable branches of backbone and encoder
+        2. fold conv-bn
+        3. insert fake-quant on conv / linear inputs and weights
+
+    The decoder keeps its training structure (aux heads, denoising), only its linears are quantized.
+    """
+    for part in (model.backbone, model.encoder):
+        fuse_rep_branches(part)
+        fuse_conv_bn(part)
+    insert_fake_quant(model, skip or [], backend)
+    return model
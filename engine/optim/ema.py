@@ -64,6 +64,9 @@ class ModelEMA(object):
                 if v.dtype.is_floating_point:
                     v *= d
                     v += (1 - d) * msd[k].detach()
+                else:
+                    # integer buffers, e.g. fake-quant zero points, follow the live model
+                    v.copy_(msd[k])
 
     def to(self, *args, **kwargs):
         self.module = self.module.to(*args, **kwargs)
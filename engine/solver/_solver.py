@@ -7,6 +7,10 @@ from typing import Dict
 import atexit
 
 from ..misc import dist_utils
+from ..misc.checkpoint import AsyncCheckpointWriter
+from ..misc.qat import prepare_qat
+from ..misc.prune_utils import apply_pruning_spec
+from .distill import Distiller, load_teacher
 from ..core import BaseConfig
 
 
@@ -46,21 +50,47 @@ class BaseSolver(object):
 
         self.model = cfg.model
 
+        # NOTE: shrink to the pruned shapes before any checkpoint is loaded
+        if cfg.prune_spec:
+            print(f'Apply pruning spec {cfg.prune_spec}')
+            apply_pruning_spec(self.model, cfg.prune_spec)
+
         # NOTE: Must load_tuning_state before EMA instance building
         if self.cfg.tuning:
             print(f'Tuning checkpoint from {self.cfg.tuning}')
             self.load_tuning_state(self.cfg.tuning)
 
+        # NOTE: fuse and insert fake-quant after loading float weights, before EMA / optimizer building
+        if cfg.qat:
+            print(f'Prepare model for quantization-aware training, skip {cfg.qat_skip}')
+            prepare_qat(self.model, skip=cfg.qat_skip)
+
+        # NOTE: NHWC weights before EMA deep-copies the model, inputs are converted in `DEIM.forward`
+        if cfg.channels_last:
+            print('Convert model to channels_last')
+            self.model.to_channels_last()
+
         self.model = dist_utils.warp_model(
             self.model.to(device), sync_bn=cfg.sync_bn, find_unused_parameters=cfg.find_unused_parameters
         )
 
         self.criterion = self.to(cfg.criterion, device)
+
+        # NOTE: hooks go on the eager student, before compile
+        if cfg.distill:
+            self.criterion = self.build_distiller(cfg.distill, device)
         self.postprocessor = self.to(cfg.postprocessor, device)
 
         self.ema = self.to(cfg.ema, device)
         self.scaler = cfg.scaler
 
+        # NOTE: compile after EMA instance building, EMA deep-copies the eager model
+        if cfg.compile:
+            print(f'Compile model with mode={cfg.compile_mode}')
+            self.model = dist_utils.compile_model(self.model, mode=cfg.compile_mode)
+            if self.ema is not None:
+                self.ema.module = dist_utils.compile_model(self.ema.module, mode=cfg.compile_mode)
+
         self.device = device
         self.last_epoch = self.cfg.last_epoch
 
@@ -68,11 +98,30 @@ class BaseSolver(object):
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.writer = cfg.writer
 
+        self.checkpoint_writer = AsyncCheckpointWriter(enabled=cfg.async_checkpoint)
+        atexit.register(self.checkpoint_writer.close)
+
         if self.writer:
             atexit.register(self.writer.close)
             if dist_utils.is_main_process():
                 self.writer.add_text('config', '{:s}'.format(cfg.__repr__()), 0)
 
+    def build_distiller(self, distill: dict, device):
+        """`distill` config: teacher_config / teacher_resume of the teacher model, or neither to read
+        cached teacher outputs from the targets; optional weight_dict and iou_thrh.
+        """
+        teacher = None
+        if distill.get('teacher_resume', None):
+            print(f'Distill from teacher {distill["teacher_resume"]}')
+            teacher = load_teacher(distill['teacher_config'], distill['teacher_resume']).to(device)
+        else:
+            print('Distill from cached teacher outputs')
+        distiller = Distiller(self.criterion, dist_utils.de_parallel(self.model), teacher,
+                              weight_dict=distill.get('weight_dict', None), iou_thrh=distill.get('iou_thrh', 0.5))
+        distiller = distiller.to(device)
+        distiller.broadcast_adapters()
+        return distiller
+
     def cleanup(self):
         if self.writer:
             atexit.register(self.writer.close)
@@ -80,6 +129,9 @@ class BaseSolver(object):
     def train(self):
         self._setup()
         self.optimizer = self.cfg.optimizer
+        # feature adapters of distillation train with the default optimizer settings, before lr schedulers record groups
+        if isinstance(self.criterion, Distiller) and hasattr(self.criterion, 'adapters'):
+            self.optimizer.add_param_group({'params': list(self.criterion.adapters.parameters())})
         self.lr_scheduler = self.cfg.lr_scheduler
         self.lr_warmup_scheduler = self.cfg.lr_warmup_scheduler
 
@@ -151,8 +203,19 @@ class BaseSolver(object):
                 else:
                     print(f'Not load {k}.state_dict')
 
+    def save_checkpoint(self, path, tag=None):
+        """Save checkpoint without blocking training, see `AsyncCheckpointWriter`"""
+        self.checkpoint_writer.save(self.state_dict(), path, tag=tag)
+
     def load_resume_state(self, path: str):
         """Load resume"""
+        # make sure pending checkpoints (e.g. best_stg1.pth) are on disk, only rank 0 writes them,
+        # the other ranks must not read the file before its write finished
+        if getattr(self, 'checkpoint_writer', None) is not None:
+            self.checkpoint_writer.wait()
+        if dist_utils.is_dist_available_and_initialized():
+            torch.distributed.barrier()
+
         if path.startswith('http'):
             state = torch.hub.load_state_dict_from_url(path, map_location='cpu')
         else:
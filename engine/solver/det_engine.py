@@ -9,6 +9,8 @@ Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 
 import sys
 import math
+import time
+import contextlib
 from typing import Iterable
 
 import torch
@@ -21,6 +23,28 @@ from ..data import CocoEvaluator
 from ..misc import MetricLogger, SmoothedValue, dist_utils
 
 
+def save_nan_state(model: torch.nn.Module):
+    state = model.state_dict()
+    new_state = {}
+    for key, value in model.state_dict().items():
+        # Replace 'module' with 'model' in each key
+        new_key = key.replace('module.', '')
+        # Add the updated key-value pair to the state dictionary
+        state[new_key] = value
+    new_state['model'] = state
+    dist_utils.save_on_master(new_state, "./NaN.pth")
+
+
+def get_num_boxes(targets, device):
+    """average number of target boxes across all nodes, for loss normalization
+    """
+    num_boxes = sum(len(t["labels"]) for t in targets)
+    num_boxes = torch.as_tensor([num_boxes], dtype=torch.float, device=device)
+    if dist_utils.is_dist_available_and_initialized():
+        torch.distributed.all_reduce(num_boxes)
+    return torch.clamp(num_boxes / dist_utils.get_world_size(), min=1).item()
+
+
 def train_one_epoch(self_lr_scheduler, lr_scheduler, model: torch.nn.Module, criterion: torch.nn.Module,
                     data_loader: Iterable, optimizer: torch.optim.Optimizer,
                     device: torch.device, epoch: int, max_norm: float = 0, **kwargs):
@@ -37,35 +61,105 @@ def train_one_epoch(self_lr_scheduler, lr_scheduler, model: torch.nn.Module, cri
     scaler :GradScaler = kwargs.get('scaler', None)
     lr_warmup_scheduler :Warmup = kwargs.get('lr_warmup_scheduler', None)
 
+    # split each batch into `accumulate_steps` micro-batches and accumulate gradients
+    accumulate_steps = kwargs.get('accumulate_steps', 1)
+    # parameters of the criterion DDP does not reduce (distillation adapters), averaged before unscale / step
+    # so that every rank sees the same gradients and the same GradScaler found_inf
+    sync_criterion_grads = getattr(criterion, 'sync_adapter_grads', None) or (lambda: None)
+
+    # fast_step: keep NaN check, loss reduction and meters on device, sync every `print_freq` steps
+    fast_step = kwargs.get('fast_step', False)
+    nan_flag = torch.zeros((), dtype=torch.bool, device=device)
+    loss_sums, num_steps = {}, 0
+
     cur_iters = epoch * len(data_loader)
 
+    start_time = time.time()
     for i, (samples, targets) in enumerate(metric_logger.log_every(data_loader, print_freq, header)):
+        if i == 0:
+            # worker startup (fork, dataset pickling) when workers are not persistent
+            startup = time.time() - start_time
+            print(f'Epoch: [{epoch}] dataloader startup: {startup:.3f}s '
+                  f'(persistent_workers={getattr(data_loader, "persistent_workers", False)})')
+            if writer and dist_utils.is_main_process():
+                writer.add_scalar('Time/dataloader_startup', startup, epoch)
+
         samples = samples.to(device)
         targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
         global_step = epoch * len(data_loader) + i
         metas = dict(epoch=epoch, step=i, global_step=global_step, epoch_step=len(data_loader))
 
-        if scaler is not None:
+        if accumulate_steps > 1:
+            # normalize micro-batch losses by the number of boxes of the full batch,
+            # losses averaged within a batch (e.g. loss_ddf) by the number of micro-batches, which `chunk`
+            # makes smaller than accumulate_steps when the batch does not divide evenly
+            num_boxes = get_num_boxes(targets, device)
+            mean_losses = tuple(getattr(criterion, 'batch_mean_losses', ()))
+            micro_samples = samples.chunk(accumulate_steps, dim=0)
+            micro_size = micro_samples[0].shape[0]
+            optimizer.zero_grad()
+
+            loss_dict = {}
+            for j, micro in enumerate(micro_samples):
+                micro_targets = targets[j * micro_size: (j + 1) * micro_size]
+                # skip DDP gradient all-reduce until the last micro-batch
+                is_last = j == len(micro_samples) - 1
+                sync_context = contextlib.nullcontext() if is_last or not hasattr(model, 'no_sync') else model.no_sync()
+                with sync_context:
+                    with torch.autocast(device_type=str(device), cache_enabled=True, enabled=scaler is not None):
+                        outputs = model(micro, targets=micro_targets)
+
+                    if scaler is not None:
+                        if fast_step:
+                            nan_flag |= ~torch.isfinite(outputs['pred_boxes']).all()
+                        elif torch.isnan(outputs['pred_boxes']).any() or torch.isinf(outputs['pred_boxes']).any():
+                            print(outputs['pred_boxes'])
+                            save_nan_state(model)
+
+                    with torch.autocast(device_type=str(device), enabled=False):
+                        micro_loss_dict = criterion(outputs, micro_targets, num_boxes=num_boxes, **metas)
+                    micro_loss_dict = {k: v / len(micro_samples) if mean_losses and k.startswith(mean_losses) else v
+                                       for k, v in micro_loss_dict.items()}
+
+                    loss = sum(micro_loss_dict.values())
+                    if scaler is not None:
+                        scaler.scale(loss).backward()
+                    else:
+                        loss.backward()
+
+                for k, v in micro_loss_dict.items():
+                    loss_dict[k] = loss_dict[k] + v.detach() if k in loss_dict else v.detach()
+
+            sync_criterion_grads()
+            if scaler is not None:
+                if max_norm > 0:
+                    scaler.unscale_(optimizer)
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm)
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                if max_norm > 0:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm)
+                optimizer.step()
+            optimizer.zero_grad()
+
+        elif scaler is not None:
             with torch.autocast(device_type=str(device), cache_enabled=True):
                 outputs = model(samples, targets=targets)
 
-            if torch.isnan(outputs['pred_boxes']).any() or torch.isinf(outputs['pred_boxes']).any():
+            if fast_step:
+                # deferred check, read back on the next sync step
+                nan_flag |= ~torch.isfinite(outputs['pred_boxes']).all()
+            elif torch.isnan(outputs['pred_boxes']).any() or torch.isinf(outputs['pred_boxes']).any():
                 print(outputs['pred_boxes'])
-                state = model.state_dict()
-                new_state = {}
-                for key, value in model.state_dict().items():
-                    # Replace 'module' with 'model' in each key
-                    new_key = key.replace('module.', '')
-                    # Add the updated key-value pair to the state dictionary
-                    state[new_key] = value
-                new_state['model'] = state
-                dist_utils.save_on_master(new_state, "./NaN.pth")
+                save_nan_state(model)
 
             with torch.autocast(device_type=str(device), enabled=False):
                 loss_dict = criterion(outputs, targets, **metas)
 
             loss = sum(loss_dict.values())
             scaler.scale(loss).backward()
+            sync_criterion_grads()
 
             if max_norm > 0:
                 scaler.unscale_(optimizer)
@@ -82,6 +176,7 @@ def train_one_epoch(self_lr_scheduler, lr_scheduler, model: torch.nn.Module, cri
             loss : torch.Tensor = sum(loss_dict.values())
             optimizer.zero_grad()
             loss.backward()
+            sync_criterion_grads()
 
             if max_norm > 0:
                 torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm)
@@ -98,6 +193,39 @@ def train_one_epoch(self_lr_scheduler, lr_scheduler, model: torch.nn.Module, cri
             if lr_warmup_scheduler is not None:
                 lr_warmup_scheduler.step()
 
+        if fast_step:
+            for k, v in loss_dict.items():
+                loss_sums[k] = loss_sums[k] + v.detach() if k in loss_sums else v.detach()
+            num_steps += 1
+            metric_logger.update(lr=optimizer.param_groups[0]["lr"])
+
+            if not (i % print_freq == 0 or i == len(data_loader) - 1):
+                continue
+
+            if nan_flag.item():
+                print("NaN/Inf in pred_boxes within the last {} steps".format(num_steps))
+                save_nan_state(model)
+                nan_flag.zero_()
+
+            loss_dict_reduced = dist_utils.reduce_dict({k: v / num_steps for k, v in loss_sums.items()})
+            loss_value = sum(loss_dict_reduced.values())
+
+            if not math.isfinite(loss_value):
+                print("Loss is {}, stopping training".format(loss_value))
+                print(loss_dict_reduced)
+                sys.exit(1)
+
+            metric_logger.update_n(num_steps, loss=loss_value, **loss_dict_reduced)
+            loss_sums, num_steps = {}, 0
+
+            if writer and dist_utils.is_main_process():
+                writer.add_scalar('Loss/total', loss_value.item(), global_step)
+                for j, pg in enumerate(optimizer.param_groups):
+                    writer.add_scalar(f'Lr/pg_{j}', pg['lr'], global_step)
+                for k, v in loss_dict_reduced.items():
+                    writer.add_scalar(f'Loss/{k}', v.item(), global_step)
+            continue
+
         loss_dict_reduced = dist_utils.reduce_dict(loss_dict)
         loss_value = sum(loss_dict_reduced.values())
 
@@ -175,3 +303,37 @@ def evaluate(model: torch.nn.Module, criterion: torch.nn.Module, postprocessor,
             stats['coco_eval_masks'] = coco_evaluator.coco_eval['segm'].stats.tolist()
 
     return stats, coco_evaluator
+
+
+@torch.no_grad()
+def evaluate_sliced(sliced_model: torch.nn.Module, dataset, coco_evaluator: CocoEvaluator, device, batch_size: int=1):
+    """COCO eval of a `SlicedInference` model on the full resolution images of `dataset` (CocoDetection),
+    its resize transforms are bypassed.
+    """
+    import torchvision.transforms.functional as TF
+
+    sliced_model.eval()
+    coco_evaluator.cleanup()
+
+    metric_logger = MetricLogger(delimiter="  ")
+    header = 'Sliced test:'
+
+    indices = list(range(len(dataset)))
+    batches = [indices[i: i + batch_size] for i in range(0, len(indices), batch_size)]
+    for batch in metric_logger.log_every(batches, 10, header):
+        items = [dataset.load_item(idx) for idx in batch]
+        images = [TF.to_tensor(image).to(device) for image, _ in items]
+        results = sliced_model(images)
+
+        res = {int(target['image_id'].item()): output for (_, target), output in zip(items, results)}
+        coco_evaluator.update(res)
+
+    metric_logger.synchronize_between_processes()
+    coco_evaluator.synchronize_between_processes()
+    coco_evaluator.accumulate()
+    coco_evaluator.summarize()
+
+    stats = {}
+    if 'bbox' in coco_evaluator.iou_types:
+        stats['coco_eval_bbox'] = coco_evaluator.coco_eval['bbox'].stats.tolist()
+    return stats, coco_evaluator
@@ -0,0 +1,219 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Knowledge distillation from a frozen DEIM teacher, e.g. X -> N/S.
+
+`Distiller` wraps the criterion. A forward hook on the student runs the teacher (no grad) on the same
+batch, or the teacher outputs are read from the targets (`teacher_boxes`, `teacher_logits`,
+`teacher_corners`, cached offline). Teacher queries are aligned to student queries by box IoU, then
+    - teacher corners / logits are injected as `teacher_corners` / `teacher_logits` of the final layer,
+      `DEIMCriterion.loss_local` adds its DDF loss (`loss_ddf`) against them
+    - loss_kd_cls     soft-label BCE on the aligned queries
+    - loss_kd_feat    `feature_loss_function` between adapted student and teacher neck features
+
+The 1x1 feature adapters live in the criterion (saved with it as `criterion.adapters.*`) and are dropped after
+training. DDP only covers the model: the adapters are broadcast from rank 0 once and their gradients are averaged
+over ranks right before each optimizer step (`sync_adapter_grads`).
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from ..deim.box_ops import box_cxcywh_to_xyxy
+from ..misc import dist_utils
+
+
+__all__ = ['Distiller', 'load_teacher', ]
+
+
+def load_teacher(config: str, resume: str) -> nn.Module:
+    """Frozen eval-mode DEIM built from its own config and checkpoint.
+    """
+    from ..core import YAMLConfig
+
+    cfg = YAMLConfig(config)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    checkpoint = torch.load(resume, map_location='cpu')
+    state = checkpoint['ema']['module'] if 'ema' in checkpoint else checkpoint['model']
+    teacher = cfg.model
+    teacher.load_state_dict(state)
+    teacher.eval()
+    for p in teacher.parameters():
+        p.requires_grad_(False)
+    return teacher
+
+
+def _pairwise_iou(boxes1, boxes2):
+    """Batched IoU, cxcywh [B, N, 4] x [B, M, 4] -> [B, N, M].
+    """
+    boxes1, boxes2 = box_cxcywh_to_xyxy(boxes1), box_cxcywh_to_xyxy(boxes2)
+    lt = torch.max(boxes1[:, :, None, :2], boxes2[:, None, :, :2])
+    rb = torch.min(boxes1[:, :, None, 2:], boxes2[:, None, :, 2:])
+    inter = (rb - lt).clamp(min=0).prod(-1)
+    area1 = (boxes1[..., 2:] - boxes1[..., :2]).prod(-1)
+    area2 = (boxes2[..., 2:] - boxes2[..., :2]).prod(-1)
+    return inter / (area1[:, :, None] + area2[:, None, :] - inter).clamp(min=1e-6)
+
+
+class Distiller(nn.Module):
+    def __init__(self,
+                 criterion: nn.Module,
+                 student: nn.Module,
+                 teacher: nn.Module=None,
+                 weight_dict: dict=None,
+                 iou_thrh: float=0.5,
+                 ):
+        """
+        Args:
+            criterion: the student criterion (DEIMCriterion)
+            student: the student model, hooks are registered on it (not wrapped, checkpoints are unchanged)
+            teacher: frozen teacher from `load_teacher`, None to read cached outputs from the targets
+            weight_dict: weights of `loss_kd_cls` and `loss_kd_feat`
+            iou_thrh: student queries aligned to a teacher query with a lower IoU are not distilled
+        """
+        super().__init__()
+        self.criterion = criterion
+        # not a submodule, the teacher stays out of state_dict / checkpoints / optimizer
+        self.__dict__['teacher'] = teacher
+        self.weight_dict = weight_dict if weight_dict is not None else {'loss_kd_cls': 1., 'loss_kd_feat': 1.}
+        self.iou_thrh = iou_thrh
+
+        if teacher is not None:
+            assert teacher.decoder.num_classes == student.decoder.num_classes, 'teacher and student classes differ'
+            s_dims, t_dims = student.encoder.out_channels, teacher.encoder.out_channels
+            self.adapters = nn.ModuleList([nn.Conv2d(s, t, 1) for s, t in zip(s_dims, t_dims)])
+            student.encoder.register_forward_hook(self._capture_feats)
+            student.register_forward_hook(self._run_teacher)
+        # corners are only comparable with the same number of bins, cached corners are checked on the first batch
+        self.num_corners = 4 * (student.decoder.reg_max + 1)
+        self.use_corners = teacher is None or teacher.decoder.reg_max == student.decoder.reg_max
+        self._student_feats, self._teacher_outputs = None, None
+
+    @torch.no_grad()
+    def broadcast_adapters(self, ):
+        """Same initial adapters on every rank.
+        """
+        if not hasattr(self, 'adapters') or not dist_utils.is_dist_available_and_initialized():
+            return
+        for p in self.adapters.parameters():
+            torch.distributed.broadcast(p.data, src=0)
+
+    @torch.no_grad()
+    def sync_adapter_grads(self, ):
+        """Average the adapter gradients over ranks (DDP does not reduce them). Called by `train_one_epoch`
+        after backward and before `scaler.unscale_` / `scaler.step`, on every rank once per step, also when
+        its batch skipped `loss_kd_feat`, so GradScaler sees the same gradients everywhere.
+        """
+        if not hasattr(self, 'adapters') or not dist_utils.is_dist_available_and_initialized():
+            return
+        params = list(self.adapters.parameters())
+        grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in params]
+        flat = torch.cat([g.flatten() for g in grads])
+        torch.distributed.all_reduce(flat)
+        flat.div_(dist_utils.get_world_size())
+        for p, g in zip(params, flat.split([g.numel() for g in grads])):
+            p.grad = g.view_as(p).clone()
+
+    def load_state_dict(self, state_dict, strict: bool=True):
+        # a checkpoint of a run without distillation has no adapters
+        missing = [k for k in self.state_dict() if k not in state_dict]
+        if missing:
+            print(f'Distiller: {missing} not in the checkpoint, they keep their initialization')
+        return super().load_state_dict(state_dict, strict=False)
+
+    @property
+    def batch_mean_losses(self):
+        # kd losses are averaged over the aligned queries / feature maps of the batch
+        return tuple(getattr(self.criterion, 'batch_mean_losses', ())) + ('loss_kd_cls', 'loss_kd_feat')
+
+    def _capture_feats(self, module, inputs, outputs):
+        if module.training:
+            self._student_feats = outputs
+
+    @torch.no_grad()
+    def _run_teacher(self, module, inputs, outputs):
+        if not module.training:
+            return
+        teacher = self.teacher
+        feats = teacher.encoder(teacher.backbone(inputs[0]))
+        out = teacher.decoder(feats)
+        out['feats'] = feats
+        self._teacher_outputs = out
+
+    def _cached_outputs(self, targets):
+        """Pad per-image cached teacher entries into batched tensors, `valid` marks real entries.
+        """
+        if not all('teacher_boxes' in t for t in targets):
+            return None
+        width = targets[0]['teacher_corners'].shape[-1]
+        if self.use_corners and width != self.num_corners:
+            print(f'Distiller: cached teacher corners have {width} bins, the student {self.num_corners} '
+                  '(reg_max of the cache differs), corners are not distilled')
+            self.use_corners = False
+        num = max(len(t['teacher_boxes']) for t in targets)
+        if num == 0:
+            return None
+        out = {}
+        for k, name in (('pred_boxes', 'teacher_boxes'), ('pred_logits', 'teacher_logits'),
+                        ('pred_corners', 'teacher_corners')):
+            v = targets[0][name]
+            out[k] = v.new_zeros((len(targets), num, v.shape[-1]))
+            for i, t in enumerate(targets):
+                out[k][i, :len(t[name])] = t[name]
+        out['valid'] = torch.stack([torch.arange(num, device=out['pred_boxes'].device) < len(t['teacher_boxes'])
+                                    for t in targets])
+        return out
+
+    @torch.no_grad()
+    def _align(self, outputs, teacher):
+        iou = _pairwise_iou(outputs['pred_boxes'].float(), teacher['pred_boxes'].float())
+        if 'valid' in teacher:
+            iou = iou.masked_fill(~teacher['valid'][:, None, :], -1)
+        best_iou, idx = iou.max(-1)
+        matched = best_iou >= self.iou_thrh
+
+        def gather(x):
+            return x.gather(1, idx.unsqueeze(-1).expand(-1, -1, x.shape[-1]))
+
+        logits = gather(teacher['pred_logits'])
+        # unaligned queries: zero DDF weight and no corner divergence
+        logits = logits.masked_fill(~matched.unsqueeze(-1), -1e4)
+        corners = None
+        if self.use_corners:
+            corners = gather(teacher['pred_corners']).to(outputs['pred_corners'].dtype)
+            corners = torch.where(matched.unsqueeze(-1), corners, outputs['pred_corners'].detach())
+        return logits, corners, matched
+
+    def forward(self, outputs, targets, **kwargs):
+        teacher = self._teacher_outputs if self.teacher is not None else self._cached_outputs(targets)
+        self._teacher_outputs = None
+        if teacher is None:
+            return self.criterion(outputs, targets, **kwargs)
+
+        logits, corners, matched = self._align(outputs, teacher)
+        if self.use_corners:
+            outputs['teacher_corners'], outputs['teacher_logits'] = corners, logits
+
+        losses = self.criterion(outputs, targets, **kwargs)
+
+        if 'loss_kd_cls' in self.weight_dict:
+            src = outputs['pred_logits'][matched].float()
+            tgt = logits[matched].float().sigmoid()
+            loss = F.binary_cross_entropy_with_logits(src, tgt, reduction='sum') / matched.sum().clamp(min=1)
+            losses['loss_kd_cls'] = loss * self.weight_dict['loss_kd_cls']
+
+        if 'loss_kd_feat' in self.weight_dict and 'feats' in teacher and self._student_feats is not None:
+            loss = 0
+            for adapter, s, t in zip(self.adapters, self._student_feats, teacher['feats']):
+                s = adapter(s.float())
+                if s.shape[-2:] != t.shape[-2:]:
+                    s = F.interpolate(s, size=t.shape[-2:], mode='bilinear', align_corners=False)
+                loss = loss + self.criterion.feature_loss_function(s, t.float()).mean()
+            losses['loss_kd_feat'] = loss * self.weight_dict['loss_kd_feat']
+        self._student_feats = None
+
+        return losses
@@ -0,0 +1,76 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+CPU throughput of deploy-mode DEIM in NCHW vs channels_last (`DEIM.to_channels_last`), per HGNetv2 size.
+oneDNN runs NHWC convolutions without the reorders NCHW needs.
+
+    python tools/benchmark/channels_last_benchmark.py --threads 8 --batch-size 1
+    python tools/benchmark/channels_last_benchmark.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import copy
+import time
+import argparse
+
+import torch
+
+from engine.core import YAMLConfig
+
+
+CONFIGS = [f'configs/deim_dfine/deim_hgnetv2_{s}_coco.yml' for s in ('n', 's', 'm', 'l', 'x')]
+
+
+@torch.no_grad()
+def throughput(model, inputs, iters, warmup):
+    for _ in range(warmup):
+        model(inputs)
+    start = time.perf_counter()
+    for _ in range(iters):
+        model(inputs)
+    return iters * inputs.shape[0] / (time.perf_counter() - start)
+
+
+@torch.no_grad()
+def run(config, args):
+    cfg = YAMLConfig(config)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+    size = cfg.yaml_cfg.get('eval_spatial_size', [640, 640])
+    inputs = torch.rand(args.batch_size, 3, *size)
+
+    nchw = cfg.model.deploy()
+    nhwc = copy.deepcopy(nchw).to_channels_last()
+    diff = max((a - b).abs().max().item() for a, b in zip(nchw(inputs).values(), nhwc(inputs).values()))
+    return throughput(nchw, inputs, args.iters, args.warmup), throughput(nhwc, inputs, args.iters, args.warmup), diff
+
+
+def main(args, ):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    print(f'batch_size={args.batch_size} threads={torch.get_num_threads()} mkldnn={torch.backends.mkldnn.is_available()}')
+
+    results = {}
+    for config in args.config or CONFIGS:
+        results[config] = run(config, args)
+
+    print('-' * 96)
+    print('{:<52}{:>12}{:>12}{:>10}{:>10}'.format('config', 'NCHW img/s', 'NHWC img/s', 'speedup', 'max diff'))
+    for config, (nchw, nhwc, diff) in results.items():
+        print('{:<52}{:>12.2f}{:>12.2f}{:>9.2f}x{:>10.1e}'.format(os.path.basename(config), nchw, nhwc, nhwc / nchw, diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, nargs='+', default=None, help='default: HGNetv2 N/S/M/L/X')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
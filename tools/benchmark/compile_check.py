@@ -0,0 +1,82 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Check that the compiled training path (`DEIM.compile_modules`) matches eager losses, runs on CPU.
+
+    python tools/benchmark/compile_check.py -c configs/deim_dfine/deim_hgnetv2_n_coco.yml
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import copy
+import argparse
+
+import torch
+
+from engine.core import YAMLConfig
+from engine.misc import dist_utils
+from train_step_benchmark import synthetic_batches
+
+
+def compute_losses(model, criterion, samples, targets, seed):
+    # same seed for the same denoising noise
+    torch.manual_seed(seed)
+    outputs = model(samples, targets=targets)
+    loss_dict = criterion(outputs, targets, epoch=0, step=0, global_step=0, epoch_step=1)
+    sum(loss_dict.values()).backward()
+    return {k: v.detach() for k, v in loss_dict.items()}
+
+
+def main(args, ):
+    update = {'DFINETransformer': {'denoising_max_gt_num': args.max_gt_num}}
+    cfg = YAMLConfig(args.config, **update)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    device = torch.device(args.device)
+    eager = cfg.model.to(device).train()
+    compiled = copy.deepcopy(eager)
+    dist_utils.compile_model(compiled, mode=args.compile_mode)
+    criterion = cfg.criterion.to(device).train()
+
+    num_classes = cfg.yaml_cfg.get('num_classes', 80)
+    batches = synthetic_batches(args.steps, args.batch_size, args.size, num_classes)
+
+    max_diff, passed = 0., True
+    for i, (samples, targets) in enumerate(batches):
+        samples = samples.to(device)
+        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+
+        eager_losses = compute_losses(eager, criterion, samples, targets, seed=i)
+        compiled_losses = compute_losses(compiled, criterion, samples, targets, seed=i)
+
+        assert eager_losses.keys() == compiled_losses.keys(), 'loss keys mismatch'
+        for k in eager_losses:
+            diff = (eager_losses[k] - compiled_losses[k]).abs().max().item()
+            max_diff = max(max_diff, diff)
+            if not torch.allclose(eager_losses[k], compiled_losses[k], rtol=args.rtol, atol=args.atol):
+                print(f'step {i}: {k} eager={eager_losses[k].item():.6f} compiled={compiled_losses[k].item():.6f}')
+                passed = False
+
+    print(f'max abs diff: {max_diff:.3e}')
+    print('PASSED' if passed else 'FAILED')
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--compile-mode', type=str, default='default')
+    parser.add_argument('--max-gt-num', type=int, default=20)
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--size', type=int, default=320)
+    parser.add_argument('--rtol', type=float, default=1e-3)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    main(args)
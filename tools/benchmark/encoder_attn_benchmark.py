@@ -0,0 +1,101 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Latency of one HybridEncoder (AIFI) layer on the stride-32 feature map per `encoder_attn` option,
+over a sweep of input resolutions, and the resolution from which each option beats `mha`.
+
+    python tools/benchmark/encoder_attn_benchmark.py -d cuda
+    python tools/benchmark/encoder_attn_benchmark.py --attn mha linear window --sizes 640 1280 1920 2560
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import time
+import argparse
+
+import torch
+
+from engine.deim.hybrid_encoder import TransformerEncoderLayer, HybridEncoder
+
+
+ATTN = {
+    'mha': None,
+    'linear': {'type': 'linear'},
+    'window': {'type': 'window', 'window_size': 10},
+    'biformer': {'type': 'biformer', 'n_win': 5, 'topk': 4},
+    'cascaded': {'type': 'cascaded'},
+}
+
+
+@torch.no_grad()
+def latency(layer, src, pos_embed, spatial_shape, iters, warmup):
+    times = []
+    for i in range(warmup + iters):
+        if src.is_cuda:
+            torch.cuda.synchronize()
+        t = time.perf_counter()
+        layer(src, pos_embed=pos_embed, spatial_shape=spatial_shape)
+        if src.is_cuda:
+            torch.cuda.synchronize()
+        if i >= warmup:
+            times.append(time.perf_counter() - t)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+def main(args, ):
+    device = torch.device(args.device)
+    layers = {}
+    for name in args.attn:
+        layer = TransformerEncoderLayer(args.hidden_dim, args.nhead, args.dim_feedforward, activation='gelu',
+                                        attn=ATTN[name])
+        layers[name] = layer.eval().to(device)
+
+    results = {name: [] for name in args.attn}
+    for size in args.sizes:
+        h = w = size // 32
+        src = torch.rand(args.batch_size, h * w, args.hidden_dim, device=device)
+        pos_embed = HybridEncoder.build_2d_sincos_position_embedding(w, h, args.hidden_dim).to(device)
+        for name, layer in layers.items():
+            try:
+                results[name].append(latency(layer, src, pos_embed, (h, w), args.iters, args.warmup))
+            except RuntimeError as e:
+                # out of memory, or a block that does not take this grid size
+                print(f'{name} @ {size}: {str(e).splitlines()[0]}')
+                results[name].append(float('nan'))
+
+    print(f'{"size":>6} {"tokens":>7} ' + ' '.join(f'{name:>10}' for name in args.attn) + '   (ms)')
+    for i, size in enumerate(args.sizes):
+        print(f'{size:>6} {(size // 32) ** 2:>7} ' + ' '.join(f'{results[name][i]:>10.2f}' for name in args.attn))
+
+    if 'mha' not in results:
+        return
+    for name in args.attn:
+        if name == 'mha':
+            continue
+        # first resolution from which the option is faster than mha at every larger size
+        crossover = None
+        for i in reversed(range(len(args.sizes))):
+            if not results[name][i] < results['mha'][i]:
+                break
+            crossover = args.sizes[i]
+        print(f'{name}: ' + (f'faster than mha from {crossover}' if crossover else 'not faster than mha in the sweep'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--attn', type=str, nargs='+', default=['mha', 'linear', 'window'], choices=list(ATTN))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[320, 640, 960, 1280, 1600, 1920])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--hidden-dim', type=int, default=256)
+    parser.add_argument('--nhead', type=int, default=8)
+    parser.add_argument('--dim-feedforward', type=int, default=1024)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,76 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Check the conv-bn fusion pass of `DEIM.deploy` (engine/misc/fuse_utils.py): number of fused convs,
+output difference against the re-parameterized but unfused model, and latency before / after.
+
+    python tools/benchmark/fuse_benchmark.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml -r best_stg2.pth
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import copy
+import argparse
+
+import torch
+
+from engine.core import YAMLConfig
+from engine.misc.fuse_utils import fuse_model, verify_fused
+from engine.backbone.common import FrozenBatchNorm2d
+
+
+def main(args, ):
+    cfg = YAMLConfig(args.config, resume=args.resume)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    model = cfg.model
+    if args.resume:
+        checkpoint = torch.load(args.resume, map_location='cpu')
+        state = checkpoint['ema']['module'] if 'ema' in checkpoint else checkpoint['model']
+        model.load_state_dict(state)
+    else:
+        # random BN statistics, so the fold is not an identity
+        for m in model.modules():
+            if isinstance(m, (torch.nn.BatchNorm2d, FrozenBatchNorm2d)):
+                m.running_mean.uniform_(-0.5, 0.5)
+                m.running_var.uniform_(0.5, 2.)
+
+    device = torch.device(args.device)
+    reference = model.deploy(fuse=False).to(device)
+    fused = copy.deepcopy(reference)
+    num_fused = fuse_model(fused)
+    num_bn = sum(isinstance(m, torch.nn.BatchNorm2d) for m in reference.modules())
+    num_left = sum(isinstance(m, torch.nn.BatchNorm2d) for m in fused.modules())
+    num_frozen = sum(isinstance(m, FrozenBatchNorm2d) for m in reference.modules())
+    num_frozen_left = sum(isinstance(m, FrozenBatchNorm2d) for m in fused.modules())
+
+    size = cfg.yaml_cfg.get('eval_spatial_size', [640, 640])
+    inputs = torch.rand(args.batch_size, 3, *size, device=device)
+    report = verify_fused(reference, fused, inputs, atol=args.atol, rtol=args.rtol, iters=args.iters)
+
+    print(f'fused convs: {num_fused}, BatchNorm2d {num_bn} -> {num_left}, '
+          f'FrozenBatchNorm2d {num_frozen} -> {num_frozen_left}')
+    print(f'max abs diff: {report["max_abs_diff"]:.3e} (atol {args.atol}, rtol {args.rtol}) '
+          f'{"passed" if report["passed"] else "FAILED"}')
+    print(f'latency: {report["latency_before"]:.2f} ms -> {report["latency_after"]:.2f} ms '
+          f'({report["latency_before"] / report["latency_after"]:.2f}x)')
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-r', '--resume', type=str, default=None)
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--atol', type=float, default=1e-3)
+    parser.add_argument('--rtol', type=float, default=1e-3)
+    args = parser.parse_args()
+
+    main(args)
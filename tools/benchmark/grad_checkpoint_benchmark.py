@@ -0,0 +1,110 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Peak memory and throughput of the activation checkpointing policies
+(`HGNetv2 / PResNet.checkpoint_stages`, `HybridEncoder / HybridEncoder_CGFM.checkpoint_modules`,
+`DFINETransformer / RTDETRTransformerv2.checkpoint_layers`), the options of modules the config
+does not use are ignored.
+
+    python tools/benchmark/grad_checkpoint_benchmark.py -c configs/deim_dfine/deim_hgnetv2_x_coco.yml --batch-size 8
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import argparse
+
+import torch
+
+from engine.core import YAMLConfig
+from engine.misc import dist_utils
+from train_step_benchmark import synthetic_batches
+
+
+BACKBONE = {
+    'HGNetv2': {'checkpoint_stages': True},
+    'PResNet': {'checkpoint_stages': True},
+}
+ENCODER = {
+    'HybridEncoder': {'checkpoint_modules': True},
+    'HybridEncoder_CGFM': {'checkpoint_modules': True},
+}
+DECODER = {
+    'DFINETransformer': {'checkpoint_layers': True},
+    'RTDETRTransformerv2': {'checkpoint_layers': True},
+}
+
+POLICIES = {
+    'none': {},
+    'backbone': dict(BACKBONE),
+    'backbone+encoder': dict(BACKBONE, **ENCODER),
+    'all': dict(BACKBONE, **ENCODER, **DECODER),
+}
+
+
+def run(args, policy, device):
+    torch.manual_seed(0)
+    cfg = YAMLConfig(args.config, **policy)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    model = cfg.model.to(device).train()
+    criterion = cfg.criterion.to(device).train()
+    optimizer = cfg.optimizer
+
+    num_classes = cfg.yaml_cfg.get('num_classes', 80)
+    batches = synthetic_batches(args.steps + 2, args.batch_size, args.size, num_classes)
+
+    def step(samples, targets):
+        samples = samples.to(device)
+        targets = [{k: v.to(device) for k, v in t.items()} for t in targets]
+        outputs = model(samples, targets=targets)
+        loss = sum(criterion(outputs, targets, epoch=0).values())
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    # warmup
+    for samples, targets in batches[:2]:
+        step(samples, targets)
+
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+    start = dist_utils.sync_time()
+    for samples, targets in batches[2:]:
+        step(samples, targets)
+    steps_per_sec = args.steps / (dist_utils.sync_time() - start)
+
+    peak_mem = torch.cuda.max_memory_allocated() / 1024 ** 2 if device.type == 'cuda' else float('nan')
+    del model, criterion, optimizer
+    return peak_mem, steps_per_sec
+
+
+def main(args, ):
+    device = torch.device(args.device)
+    results = {}
+    for name in args.policies:
+        results[name] = run(args, POLICIES[name], device)
+
+    base_mem, base_speed = results[args.policies[0]]
+    print('-' * 70)
+    print('{:<20}{:>14}{:>12}{:>12}{:>12}'.format('policy', 'peak mem(MB)', 'mem ratio', 'steps/sec', 'speed ratio'))
+    for name, (mem, speed) in results.items():
+        print('{:<20}{:>14.1f}{:>12.3f}{:>12.3f}{:>12.3f}'.format(name, mem, mem / base_mem, speed, speed / base_speed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-d', '--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--policies', nargs='+', default=list(POLICIES.keys()), choices=list(POLICIES.keys()))
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--size', type=int, default=640)
+    args = parser.parse_args()
+
+    main(args)
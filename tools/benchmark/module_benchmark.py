@@ -0,0 +1,312 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Benchmark the drop-in blocks of engine/extre_module/custom_nn. Every block is built and called the
+way the `__main__` of its file does, with the channel / resolution variables of that `__main__`
+(`channel`, `in_channel`, `out_channel`, `height`, `width`, ...) replaced by `--channels` / `--size`,
+so all blocks are compared at the same setting. Reported per block: parameters, FLOPs (calflops),
+eager latency p50 / p99, latency p50 after `convert_to_deploy` (re-parameterized blocks), and the
+peak activation memory of one forward.
+
+    python tools/benchmark/module_benchmark.py --channels 64 --size 40 -o outputs/module_benchmark
+    python tools/benchmark/module_benchmark.py --filter 'conv_module/' --sort deploy
+    python tools/benchmark/module_benchmark.py --baseline outputs/module_benchmark/module_benchmark.json
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import re
+import ast
+import csv
+import copy
+import json
+import time
+import argparse
+import importlib
+import traceback
+
+import torch
+
+
+CUSTOM_NN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../engine/extre_module/custom_nn')
+
+# variables of the `__main__` blocks replaced by the standard setting
+CHANNEL_VARS = ('channel', 'in_channel', 'out_channel', 'channel_1', 'channel_2', 'ouc_channel')
+SIZE_VARS = ('height', 'width')
+BATCH_VARS = ('batch_size', 'bs')
+SKIP_VARS = ('RED', 'GREEN', 'BLUE', 'YELLOW', 'ORANGE', 'RESET', 'device')
+
+COLUMNS = ('params', 'gflops', 'latency_p50', 'latency_p99', 'deploy_p50', 'memory')
+SORT_KEYS = {'name': 'name', 'params': 'params', 'flops': 'gflops', 'latency': 'latency_p50',
+             'p99': 'latency_p99', 'deploy': 'deploy_p50', 'memory': 'memory'}
+
+
+def _assigned_names(stmt):
+    return [n.id for t in stmt.targets for n in ast.walk(t) if isinstance(n, ast.Name)]
+
+
+def _used_names(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def _module_class(call):
+    """`X(...).to(device)` -> X
+    """
+    while isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute):
+        call = call.func.value
+    if isinstance(call, ast.Call) and isinstance(call.func, ast.Name):
+        return call.func.id
+    return None
+
+
+def discover(root=CUSTOM_NN):
+    """Cases `(name, python module, setup statements, module statement, forward args)` from the
+    `module = X(...)` / `outputs = module(...)` pairs of each file's `__main__`.
+    """
+    package_root = os.path.abspath(os.path.join(root, '../../..'))
+    cases = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('__'))
+        for filename in sorted(filenames):
+            if not filename.endswith('.py') or filename.startswith('__'):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'r', encoding='utf-8') as f:
+                tree = ast.parse(f.read(), filename=path)
+            mains = [n for n in tree.body if isinstance(n, ast.If) and '__main__' in ast.unparse(n.test)]
+            if not mains:
+                continue
+
+            pymodule = os.path.relpath(path, package_root)[:-len('.py')].replace(os.sep, '.')
+            prefix = os.path.relpath(path, root)[:-len('.py')].replace(os.sep, '/')
+            setup, module_stmt = [], None
+            for stmt in mains[0].body:
+                if not isinstance(stmt, ast.Assign):
+                    continue
+                names = _assigned_names(stmt)
+                if names == ['module']:
+                    # `module = model_fuse_test(module)` is what the deploy measurement does
+                    if _module_class(stmt.value) not in (None, 'model_fuse_test'):
+                        module_stmt = stmt
+                elif names == ['outputs']:
+                    if module_stmt is not None and isinstance(stmt.value, ast.Call) \
+                            and getattr(stmt.value.func, 'id', None) == 'module':
+                        args = ast.unparse(ast.Tuple(elts=stmt.value.args, ctx=ast.Load()))
+                        name = f'{prefix}:{_module_class(module_stmt.value)}'
+                        cases.append((name, pymodule, list(setup), ast.unparse(module_stmt), args))
+                    module_stmt = None
+                elif not set(names) & set(SKIP_VARS) \
+                        and not _used_names(stmt.value) & {'outputs', 'module', 'calculate_flops'}:
+                    setup.append(ast.unparse(stmt))
+    return cases
+
+
+def build(case, args, device):
+    """Run the setup of a case at the standard setting, return (module, forward inputs).
+    """
+    _, pymodule, setup, module_stmt, forward_args = case
+    overrides = {k: args.channels for k in CHANNEL_VARS}
+    overrides.update({k: args.size for k in SIZE_VARS})
+    overrides.update({k: args.batch_size for k in BATCH_VARS})
+
+    namespace = dict(vars(importlib.import_module(pymodule)))
+    namespace['device'] = device
+    for stmt in setup:
+        exec(stmt, namespace)
+        for k in _assigned_names(ast.parse(stmt).body[0]):
+            if k in overrides:
+                namespace[k] = overrides[k]
+
+    exec(module_stmt, namespace)
+    module = namespace['module'].to(device).eval()
+    inputs = eval(forward_args, namespace)
+    return module, inputs
+
+
+def convert_to_deploy(module):
+    """Same as `torch_utils.model_fuse_test` without the prints, None if nothing is re-parameterized.
+    """
+    module = copy.deepcopy(module).eval()
+    converted = False
+    for m in module.modules():
+        if hasattr(m, 'convert_to_deploy'):
+            m.convert_to_deploy()
+            converted = True
+    return module if converted else None
+
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+@torch.no_grad()
+def latency(module, inputs, device, iters, warmup):
+    """(p50, p99) in ms.
+    """
+    times = []
+    for i in range(warmup + iters):
+        _sync(device)
+        t = time.perf_counter()
+        module(*inputs)
+        _sync(device)
+        if i >= warmup:
+            times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[min(len(times) - 1, int(len(times) * 0.99))]
+
+
+@torch.no_grad()
+def peak_memory(module, inputs, device):
+    """Peak memory (MB) allocated by one forward on top of the parameters and inputs. On CPU it is
+    replayed from the allocations / frees recorded by the profiler.
+    """
+    if device.type == 'cuda':
+        _sync(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        module(*inputs)
+        _sync(device)
+        return (torch.cuda.max_memory_allocated(device) - base) / 2 ** 20
+
+    from torch.profiler import profile, ProfilerActivity
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        module(*inputs)
+    live, peak = 0, 0
+    for e in sorted(prof.events(), key=lambda e: e.time_range.start):
+        live += e.self_cpu_memory_usage
+        peak = max(peak, live)
+    return peak / 2 ** 20
+
+
+def gflops(module, inputs):
+    try:
+        from calflops import calculate_flops
+        flops, _, _ = calculate_flops(model=module, args=list(inputs), output_as_string=False,
+                                      print_results=False, print_detailed=False)
+        return flops / 1e9
+    except Exception:
+        return None
+
+
+def run(case, args, device):
+    module, inputs = build(case, args, device)
+    result = {'params': sum(p.numel() for p in module.parameters())}
+    result['gflops'] = gflops(module, inputs)
+    result['latency_p50'], result['latency_p99'] = latency(module, inputs, device, args.iters, args.warmup)
+    result['memory'] = peak_memory(module, inputs, device)
+
+    deploy = convert_to_deploy(module)
+    result['deploy_p50'] = latency(deploy, inputs, device, args.iters, args.warmup)[0] if deploy is not None else None
+    return result
+
+
+def print_table(results, sort):
+    key = SORT_KEYS[sort]
+    def _key(item):
+        v = item[0] if key == 'name' else item[1][key]
+        return (v is None, v)
+
+    fmt = '{:<56}{:>10}{:>10}{:>12}{:>12}{:>12}{:>12}'
+    print(fmt.format('module', 'params(K)', 'GFLOPs', 'p50(ms)', 'p99(ms)', 'deploy(ms)', 'memory(MB)'))
+    print('-' * 124)
+    for name, r in sorted(results.items(), key=_key):
+        cells = [f'{r["params"] / 1e3:.1f}'] + \
+            ['-' if r[k] is None else f'{r[k]:.3f}' for k in ('gflops', 'latency_p50', 'latency_p99', 'deploy_p50')] + \
+            [f'{r["memory"]:.2f}']
+        print(fmt.format(name, *cells))
+
+
+def write_csv(results, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('module', ) + COLUMNS)
+        for name, r in sorted(results.items()):
+            writer.writerow((name, ) + tuple('' if r[k] is None else r[k] for k in COLUMNS))
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a baseline json: latency above `1 + tolerance` times the baseline,
+    changed params / FLOPs, or a block that no longer runs.
+    """
+    regressions = []
+    for name, old in baseline['results'].items():
+        new = results.get(name)
+        if new is None:
+            regressions.append(f'{name}: missing or failed')
+            continue
+        for k in ('latency_p50', 'deploy_p50'):
+            if old.get(k) and new[k] and new[k] > old[k] * (1 + tolerance):
+                regressions.append(f'{name}: {k} {old[k]:.3f} -> {new[k]:.3f} ms')
+        for k in ('params', 'gflops'):
+            if old.get(k) is not None and new[k] is not None and abs(new[k] - old[k]) > 1e-6 * max(1, abs(old[k])):
+                regressions.append(f'{name}: {k} {old[k]} -> {new[k]}')
+    return regressions
+
+
+def main(args, ):
+    device = torch.device(args.device)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    cases = [c for c in discover() if re.search(args.filter, c[0])] if args.filter else discover()
+    print(f'{len(cases)} modules, channels={args.channels} size={args.size} batch_size={args.batch_size} '
+          f'device={device} threads={torch.get_num_threads()}')
+
+    results, failures = {}, {}
+    for case in cases:
+        try:
+            results[case[0]] = run(case, args, device)
+        except Exception as e:
+            failures[case[0]] = f'{type(e).__name__}: {e}'
+            if args.verbose:
+                traceback.print_exc()
+
+    print_table(results, args.sort)
+    for name, error in failures.items():
+        print(f'[failed] {name}: {error}')
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        settings = {k: getattr(args, k) for k in ('channels', 'size', 'batch_size', 'device', 'iters', 'warmup')}
+        settings.update(threads=torch.get_num_threads(), torch=torch.__version__)
+        with open(os.path.join(args.output_dir, 'module_benchmark.json'), 'w') as f:
+            json.dump({'settings': settings, 'results': results, 'failures': failures}, f, indent=2)
+        write_csv(results, os.path.join(args.output_dir, 'module_benchmark.csv'))
+        print(f'Save module_benchmark.json / .csv to {args.output_dir}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if args.filter:
+            baseline['results'] = {k: v for k, v in baseline['results'].items() if re.search(args.filter, k)}
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f'[regression] {r}')
+        print(f'{len(regressions)} regressions against {args.baseline}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=64)
+    parser.add_argument('--size', type=int, default=40, help='height / width of the feature map')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    parser.add_argument('--iters', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--filter', type=str, default=None, help='regex on `category/file:Class`')
+    parser.add_argument('--sort', type=str, default='latency', choices=list(SORT_KEYS))
+    parser.add_argument('-o', '--output-dir', type=str, default=None, help='write json baseline and csv table')
+    parser.add_argument('--baseline', type=str, default=None, help='json of a previous run, exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative latency increase')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    main(args)
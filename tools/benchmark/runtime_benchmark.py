@@ -0,0 +1,138 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Compare inference backends of tools/inference/runtime.py on the same image set.
+Every backend runs in a fresh process so that peak memory is not shared between them.
+
+    python tools/benchmark/runtime_benchmark.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml -r model.pth \
+        --onnx model.onnx --backends torch torch_eager onnx openvino --batch-sizes 1 2 4 8 --images /data/COCO2017/val2017
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../inference'))
+
+import glob
+import json
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+from PIL import Image
+
+from runtime import BACKENDS, build_backend, preprocess_batch
+
+
+def load_images(args):
+    if args.images:
+        paths = sorted(glob.glob(os.path.join(args.images, '*.jpg')) + glob.glob(os.path.join(args.images, '*.png')))
+        return [Image.open(p).convert('RGB') for p in paths[:args.num_images]]
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)) for _ in range(args.num_images)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_backend(args, name):
+    images = load_images(args)
+    backend = build_backend(name, config=args.config, resume=args.resume, onnx_file=args.onnx,
+                            device=args.device, size=args.size, num_threads=args.num_threads)
+
+    results = []
+    for batch_size in args.batch_sizes:
+        buffer = backend.allocate(batch_size)
+        batches = []
+        for i in range(0, len(images) - batch_size + 1, batch_size):
+            data, orig_sizes, _ = preprocess_batch(images[i: i + batch_size], args.size, args.mode)
+            batches.append((data, orig_sizes))
+        assert len(batches) > 0, f'need at least {batch_size} images'
+
+        for i in range(args.warmup):
+            data, orig_sizes = batches[i % len(batches)]
+            buffer[:batch_size] = data
+            backend(buffer, orig_sizes)
+
+        times = []
+        for i in range(args.iters):
+            data, orig_sizes = batches[i % len(batches)]
+            buffer[:batch_size] = data
+            t = time.perf_counter()
+            backend(buffer, orig_sizes)
+            times.append(time.perf_counter() - t)
+
+        times = np.array(times) * 1000
+        results.append({
+            'backend': name,
+            'batch_size': batch_size,
+            'p50': float(np.percentile(times, 50)),
+            'p90': float(np.percentile(times, 90)),
+            'p99': float(np.percentile(times, 99)),
+            'throughput': float(batch_size * 1000 / times.mean()),
+        })
+
+    device_mem = backend.peak_memory()
+    for r in results:
+        r['peak_rss_mb'] = peak_rss_mb()
+        r['peak_device_mb'] = device_mem
+    return results
+
+
+def _worker(args, name, q):
+    try:
+        q.put(bench_backend(args, name))
+    except Exception as e:
+        q.put(e)
+
+
+def main(args, ):
+    ctx = mp.get_context('spawn')
+    results = []
+    for name in args.backends:
+        q = ctx.Queue()
+        p = ctx.Process(target=_worker, args=(args, name, q))
+        p.start()
+        out = q.get()
+        p.join()
+        if isinstance(out, Exception):
+            print(f'{name}: failed with {out!r}')
+            continue
+        results.extend(out)
+
+    print('-' * 100)
+    print('{:<14}{:>8}{:>12}{:>12}{:>12}{:>14}{:>14}{:>14}'.format(
+        'backend', 'batch', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'img/s', 'peak rss(MB)', 'peak dev(MB)'))
+    for r in results:
+        dev = '-' if r['peak_device_mb'] is None else '{:.1f}'.format(r['peak_device_mb'])
+        print('{:<14}{:>8}{:>12.2f}{:>12.2f}{:>12.2f}{:>14.2f}{:>14.1f}{:>14}'.format(
+            r['backend'], r['batch_size'], r['p50'], r['p90'], r['p99'], r['throughput'], r['peak_rss_mb'], dev))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, help='torch backends')
+    parser.add_argument('-r', '--resume', type=str, help='torch backends')
+    parser.add_argument('--onnx', type=str, help='onnx / openvino backends')
+    parser.add_argument('--backends', type=str, nargs='+', default=['onnx'], choices=BACKENDS)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--images', type=str, default=None, help='image folder, random images if not given')
+    parser.add_argument('--num-images', type=int, default=64)
+    parser.add_argument('--mode', type=str, default='resize', choices=['resize', 'letterbox'])
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--num-threads', type=int, default=0, help='intra-op threads for onnx / openvino, 0 for default')
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--iters', type=int, default=100)
+    parser.add_argument('--output', type=str, default=None, help='save results as json')
+    args = parser.parse_args()
+
+    main(args)
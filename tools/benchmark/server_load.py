@@ -0,0 +1,145 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Local load generator for tools/inference/server.py. Each client keeps one connection and
+sends requests back to back (closed loop); client-side latency percentiles, throughput and
+the server's own stats are reported per concurrency level.
+
+    python tools/inference/server.py --backend onnx --onnx model.onnx &
+    python tools/benchmark/server_load.py --images /data/COCO2017/val2017 --concurrency 1 4 16
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import base64
+import socket
+import argparse
+import threading
+
+import numpy as np
+
+
+class Client(object):
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, payload: dict):
+        self.sock.sendall((json.dumps(payload) + '\n').encode())
+        return json.loads(self.rfile.readline())
+
+    def close(self, ):
+        self.rfile.close()
+        self.sock.close()
+
+
+def load_payloads(args):
+    if args.images:
+        paths = sorted(glob.glob(os.path.join(args.images, '*.jpg')) + glob.glob(os.path.join(args.images, '*.png')))
+        paths = paths[:args.num_images]
+    else:
+        # synthetic images, nothing needs to exist on disk
+        from PIL import Image
+        import io
+        paths = []
+        for _ in range(args.num_images):
+            buf = io.BytesIO()
+            Image.fromarray(np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)).save(buf, format='JPEG')
+            paths.append(buf.getvalue())
+
+    payloads = []
+    for p in paths:
+        if isinstance(p, bytes):
+            payloads.append({'image': base64.b64encode(p).decode()})
+        elif args.send_bytes:
+            with open(p, 'rb') as f:
+                payloads.append({'image': base64.b64encode(f.read()).decode()})
+        else:
+            payloads.append({'path': os.path.abspath(p)})
+    return payloads
+
+
+def run(args, payloads, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    per_client = args.requests // concurrency
+
+    def worker(rank):
+        client = Client(args.host, args.port)
+        local = []
+        for i in range(per_client):
+            payload = dict(payloads[(rank * per_client + i) % len(payloads)], id=i)
+            t = time.perf_counter()
+            response = client.request(payload)
+            local.append(time.perf_counter() - t)
+            if 'error' in response:
+                errors.append(response['error'])
+        client.close()
+        with lock:
+            latencies.extend(local)
+
+    control = Client(args.host, args.port)
+    control.request({'cmd': 'reset_stats'})
+
+    threads = [threading.Thread(target=worker, args=(r, )) for r in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+
+    server_stats = control.request({'cmd': 'stats'})
+    control.close()
+
+    lat = np.array(latencies) * 1000
+    return {
+        'concurrency': concurrency,
+        'throughput': len(latencies) / total,
+        'p50': np.percentile(lat, 50), 'p90': np.percentile(lat, 90), 'p99': np.percentile(lat, 99),
+        'batch': server_stats.get('batch_size', {}).get('mean', float('nan')),
+        'errors': len(errors),
+    }
+
+
+def main(args, ):
+    payloads = load_payloads(args)
+    assert len(payloads) > 0, 'no images found'
+
+    # warmup
+    client = Client(args.host, args.port)
+    for p in payloads[:args.warmup]:
+        client.request(p)
+    client.close()
+
+    print('{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}{:>8}'.format('concurrency', 'req/s', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'batch', 'errors'))
+    results = []
+    for c in args.concurrency:
+        r = run(args, payloads, c)
+        results.append(r)
+        print('{:>12}{:>12.2f}{:>12.2f}{:>12.2f}{:>12.2f}{:>12.2f}{:>8}'.format(
+            r['concurrency'], r['throughput'], r['p50'], r['p90'], r['p99'], r['batch'], r['errors']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--images', type=str, default=None, help='image folder, random images if not given')
+    parser.add_argument('--num-images', type=int, default=64)
+    parser.add_argument('--send-bytes', action='store_true', help='send encoded images instead of paths')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=256, help='requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=8)
+    parser.add_argument('--output', type=str, default=None, help='save results as json')
+    args = parser.parse_args()
+
+    main(args)
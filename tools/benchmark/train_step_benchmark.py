@@ -0,0 +1,90 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Compare training throughput (steps/sec) of `train_one_epoch` with and without `fast_step`.
+
+    python tools/benchmark/train_step_benchmark.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml --steps 200
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import time
+import argparse
+
+import torch
+
+from engine.core import YAMLConfig
+from engine.misc import dist_utils
+from engine.solver.det_engine import train_one_epoch
+
+
+def synthetic_batches(num_steps, batch_size, size, num_classes, max_boxes=20):
+    batches = []
+    for _ in range(num_steps):
+        samples = torch.rand(batch_size, 3, size, size)
+        targets = []
+        for i in range(batch_size):
+            n = int(torch.randint(1, max_boxes, (1, )))
+            cxcy = torch.rand(n, 2) * 0.6 + 0.2
+            wh = torch.rand(n, 2) * 0.3 + 0.05
+            targets.append({
+                'boxes': torch.cat([cxcy, wh], dim=1),
+                'labels': torch.randint(0, num_classes, (n, )),
+                'image_id': torch.tensor([i]),
+                'orig_size': torch.tensor([size, size]),
+            })
+        batches.append((samples, targets))
+    return batches
+
+
+def run(cfg, batches, device, fast_step, print_freq):
+    model = cfg.model.to(device)
+    criterion = cfg.criterion.to(device)
+    optimizer = cfg.optimizer
+    scaler = cfg.scaler
+    ema = cfg.ema.to(device) if cfg.ema is not None else None
+
+    # warmup
+    train_one_epoch(False, None, model, criterion, batches[:2], optimizer, device, 0,
+        max_norm=cfg.clip_max_norm, print_freq=print_freq, ema=ema, scaler=scaler, fast_step=fast_step)
+
+    start = dist_utils.sync_time()
+    train_one_epoch(False, None, model, criterion, batches, optimizer, device, 0,
+        max_norm=cfg.clip_max_norm, print_freq=print_freq, ema=ema, scaler=scaler, fast_step=fast_step)
+    return len(batches) / (dist_utils.sync_time() - start)
+
+
+def main(args, ):
+    device = torch.device(args.device)
+    results = {}
+    for fast_step in (False, True):
+        torch.manual_seed(0)
+        cfg = YAMLConfig(args.config, use_amp=args.use_amp and device.type == 'cuda')
+        if 'HGNetv2' in cfg.yaml_cfg:
+            cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+        num_classes = cfg.yaml_cfg.get('num_classes', 80)
+        batches = synthetic_batches(args.steps, args.batch_size, args.size, num_classes)
+        results[fast_step] = run(cfg, batches, device, fast_step, args.print_freq)
+
+    print('-' * 42)
+    print('{:<12}{:>14}'.format('fast_step', 'steps/sec'))
+    for k, v in results.items():
+        print('{:<12}{:>14.3f}'.format(str(k), v))
+    print('speedup: {:.3f}x'.format(results[True] / results[False]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-d', '--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--print-freq', type=int, default=20)
+    parser.add_argument('--use-amp', action='store_true')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,91 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Run a trained DEIM over the training set once, under the deterministic val transforms, and store the
+top-k queries of every image (boxes, logits, corner distributions) in a memory-mapped cache keyed by
+image_id (engine/data/dataset/teacher_cache.py). Train with the cache through `TeacherCocoDetection`:
+
+    python tools/dataset/build_teacher_cache.py -c configs/deim_dfine/deim_hgnetv2_x_coco.yml \
+        -r deim_hgnetv2_x_coco.pth -o outputs/teacher_cache/deim_hgnetv2_x_coco --topk 100
+    python train.py -c configs/deim_dfine/deim_hgnetv2_s_coco_distill_cached.yml
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from engine.core import YAMLConfig
+from engine.data import TeacherCacheWriter, batch_image_collate_fn
+
+
+def build_dataset(cfg):
+    """Training images with the val transforms (resize only), boxes stay normalized to the original image.
+    """
+    dataset = cfg.train_dataloader.dataset
+    dataset._transforms = cfg.val_dataloader.dataset._transforms
+    return dataset
+
+
+@torch.no_grad()
+def main(args, ):
+    cfg = YAMLConfig(args.config, resume=args.resume)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    state = checkpoint['ema']['module'] if 'ema' in checkpoint else checkpoint['model']
+    model = cfg.model
+    model.load_state_dict(state)
+    device = torch.device(args.device)
+    model = model.eval().to(device)
+
+    dataset = build_dataset(cfg)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers,
+                        collate_fn=batch_image_collate_fn, pin_memory=True)
+
+    writer = TeacherCacheWriter(args.output_dir, len(dataset), args.topk, model.decoder.num_classes,
+                                model.decoder.reg_max, meta={'config': args.config, 'resume': args.resume})
+
+    start = time.time()
+    for i, (samples, targets) in enumerate(loader):
+        with torch.autocast(device_type=device.type, enabled=args.use_amp):
+            outputs = model(samples.to(device))
+
+        logits, boxes, corners = outputs['pred_logits'].float(), outputs['pred_boxes'].float(), outputs['pred_corners'].float()
+        scores = logits.sigmoid().max(-1)[0]
+        topk = min(args.topk, scores.shape[1])
+        for b, t in enumerate(targets):
+            score, idx = scores[b].topk(topk)
+            idx = idx[score > args.min_score]
+            writer.append(t['image_id'].item(), boxes[b, idx].cpu().numpy(), logits[b, idx].cpu().numpy(),
+                          corners[b, idx].cpu().numpy())
+
+        if i % args.print_freq == 0:
+            print(f'[{i}/{len(loader)}] {writer.offsets[-1]} rows, {time.time() - start:.1f}s')
+
+    writer.close()
+    print(f'Save {writer.meta["num_rows"]} rows of {writer.meta["num_images"]} images to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True, help='teacher config')
+    parser.add_argument('-r', '--resume', type=str, required=True, help='teacher checkpoint')
+    parser.add_argument('-o', '--output-dir', type=str, required=True)
+    parser.add_argument('--topk', type=int, default=100, help='queries kept per image')
+    parser.add_argument('--min-score', type=float, default=0.01, help='drop queries below it')
+    parser.add_argument('-b', '--batch-size', type=int, default=32)
+    parser.add_argument('--num-workers', type=int, default=8)
+    parser.add_argument('-d', '--device', type=str, default='cuda')
+    parser.add_argument('--use-amp', action='store_true')
+    parser.add_argument('--print-freq', type=int, default=50)
+    args = parser.parse_args()
+
+    main(args)
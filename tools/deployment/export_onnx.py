@@ -10,20 +10,30 @@ import os
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
 
+import json
+
 import torch
 import torch.nn as nn
 
 from engine.core import YAMLConfig
+from engine.misc.qat import prepare_qat
+from engine.misc.prune_utils import apply_pruning_spec
 
 
-def main(args, ):
-    """main
-    """
-    cfg = YAMLConfig(args.config, resume=args.resume)
+def build_model(args, eval_spatial_size=None):
+    update = {} if eval_spatial_size is None else {'eval_spatial_size': list(eval_spatial_size)}
+    cfg = YAMLConfig(args.config, resume=args.resume, **update)
 
     if 'HGNetv2' in cfg.yaml_cfg:
         cfg.yaml_cfg['HGNetv2']['pretrained'] = False
 
+    if cfg.prune_spec:
+        apply_pruning_spec(cfg.model, cfg.prune_spec)
+
+    if cfg.qat:
+        # same structure as the QAT checkpoint, fake-quant exports as QuantizeLinear / DequantizeLinear (int8 model)
+        prepare_qat(cfg.model, skip=cfg.qat_skip)
+
     if args.resume:
         checkpoint = torch.load(args.resume, map_location='cpu')
         if 'ema' in checkpoint:
@@ -31,8 +41,15 @@ def main(args, ):
         else:
             state = checkpoint['model']
 
-        # NOTE load train mode state -> convert to deploy mode
-        cfg.model.load_state_dict(state)
+        if eval_spatial_size is not None:
+            # anchors / valid_mask depend on the export resolution and are regenerated by the model
+            state = {k: v for k, v in state.items() if not k.endswith(('.anchors', '.valid_mask'))}
+            missing, unexpected = cfg.model.load_state_dict(state, strict=False)
+            assert not unexpected and all(k.endswith(('.anchors', '.valid_mask')) for k in missing), \
+                f'missing {missing}, unexpected {unexpected}'
+        else:
+            # NOTE load train mode state -> convert to deploy mode
+            cfg.model.load_state_dict(state)
 
     else:
         # raise AttributeError('Only support resume to load model.state_dict by now.')
@@ -43,16 +60,17 @@ def main(args, ):
             super().__init__()
             self.model = cfg.model.deploy()
             self.postprocessor = cfg.postprocessor.deploy()
+            self.qat = bool(cfg.qat)
 
         def forward(self, images, orig_target_sizes):
             outputs = self.model(images)
             outputs = self.postprocessor(outputs, orig_target_sizes)
             return outputs
 
-    model = Model()
+    return Model()
 
-    data = torch.rand(32, 3, 640, 640)
-    size = torch.tensor([[640, 640]])
+
+def export(model, output_file, data, size, args):
     _ = model(data, size)
 
     dynamic_axes = {
@@ -60,8 +78,6 @@ def main(args, ):
         'orig_target_sizes': {0: 'N'}
     }
 
-    output_file = args.resume.replace('.pth', '.onnx') if args.resume else 'model.onnx'
-
     torch.onnx.export(
         model,
         (data, size),
@@ -91,6 +107,102 @@ def main(args, ):
         print(f'Simplify onnx model {check}...')
 
 
+@torch.no_grad()
+def check_parity(model, output_file, height, width, batch_size=2, score_thrh=0.3):
+    """Compare PyTorch and ONNX Runtime (CPU) outputs on random inputs of the exported shape.
+    Boxes are only compared for queries scoring above `score_thrh`.
+    """
+    import onnxruntime as ort
+
+    torch.manual_seed(0)
+    data = torch.rand(batch_size, 3, height, width)
+    size = torch.tensor([[width, height]] * batch_size)
+
+    labels, boxes, scores = model(data, size)
+    sess = ort.InferenceSession(output_file, providers=['CPUExecutionProvider'])
+    ort_labels, ort_boxes, ort_scores = sess.run(None, {'images': data.numpy(), 'orig_target_sizes': size.numpy()})
+
+    keep = scores.numpy() > score_thrh
+    result = {
+        'max_score_diff': float(abs(scores.numpy() - ort_scores).max()),
+        'max_box_diff': float(abs(boxes.numpy() - ort_boxes)[keep].max()) if keep.any() else 0.,
+        'label_match': float((labels.numpy() == ort_labels)[keep].mean()) if keep.any() else 1.,
+    }
+    result['passed'] = result['max_score_diff'] < 1e-3 and result['max_box_diff'] < 1e-1 and result['label_match'] == 1.
+    return result
+
+
+def check_qdq(output_file):
+    """Count the QuantizeLinear / DequantizeLinear nodes of a QAT export, fails if fake-quant was not exported.
+    """
+    import onnx
+    ops = [n.op_type for n in onnx.load(output_file).graph.node]
+    result = {'QuantizeLinear': ops.count('QuantizeLinear'), 'DequantizeLinear': ops.count('DequantizeLinear')}
+    assert result['QuantizeLinear'] > 0 and result['DequantizeLinear'] > 0, f'no QDQ nodes in {output_file}'
+    return result
+
+
+def parse_size(s):
+    h, _, w = s.lower().partition('x')
+    return int(h), int(w or h)
+
+
+def export_bundle(args, ):
+    """One ONNX model per resolution, anchors and positional embeddings specialised for each,
+    plus a manifest.json for runtime selection (see `tools/inference/runtime.py: select_bundle_model`).
+    """
+    output_dir = args.output_dir or (args.resume.replace('.pth', '_onnx') if args.resume else 'model_onnx')
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        'config': args.config,
+        'resume': args.resume,
+        'inputs': {'images': ['N', 3, 'H', 'W'], 'orig_target_sizes': ['N', 2]},
+        'outputs': ['labels', 'boxes', 'scores'],
+        'models': [],
+    }
+
+    for h, w in [parse_size(s) for s in args.sizes]:
+        model = build_model(args, eval_spatial_size=(h, w))
+        file_name = f'model_{h}x{w}.onnx'
+        output_file = os.path.join(output_dir, file_name)
+        export(model, output_file, torch.rand(args.batch_size, 3, h, w), torch.tensor([[w, h]]), args)
+
+        entry = {'height': h, 'width': w, 'file': file_name, 'parity': check_parity(model, output_file, h, w)}
+        if model.qat:
+            entry['qdq'] = check_qdq(output_file)
+        print(f'{h}x{w} parity: {entry["parity"]}')
+        manifest['models'].append(entry)
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f'Export bundle of {len(manifest["models"])} models to {output_dir}')
+
+    failed = [f'{m["height"]}x{m["width"]}' for m in manifest['models'] if not m['parity']['passed']]
+    assert not failed, f'ONNX Runtime parity check failed for {failed}'
+
+
+def main(args, ):
+    """main
+    """
+    if args.sizes:
+        return export_bundle(args)
+
+    model = build_model(args)
+
+    data = torch.rand(32, 3, 640, 640)
+    size = torch.tensor([[640, 640]])
+
+    output_file = args.resume.replace('.pth', '.onnx') if args.resume else 'model.onnx'
+    export(model, output_file, data, size, args)
+
+    if model.qat:
+        # int8 graph must run in ONNX Runtime and match the fake-quant model
+        print(f'qdq nodes: {check_qdq(output_file)}')
+    if args.parity or model.qat:
+        print(f'parity: {check_parity(model, output_file, 640, 640)}')
+
+
 if __name__ == '__main__':
 
     import argparse
@@ -99,5 +211,10 @@ if __name__ == '__main__':
     parser.add_argument('--resume', '-r', type=str, )
     parser.add_argument('--check',  action='store_true', default=True,)
     parser.add_argument('--simplify',  action='store_true', default=True,)
+    parser.add_argument('--sizes', type=str, nargs='+', default=None,
+                        help='export one model per resolution, e.g. 480x640 640 800x1333, with a manifest.json')
+    parser.add_argument('--output-dir', type=str, default=None, help='bundle directory for --sizes')
+    parser.add_argument('--batch-size', type=int, default=1, help='trace batch size for --sizes, batch stays dynamic')
+    parser.add_argument('--parity', action='store_true', default=False, help='compare with ONNX Runtime on CPU, always on for --sizes')
     args = parser.parse_args()
     main(args)
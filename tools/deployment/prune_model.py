@@ -0,0 +1,148 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Structured channel pruning of the HGNetv2 backbone and HybridEncoder (engine/misc/prune_utils.py).
+Ranks channels by BN gamma or first-order Taylor importance, prunes a global ratio (or the largest
+ratio meeting a CPU latency target), reports FLOPs / params / latency and writes a pruned checkpoint
+with its spec. Fine-tune the result with the spec so the model is built at the pruned shapes:
+
+    python tools/deployment/prune_model.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml -r best_stg2.pth \
+        --method taylor --ratio 0.3 -o outputs/pruned
+    python train.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml -t outputs/pruned/pruned.pth \
+        -u prune_spec=outputs/pruned/prune_spec.json
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import copy
+import json
+import time
+import itertools
+
+import torch
+
+from engine.core import YAMLConfig
+from engine.misc.prune_utils import build_groups, prune_model, apply_pruning_spec, taylor_importance
+
+
+def load_model(args):
+    cfg = YAMLConfig(args.config, resume=args.resume)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    # an already pruned checkpoint is pruned further
+    if cfg.prune_spec:
+        apply_pruning_spec(cfg.model, cfg.prune_spec)
+
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    state = checkpoint['ema']['module'] if 'ema' in checkpoint else checkpoint['model']
+    cfg.model.load_state_dict(state)
+    return cfg
+
+
+def measure(model, size, iters=30, warmup=5):
+    """(GFLOPs, params in M, CPU p50 latency in ms) of the deploy-mode model.
+    """
+    from calflops import calculate_flops
+
+    model = copy.deepcopy(model).deploy()
+    shape = (1, 3, size[0], size[1])
+    flops, _, _ = calculate_flops(model=model, input_shape=shape, output_as_string=False, print_results=False,
+                                  print_detailed=False)
+    params = sum(p.numel() for p in model.parameters())
+
+    data = torch.rand(*shape)
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + iters):
+            t = time.perf_counter()
+            model(data)
+            if i >= warmup:
+                times.append(time.perf_counter() - t)
+    times.sort()
+    return flops / 1e9, params / 1e6, times[len(times) // 2] * 1000
+
+
+def compute_importance(cfg, model, args):
+    if args.method == 'bn':
+        return None
+
+    device = torch.device(args.device)
+    model.to(device)
+    criterion = cfg.criterion.to(device)
+    batches = itertools.islice(cfg.train_dataloader, args.taylor_batches)
+    scores = taylor_importance(model, criterion, batches, device, build_groups(model))
+    model.cpu().eval()
+    return {k: v.cpu() for k, v in scores.items()}
+
+
+def search_ratio(model, importance, size, args):
+    """Largest ratio (bisection, `--search-steps`) whose pruned model meets `--target-latency`.
+    """
+    lo, hi, best = 0., args.max_ratio, None
+    for _ in range(args.search_steps):
+        ratio = (lo + hi) / 2
+        candidate = copy.deepcopy(model)
+        prune_model(candidate, ratio, importance, round_to=args.round_to)
+        lat = measure(candidate, size, iters=args.bench_iters)[2]
+        print(f'ratio {ratio:.3f}: {lat:.2f} ms')
+        if lat <= args.target_latency:
+            best, hi = ratio, ratio
+        else:
+            lo = ratio
+    if best is None:
+        print(f'Target {args.target_latency} ms not reached, use max ratio {args.max_ratio}')
+        best = args.max_ratio
+    return best
+
+
+def main(args, ):
+    cfg = load_model(args)
+    model = cfg.model.eval()
+    size = cfg.yaml_cfg.get('eval_spatial_size', [640, 640])
+
+    before = measure(model, size, iters=args.bench_iters)
+    groups = build_groups(model)
+    print(f'{len(groups)} prunable channel groups, {sum(g.size for g in groups)} channels')
+
+    importance = compute_importance(cfg, model, args)
+    ratio = search_ratio(model, importance, size, args) if args.target_latency else args.ratio
+
+    spec = prune_model(model, ratio, importance, round_to=args.round_to)
+    after = measure(model, size, iters=args.bench_iters)
+
+    print('-' * 60)
+    print('{:<10}{:>16}{:>16}{:>18}'.format('', 'GFLOPs', 'Params(M)', 'CPU latency(ms)'))
+    for name, (flops, params, lat) in (('original', before), ('pruned', after)):
+        print('{:<10}{:>16.3f}{:>16.3f}{:>18.2f}'.format(name, flops, params, lat))
+    print(f'ratio {ratio:.3f}, method {args.method}, latency speedup {before[2] / after[2]:.2f}x')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    spec_file = os.path.join(args.output_dir, 'prune_spec.json')
+    with open(spec_file, 'w') as f:
+        json.dump(spec, f, indent=2)
+    torch.save({'model': model.state_dict(), 'prune_spec': spec}, os.path.join(args.output_dir, 'pruned.pth'))
+    print(f'Save pruned model and {spec_file}, fine-tune with `-u prune_spec={spec_file}`')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-r', '--resume', type=str, required=True)
+    parser.add_argument('-o', '--output-dir', type=str, default='outputs/pruned')
+    parser.add_argument('--method', type=str, default='bn', choices=['bn', 'taylor'])
+    parser.add_argument('--ratio', type=float, default=0.3, help='fraction of channels removed per group')
+    parser.add_argument('--round-to', type=int, default=8, help='kept channels are a multiple of it')
+    parser.add_argument('--target-latency', type=float, default=None, help='CPU ms, search the ratio instead')
+    parser.add_argument('--max-ratio', type=float, default=0.7)
+    parser.add_argument('--search-steps', type=int, default=5)
+    parser.add_argument('--taylor-batches', type=int, default=16)
+    parser.add_argument('--bench-iters', type=int, default=30)
+    parser.add_argument('-d', '--device', type=str, default='cpu', help='device for taylor importance')
+    args = parser.parse_args()
+
+    main(args)
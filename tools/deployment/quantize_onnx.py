@@ -0,0 +1,177 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Post-training static INT8 quantization of an exported ONNX model (tools/deployment/export_onnx.py)
+with ONNX Runtime, calibrated on `cfg.val_dataloader`. Reports COCO AP and CPU latency of the
+fp32 and int8 models in one run.
+
+    python tools/deployment/quantize_onnx.py -c configs/deim_dfine/deim_hgnetv2_s_coco.yml --onnx model.onnx \
+        --calib-batches 32 --skip integral/Softmax sampling_offsets
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import re
+import time
+
+import numpy as np
+import torch
+
+from engine.core import YAMLConfig
+from engine.data.dataset import mscoco_label2category
+
+
+# sensitive ops kept in float: the distribution softmax of `Integral` and the linear
+# producing `MSDeformableAttention` sampling offsets, quantizing them shifts boxes by whole bins / pixels
+DEFAULT_SKIP = ['integral', 'sampling_offsets']
+
+
+def to_inputs(samples, targets):
+    orig_sizes = torch.stack([t['orig_size'] for t in targets], dim=0)
+    return {'images': samples.numpy(), 'orig_target_sizes': orig_sizes.numpy().astype(np.int64)}
+
+
+def build_calibration_reader(dataloader, num_batches):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ValCalibrationReader(CalibrationDataReader):
+        def __init__(self, ):
+            self.iter = None
+            self.count = 0
+
+        def get_next(self, ):
+            if self.iter is None:
+                self.iter = iter(dataloader)
+            if self.count >= num_batches:
+                return None
+            try:
+                samples, targets = next(self.iter)
+            except StopIteration:
+                return None
+            self.count += 1
+            return to_inputs(samples, targets)
+
+        def rewind(self, ):
+            self.iter, self.count = None, 0
+
+    return ValCalibrationReader()
+
+
+def find_nodes(onnx_file, patterns, op_types):
+    """Names of nodes of `op_types` whose name matches any of `patterns` (regex, case-insensitive).
+    """
+    import onnx
+    graph = onnx.load(onnx_file).graph
+    regex = [re.compile(p, re.IGNORECASE) for p in patterns]
+    return [n.name for n in graph.node if n.op_type in op_types and any(r.search(n.name) for r in regex)]
+
+
+def quantize(args, dataloader):
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType, CalibrationMethod
+
+    op_types = ['Conv', 'MatMul', 'Gemm']
+    # Softmax is not in `op_types`, list it anyway so that a custom op set still respects the skip list
+    nodes_to_exclude = find_nodes(args.onnx, args.skip, op_types + ['Softmax'])
+    print(f'Keep {len(nodes_to_exclude)} nodes in float: {nodes_to_exclude}')
+
+    quantize_static(
+        args.onnx,
+        args.output,
+        build_calibration_reader(dataloader, args.calib_batches),
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=op_types,
+        per_channel=args.per_channel,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        nodes_to_exclude=nodes_to_exclude,
+        calibrate_method=getattr(CalibrationMethod, args.calib_method),
+    )
+    print(f'Save int8 model to {args.output}')
+
+
+def evaluate(sess, dataloader, evaluator, remap_mscoco_category, max_batches=None):
+    evaluator.cleanup()
+    for i, (samples, targets) in enumerate(dataloader):
+        if max_batches is not None and i >= max_batches:
+            break
+        labels, boxes, scores = sess.run(None, to_inputs(samples, targets))
+        if remap_mscoco_category:
+            labels = np.vectorize(lambda x: mscoco_label2category[int(x)])(labels)
+
+        res = {}
+        for t, lab, box, scr in zip(targets, labels, boxes, scores):
+            res[t['image_id'].item()] = dict(labels=torch.from_numpy(np.asarray(lab)),
+                                             boxes=torch.from_numpy(box), scores=torch.from_numpy(scr))
+        evaluator.update(res)
+
+    evaluator.synchronize_between_processes()
+    evaluator.accumulate()
+    evaluator.summarize()
+    return evaluator.coco_eval['bbox'].stats.tolist()
+
+
+def latency(sess, inputs, warmup=10, iters=50):
+    for _ in range(warmup):
+        sess.run(None, inputs)
+    times = []
+    for _ in range(iters):
+        t = time.perf_counter()
+        sess.run(None, inputs)
+        times.append(time.perf_counter() - t)
+    return float(np.percentile(np.array(times) * 1000, 50))
+
+
+def main(args, ):
+    import onnxruntime as ort
+
+    cfg = YAMLConfig(args.config)
+    dataloader = cfg.val_dataloader
+    args.output = args.output or args.onnx.replace('.onnx', '_int8.onnx')
+
+    quantize(args, dataloader)
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = args.num_threads
+    sessions = {name: ort.InferenceSession(f, sess_options=options, providers=['CPUExecutionProvider'])
+                for name, f in (('fp32', args.onnx), ('int8', args.output))}
+
+    samples, targets = next(iter(dataloader))
+    bench_inputs = to_inputs(samples[:1], targets[:1])
+
+    results = {}
+    for name, sess in sessions.items():
+        ap = evaluate(sess, dataloader, cfg.evaluator, cfg.postprocessor.remap_mscoco_category, args.eval_batches) \
+            if args.eval else [float('nan')] * 2
+        results[name] = (ap[0], ap[1], latency(sess, bench_inputs, iters=args.bench_iters))
+
+    print('-' * 56)
+    print('{:<8}{:>12}{:>12}{:>16}'.format('model', 'AP', 'AP50', 'latency(ms)'))
+    for name, (ap, ap50, lat) in results.items():
+        print('{:<8}{:>12.4f}{:>12.4f}{:>16.2f}'.format(name, ap, ap50, lat))
+    print('AP delta: {:+.4f}, CPU speedup: {:.2f}x'.format(
+        results['int8'][0] - results['fp32'][0], results['fp32'][2] / results['int8'][2]))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('--onnx', type=str, required=True, help='fp32 model exported by export_onnx.py')
+    parser.add_argument('-o', '--output', type=str, default=None)
+    parser.add_argument('--calib-batches', type=int, default=32)
+    parser.add_argument('--calib-method', type=str, default='MinMax', choices=['MinMax', 'Entropy', 'Percentile'])
+    parser.add_argument('--per-channel', action=argparse.BooleanOptionalAction, default=True,
+                        help='per-channel weight scales, --no-per-channel for per-tensor')
+    parser.add_argument('--skip', type=str, nargs='*', default=DEFAULT_SKIP,
+                        help='node name patterns kept in float')
+    parser.add_argument('--eval', action=argparse.BooleanOptionalAction, default=True,
+                        help='COCO eval of fp32 and int8, --no-eval to only quantize and benchmark')
+    parser.add_argument('--eval-batches', type=int, default=None, help='evaluate on a subset of val batches')
+    parser.add_argument('--num-threads', type=int, default=0)
+    parser.add_argument('--bench-iters', type=int, default=50)
+    args = parser.parse_args()
+
+    main(args)
@@ -5,3 +5,45 @@ Copyright(c) 2023 lyuwenyu. All Rights Reserved.
 
 
 # please reference: https://github.com/guojin-yan/RT-DETR-OpenVINO
+
+import os
+
+from runtime import OpenVINOBackend, load_image, preprocess_batch, postprocess, draw_detections, video_stages
+from video_pipeline import VideoPipeline
+
+
+def process_image(m, file_path, thrh=0.4):
+    im_pil = load_image(file_path)
+    images, orig_sizes, metas = preprocess_batch([im_pil], m.size)
+    result, = postprocess(*m(images, orig_sizes), metas, thrh=thrh)
+
+    draw_detections(im_pil, *result).save('openvino_result.jpg')
+    print("Image processing complete. Result saved as 'openvino_result.jpg'.")
+
+
+def process_video(m, file_path, batch_size=1, num_workers=2, queue_size=8, drop_frames=False):
+    preprocess, infer = video_stages(m, m.size)
+    pipeline = VideoPipeline(preprocess, infer, batch_size=batch_size, num_workers=num_workers,
+                             queue_size=queue_size, drop_frames=drop_frames)
+    pipeline.run(file_path, 'openvino_result.mp4')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, required=True, help='Exported ONNX file or OpenVINO IR (.xml).')
+    parser.add_argument('-i', '--input', type=str, required=True)
+    parser.add_argument('-d', '--device', type=str, default='CPU')
+    parser.add_argument('--batch-size', type=int, default=1, help='frames per model call for video input')
+    parser.add_argument('--workers', type=int, default=2, help='preprocess threads for video input')
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--drop-frames', action='store_true', help='drop frames instead of stalling the decoder')
+    args = parser.parse_args()
+
+    m = OpenVINOBackend(args.model, device=args.device)
+
+    if os.path.splitext(args.input)[-1].lower() in ['.jpg', '.jpeg', '.png', '.bmp']:
+        process_image(m, args.input)
+    else:
+        process_video(m, args.input, batch_size=args.batch_size, num_workers=args.workers,
+                      queue_size=args.queue_size, drop_frames=args.drop_frames)
@@ -0,0 +1,300 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Inference backends sharing one calling convention and one pre/post-processing path:
+
+    backend = build_backend('onnx', onnx_file='model.onnx')
+    images, orig_sizes, metas = preprocess_batch(pil_images, size=640, mode='resize', out=backend.allocate(8))
+    labels, boxes, scores = backend(images, orig_sizes)
+    results = postprocess(labels, boxes, scores, metas, thrh=0.4)
+    draw_detections(pil_images[0], *results[0])
+
+    # video, see video_pipeline.py
+    preprocess, infer = video_stages(backend, size=640, mode='resize')
+
+Backends
+    torch        deploy-mode DEIM + PostProcessor (`.deploy()`, rep branches fused)
+    torch_eager  the same weights without `.deploy()` on the model
+    onnx         ONNX Runtime, CPU provider by default
+    openvino     OpenVINO runtime, reads the same ONNX file (or an IR .xml)
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+
+__all__ = ['BACKENDS', 'build_backend', 'TorchBackend', 'ORTBackend', 'OpenVINOBackend',
+           'load_image', 'preprocess', 'preprocess_batch', 'postprocess', 'draw_detections', 'video_stages',
+           'select_bundle_model', ]
+
+
+def load_image(data):
+    """`data`: file path or encoded image bytes.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    return Image.open(data).convert('RGB')
+
+
+def _resize_to(im, w, h):
+    if isinstance(im, np.ndarray):
+        # video frames, resized by cv2 without a round trip through PIL
+        import cv2
+        return cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return np.asarray(im.resize((w, h), Image.BILINEAR))
+
+
+def _resize(im, size, mode):
+    """Resize a PIL image or a HWC uint8 array to a uint8 [size, size, 3] array.
+    Returns the array, the `orig_target_sizes` row for the model and the meta to undo letterboxing.
+    """
+    w, h = (im.shape[1], im.shape[0]) if isinstance(im, np.ndarray) else im.size
+    if mode == 'resize':
+        # stretch like `T.Resize((size, size))`, the postprocessor scales boxes to (w, h) directly
+        return _resize_to(im, size, size), (w, h), None
+
+    ratio = min(size / w, size / h)
+    new_w, new_h = int(w * ratio), int(h * ratio)
+    pad_w, pad_h = (size - new_w) // 2, (size - new_h) // 2
+    padded = np.zeros((size, size, 3), dtype=np.uint8)
+    padded[pad_h: pad_h + new_h, pad_w: pad_w + new_w] = _resize_to(im, new_w, new_h)
+    return padded, (size, size), (ratio, pad_w, pad_h)
+
+
+def preprocess(im_pil, size=640, out=None):
+    """PIL image -> float32 [3, size, size] in [0, 1], stretched like `T.Resize((size, size))` + `T.ToTensor()`.
+    Written into `out` when given. Returns the array and the original (w, h).
+    """
+    im, orig_size, _ = _resize(im_pil, size, 'resize')
+    if out is None:
+        out = np.empty((3, size, size), dtype=np.float32)
+    np.multiply(im.transpose(2, 0, 1), 1. / 255, out=out, casting='unsafe')
+    return out, orig_size
+
+
+def preprocess_batch(images, size=640, mode='resize', out=None, bgr=False):
+    """
+    Args:
+        images: list of PIL images, or of HWC uint8 arrays (video frames)
+        mode: 'resize' (stretch, the training eval transform) or 'letterbox' (aspect ratio kept, zero padded)
+        out: optional preallocated float32 [>=B, 3, size, size] buffer
+        bgr: the arrays are cv2 BGR frames, channels are flipped in the float conversion
+    Returns:
+        images [B, 3, size, size] float32, orig_target_sizes [B, 2] int64, metas for `postprocess`
+    """
+    assert mode in ('resize', 'letterbox'), mode
+    n = len(images)
+    resized = np.empty((n, size, size, 3), dtype=np.uint8)
+    orig_sizes = np.empty((n, 2), dtype=np.int64)
+    metas = []
+    for i, im in enumerate(images):
+        resized[i], orig_sizes[i], meta = _resize(im, size, mode)
+        metas.append(meta)
+
+    # one vectorized HWC uint8 -> CHW float32 conversion for the whole batch
+    if out is None:
+        out = np.empty((n, 3, size, size), dtype=np.float32)
+    out = out[:n]
+    if bgr:
+        resized = resized[..., ::-1]
+    np.multiply(resized.transpose(0, 3, 1, 2), 1. / 255, out=out, casting='unsafe')
+    return out, orig_sizes, metas
+
+
+def postprocess(labels, boxes, scores, metas=None, thrh=0.):
+    """Filter by score and map letterboxed boxes back to the original image.
+    Returns a list of (labels, boxes, scores) per image.
+    """
+    boxes = np.array(boxes, dtype=np.float32)
+    if metas is not None and any(m is not None for m in metas):
+        params = np.array([m if m is not None else (1., 0., 0.) for m in metas], dtype=np.float32)
+        ratio = params[:, 0, None, None]
+        pad = params[:, [1, 2, 1, 2]][:, None, :]
+        boxes = (boxes - pad) / ratio
+
+    results = []
+    for lab, box, scr in zip(labels, boxes, scores):
+        keep = scr > thrh
+        results.append((lab[keep], box[keep], scr[keep]))
+    return results
+
+
+def draw_detections(im_pil, labels, boxes, scores):
+    """Draw the detections of one image, as returned by `postprocess`, in place on a PIL image.
+    """
+    draw = ImageDraw.Draw(im_pil)
+    for lab, box, scr in zip(labels, boxes, scores):
+        box = [float(v) for v in box]
+        draw.rectangle(box, outline='red')
+        draw.text((box[0], box[1]), text=f'{int(lab)} {round(float(scr), 2)}', fill='blue')
+    return im_pil
+
+
+def video_stages(call, size=640, mode='resize'):
+    """`preprocess` / `infer` callbacks of VideoPipeline on the same pre/post-processing as images.
+    `call(images, orig_sizes) -> (labels, boxes, scores)` takes and returns numpy arrays, like the backends.
+    """
+    def preprocess(frame):
+        images, orig_sizes, metas = preprocess_batch([frame], size, mode, bgr=True)
+        return images[0], (orig_sizes[0], metas[0])
+
+    def infer(inputs, metas):
+        orig_sizes, metas = zip(*metas)
+        return postprocess(*call(inputs, np.stack(orig_sizes)), metas)
+
+    return preprocess, infer
+
+
+class TorchBackend(object):
+    """DEIM + PostProcessor loaded from a config and checkpoint.
+    `deploy=False` keeps the training-time module structure (only `.eval()`), for comparison.
+    """
+    name = 'torch'
+
+    def __init__(self, config, resume, device='cpu', size=640, deploy=True, channels_last=False):
+        import torch
+        import torch.nn as nn
+        from engine.core import YAMLConfig
+
+        cfg = YAMLConfig(config, resume=resume)
+        if 'HGNetv2' in cfg.yaml_cfg:
+            cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+        checkpoint = torch.load(resume, map_location='cpu')
+        if 'ema' in checkpoint:
+            state = checkpoint['ema']['module']
+        else:
+            state = checkpoint['model']
+        cfg.model.load_state_dict(state)
+
+        class Model(nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.model = cfg.model.deploy() if deploy else cfg.model.eval()
+                if channels_last:
+                    self.model.to_channels_last()
+                self.postprocessor = cfg.postprocessor.deploy()
+
+            def forward(self, images, orig_target_sizes):
+                outputs = self.model(images)
+                outputs = self.postprocessor(outputs, orig_target_sizes)
+                return outputs
+
+        self.name = 'torch' if deploy else 'torch_eager'
+        self.torch = torch
+        self.device = torch.device(device)
+        self.size = size
+        self.model = Model().to(self.device)
+
+    def allocate(self, batch_size):
+        # pinned host memory shared with a numpy view, filled in place and copied asynchronously
+        pin = self.device.type == 'cuda'
+        images = self.torch.empty(batch_size, 3, self.size, self.size, pin_memory=pin)
+        return images.numpy()
+
+    def __call__(self, images, orig_sizes):
+        torch = self.torch
+        with torch.no_grad():
+            images = torch.from_numpy(images).to(self.device, non_blocking=True)
+            orig_sizes = torch.from_numpy(np.asarray(orig_sizes, dtype=np.int64)).to(self.device)
+            labels, boxes, scores = self.model(images, orig_sizes)
+        return labels.cpu().numpy(), boxes.cpu().numpy(), scores.cpu().numpy()
+
+    def peak_memory(self, ):
+        """Peak device memory in MB, None on CPU.
+        """
+        if self.device.type == 'cuda':
+            return self.torch.cuda.max_memory_allocated(self.device) / 1024 ** 2
+        return None
+
+
+class ORTBackend(object):
+    """ONNX model exported by tools/deployment/export_onnx.py (model + postprocessor).
+    """
+    name = 'onnx'
+
+    def __init__(self, onnx_file, size=640, providers=None, num_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        self.sess = ort.InferenceSession(onnx_file, sess_options=options,
+                                         providers=providers or ['CPUExecutionProvider'])
+        self.size = size
+
+    def allocate(self, batch_size):
+        return np.empty((batch_size, 3, self.size, self.size), dtype=np.float32)
+
+    def __call__(self, images, orig_sizes):
+        labels, boxes, scores = self.sess.run(
+            output_names=None,
+            input_feed={'images': images, 'orig_target_sizes': np.asarray(orig_sizes, dtype=np.int64)}
+        )
+        return labels, boxes, scores
+
+    def peak_memory(self, ):
+        return None
+
+
+class OpenVINOBackend(object):
+    """OpenVINO runtime on the exported ONNX file (or a converted IR .xml).
+    """
+    name = 'openvino'
+
+    def __init__(self, model_file, size=640, device='CPU', num_threads=0):
+        import openvino as ov
+
+        core = ov.Core()
+        config = {'INFERENCE_NUM_THREADS': num_threads} if num_threads > 0 else {}
+        self.model = core.compile_model(core.read_model(model_file), device, config)
+        self.outputs = [self.model.output(i) for i in range(len(self.model.outputs))]
+        self.request = self.model.create_infer_request()
+        self.size = size
+
+    def allocate(self, batch_size):
+        return np.empty((batch_size, 3, self.size, self.size), dtype=np.float32)
+
+    def __call__(self, images, orig_sizes):
+        res = self.request.infer({'images': images, 'orig_target_sizes': np.asarray(orig_sizes, dtype=np.int64)})
+        labels, boxes, scores = [res[o] for o in self.outputs]
+        return labels, boxes, scores
+
+    def peak_memory(self, ):
+        return None
+
+
+def select_bundle_model(manifest_file, height, width):
+    """Pick the model of a `export_onnx.py --sizes` bundle closest to an (height, width) input,
+    by log-scale distance so that aspect ratio and scale both count.
+    Returns the model path and its (height, width).
+    """
+    import json
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    def distance(m):
+        return abs(np.log(m['height'] / height)) + abs(np.log(m['width'] / width))
+
+    best = min(manifest['models'], key=distance)
+    return os.path.join(os.path.dirname(manifest_file), best['file']), (best['height'], best['width'])
+
+
+BACKENDS = ['torch', 'torch_eager', 'onnx', 'openvino']
+
+
+def build_backend(name, config=None, resume=None, onnx_file=None, device='cpu', size=640, num_threads=0):
+    if name in ('torch', 'torch_eager'):
+        return TorchBackend(config, resume, device=device, size=size, deploy=name == 'torch')
+    elif name == 'onnx':
+        return ORTBackend(onnx_file, size=size, num_threads=num_threads)
+    elif name == 'openvino':
+        # OpenVINO device names: CPU, GPU, GPU.1, NPU, AUTO
+        return OpenVINOBackend(onnx_file, size=size, device=device.upper(), num_threads=num_threads)
+    raise ValueError(f'Unsupported backend {name}, expected one of {BACKENDS}')
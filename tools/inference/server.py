@@ -0,0 +1,262 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Long-running local inference service with dynamic batching.
+
+    # torch deploy model, TCP on localhost
+    python tools/inference/server.py --backend torch -c configs/deim_dfine/deim_hgnetv2_s_coco.yml -r model.pth --port 8765
+    # ONNX Runtime, JSON lines on stdin / stdout
+    python tools/inference/server.py --backend onnx --onnx model.onnx --stdin
+
+Protocol: one JSON object per line.
+    {"id": 0, "path": "a.jpg"}  or  {"id": 0, "image": "<base64 encoded jpg/png>"}
+    -> {"id": 0, "labels": [...], "boxes": [[x1, y1, x2, y2], ...], "scores": [...], "latency_ms": 12.3}
+    {"cmd": "stats"}
+    -> {"requests": ..., "throughput": ..., "latency_ms": {"p50": ...}, "batch_size": {"mean": ...}}
+
+Requests are decoded and resized on the connection threads, then coalesced by a single batching
+thread: a batch is launched when `max_batch_size` requests are queued or when the oldest one has
+waited `max_latency_ms`. Inputs are copied into a buffer preallocated by the backend.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import time
+import queue
+import base64
+import threading
+import socketserver
+from concurrent.futures import Future
+
+import numpy as np
+
+from runtime import BACKENDS, build_backend, load_image, preprocess
+
+
+class LatencyStats(object):
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.reset()
+
+    def reset(self, ):
+        with self.lock:
+            self.latency = []
+            self.batch_sizes = []
+            self.num_requests = 0
+            self.start = time.perf_counter()
+
+    def add_batch(self, latencies):
+        with self.lock:
+            self.latency.extend(latencies)
+            self.latency = self.latency[-self.window:]
+            self.batch_sizes.append(len(latencies))
+            self.batch_sizes = self.batch_sizes[-self.window:]
+            self.num_requests += len(latencies)
+
+    def summary(self, ):
+        with self.lock:
+            elapsed = time.perf_counter() - self.start
+            out = {'requests': self.num_requests, 'throughput': self.num_requests / max(elapsed, 1e-9)}
+            if self.latency:
+                lat = np.array(self.latency) * 1000
+                out['latency_ms'] = {k: float(np.percentile(lat, q)) for k, q in (('p50', 50), ('p90', 90), ('p99', 99))}
+                out['latency_ms']['mean'] = float(lat.mean())
+                out['batch_size'] = {'mean': float(np.mean(self.batch_sizes)), 'max': int(np.max(self.batch_sizes))}
+            return out
+
+
+class DynamicBatcher(object):
+    """Coalesce concurrent requests into batches under a latency budget.
+    """
+    def __init__(self, backend, max_batch_size=8, max_latency_ms=10., size=640, thrh=0.):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.
+        self.size = size
+        self.thrh = thrh
+
+        self.images = backend.allocate(max_batch_size)
+        self.orig_sizes = np.empty((max_batch_size, 2), dtype=np.int64)
+
+        self.stats = LatencyStats()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name='batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, data) -> Future:
+        """`data`: file path or encoded image bytes. Runs decoding on the calling thread.
+        """
+        arrival = time.perf_counter()
+        future = Future()
+        try:
+            image, orig_size = preprocess(load_image(data), self.size)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self.queue.put((arrival, image, orig_size, future))
+        return future
+
+    def close(self, ):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self, ):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[0] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self, ):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            n = len(batch)
+            for i, (_, image, orig_size, _) in enumerate(batch):
+                self.images[i] = image
+                self.orig_sizes[i] = orig_size
+
+            try:
+                labels, boxes, scores = self.backend(self.images[:n], self.orig_sizes[:n])
+            except Exception as e:
+                for item in batch:
+                    item[-1].set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            latencies = []
+            for i, (arrival, _, _, future) in enumerate(batch):
+                keep = scores[i] > self.thrh
+                latencies.append(done - arrival)
+                future.set_result({
+                    'labels': labels[i][keep].tolist(),
+                    'boxes': boxes[i][keep].tolist(),
+                    'scores': scores[i][keep].tolist(),
+                    'latency_ms': (done - arrival) * 1000,
+                })
+            self.stats.add_batch(latencies)
+
+
+def handle(batcher: DynamicBatcher, line: str) -> dict:
+    try:
+        request = json.loads(line)
+        if request.get('cmd') == 'stats':
+            return batcher.stats.summary()
+        if request.get('cmd') == 'reset_stats':
+            batcher.stats.reset()
+            return {'ok': True}
+
+        data = base64.b64decode(request['image']) if 'image' in request else request['path']
+        response = batcher.submit(data).result()
+        response['id'] = request.get('id', None)
+        return response
+
+    except Exception as e:
+        return {'error': repr(e)}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self, ):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = handle(self.server.batcher, line)
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve_stdin(batcher: DynamicBatcher, num_threads=8):
+    # requests are answered as they finish, use `id` to match them
+    lock = threading.Lock()
+    lines = queue.Queue(num_threads * 2)
+
+    def worker():
+        while True:
+            line = lines.get()
+            if line is None:
+                return
+            response = handle(batcher, line)
+            with lock:
+                sys.stdout.write(json.dumps(response) + '\n')
+                sys.stdout.flush()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(num_threads)]
+    for t in threads:
+        t.start()
+    for line in sys.stdin:
+        if line.strip():
+            lines.put(line)
+    for _ in threads:
+        lines.put(None)
+    for t in threads:
+        t.join()
+
+
+def main(args, ):
+    backend = build_backend(args.backend, config=args.config, resume=args.resume, onnx_file=args.onnx,
+                            device=args.device, size=args.size, num_threads=args.num_threads)
+    batcher = DynamicBatcher(backend, max_batch_size=args.max_batch_size, max_latency_ms=args.max_latency_ms,
+                             size=args.size, thrh=args.thrh)
+
+    # warmup at every batch size the batcher can produce
+    for n in range(1, args.max_batch_size + 1):
+        backend(batcher.images[:n], np.full((n, 2), args.size, dtype=np.int64))
+    batcher.stats.reset()
+
+    try:
+        if args.stdin:
+            serve_stdin(batcher)
+        else:
+            with _Server((args.host, args.port), _Handler) as server:
+                server.batcher = batcher
+                print(f'Serving {args.backend} backend on {args.host}:{args.port}', file=sys.stderr)
+                server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.close()
+        print(json.dumps(batcher.stats.summary()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', type=str, default='torch', choices=BACKENDS)
+    parser.add_argument('-c', '--config', type=str, help='torch backend')
+    parser.add_argument('-r', '--resume', type=str, help='torch backend')
+    parser.add_argument('--onnx', type=str, help='onnx / openvino backend')
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--num-threads', type=int, default=0, help='onnxruntime intra-op threads, 0 for default')
+    parser.add_argument('--size', type=int, default=640)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    parser.add_argument('--max-latency-ms', type=float, default=10.)
+    parser.add_argument('--thrh', type=float, default=0.4, help='drop detections below this score from responses')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--stdin', action='store_true', help='read requests from stdin instead of a socket')
+    args = parser.parse_args()
+
+    main(args)
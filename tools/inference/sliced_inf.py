@@ -0,0 +1,75 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Sliced (tiled) inference for large images, see engine/deim/sliced_inference.py.
+
+    # one image, draws to sliced_results.jpg
+    python tools/inference/sliced_inf.py -c configs/test/visdrone2019.yml -r best_stg2.pth -i image.jpg -d cuda
+    # COCO eval on the full resolution val images
+    python tools/inference/sliced_inf.py -c configs/test/visdrone2019.yml -r best_stg2.pth --eval -d cuda
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+import argparse
+
+import torch
+import torchvision.transforms.functional as TF
+
+from engine.core import YAMLConfig
+from engine.deim.sliced_inference import SlicedInference
+from engine.solver.det_engine import evaluate_sliced
+from runtime import load_image, postprocess, draw_detections
+
+
+def main(args, ):
+    cfg = YAMLConfig(args.config, resume=args.resume)
+    if 'HGNetv2' in cfg.yaml_cfg:
+        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
+
+    checkpoint = torch.load(args.resume, map_location='cpu')
+    state = checkpoint['ema']['module'] if 'ema' in checkpoint else checkpoint['model']
+    cfg.model.load_state_dict(state)
+
+    device = torch.device(args.device)
+    size = cfg.yaml_cfg.get('eval_spatial_size', [640, 640])[0]
+    sliced = SlicedInference(cfg.model.deploy(), cfg.postprocessor.eval(), tile_size=args.tile_size or size,
+                             overlap=args.overlap, input_size=size, full_image=not args.no_full_image,
+                             batch_size=args.batch_size, merge=args.merge, iou_threshold=args.iou_threshold,
+                             max_det=args.max_det).to(device)
+
+    if args.eval:
+        dataset = cfg.val_dataloader.dataset
+        stats, _ = evaluate_sliced(sliced, dataset, cfg.evaluator, device)
+        print(stats)
+        return
+
+    image = load_image(args.input)
+    result = sliced([TF.to_tensor(image).to(device)])[0]
+    labels, boxes, scores = (result[k][None].cpu().numpy() for k in ('labels', 'boxes', 'scores'))
+    draw_detections(image, *postprocess(labels, boxes, scores, thrh=args.threshold)[0]).save('sliced_results.jpg')
+    print(f'{len(result["scores"])} detections, tile batch size {sliced.batch_size}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', type=str, required=True)
+    parser.add_argument('-r', '--resume', type=str, required=True)
+    parser.add_argument('-i', '--input', type=str, default=None)
+    parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--eval', action='store_true', help='COCO eval on the val dataset instead of one image')
+    parser.add_argument('--tile-size', type=int, default=None, help='defaults to the model input size')
+    parser.add_argument('--overlap', type=float, default=0.2)
+    parser.add_argument('--no-full-image', action='store_true', help='tiles only, no full image pass')
+    parser.add_argument('--batch-size', type=int, default=None, help='tiles per model call, default sized to memory')
+    parser.add_argument('--merge', type=str, default='nms', choices=['nms', 'wbf'])
+    parser.add_argument('--iou-threshold', type=float, default=0.5)
+    parser.add_argument('--max-det', type=int, default=300)
+    parser.add_argument('--threshold', type=float, default=0.4, help='score threshold for drawing')
+    args = parser.parse_args()
+    assert args.eval or args.input, 'either -i or --eval'
+
+    main(args)
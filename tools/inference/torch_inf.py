@@ -2,149 +2,42 @@
 Copyright (c) 2024 The D-FINE Authors. All Rights Reserved.
 """
 
-import torch
-import torch.nn as nn
-import torchvision.transforms as T
-
-import numpy as np
-from PIL import Image, ImageDraw
-
-import sys
 import os
-import cv2  # Added for video processing
-
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from engine.core import YAMLConfig
-
-
-def draw(images, labels, boxes, scores, thrh=0.4):
-    for i, im in enumerate(images):
-        draw = ImageDraw.Draw(im)
-
-        scr = scores[i]
-        lab = labels[i][scr > thrh]
-        box = boxes[i][scr > thrh]
-        scrs = scr[scr > thrh]
-
-        for j, b in enumerate(box):
-            draw.rectangle(list(b), outline='red')
-            draw.text((b[0], b[1]), text=f"{lab[j].item()} {round(scrs[j].item(), 2)}", fill='blue', )
-
-        im.save('torch_results.jpg')
-
-
-def process_image(model, device, file_path):
-    im_pil = Image.open(file_path).convert('RGB')
-    w, h = im_pil.size
-    orig_size = torch.tensor([[w, h]]).to(device)
-
-    transforms = T.Compose([
-        T.Resize((640, 640)),
-        T.ToTensor(),
-    ])
-    im_data = transforms(im_pil).unsqueeze(0).to(device)
-
-    output = model(im_data, orig_size)
-    labels, boxes, scores = output
-
-    draw([im_pil], labels, boxes, scores)
-
-
-def process_video(model, device, file_path):
-    cap = cv2.VideoCapture(file_path)
 
-    # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+from runtime import TorchBackend, load_image, preprocess_batch, postprocess, draw_detections, video_stages
+from video_pipeline import VideoPipeline
 
-    # Define the codec and create VideoWriter object
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter('torch_results.mp4', fourcc, fps, (orig_w, orig_h))
 
-    transforms = T.Compose([
-        T.Resize((640, 640)),
-        T.ToTensor(),
-    ])
+def process_image(m, file_path, thrh=0.4):
+    im_pil = load_image(file_path)
+    images, orig_sizes, metas = preprocess_batch([im_pil], m.size)
+    result, = postprocess(*m(images, orig_sizes), metas, thrh=thrh)
 
-    frame_count = 0
-    print("Processing video frames...")
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+    draw_detections(im_pil, *result).save('torch_results.jpg')
 
-        # Convert frame to PIL image
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
 
-        w, h = frame_pil.size
-        orig_size = torch.tensor([[w, h]]).to(device)
-
-        im_data = transforms(frame_pil).unsqueeze(0).to(device)
-
-        output = model(im_data, orig_size)
-        labels, boxes, scores = output
-
-        # Draw detections on the frame
-        draw([frame_pil], labels, boxes, scores)
-
-        # Convert back to OpenCV image
-        frame = cv2.cvtColor(np.array(frame_pil), cv2.COLOR_RGB2BGR)
-
-        # Write the frame
-        out.write(frame)
-        frame_count += 1
-
-        if frame_count % 10 == 0:
-            print(f"Processed {frame_count} frames...")
-
-    cap.release()
-    out.release()
-    print("Video processing complete. Result saved as 'results_video.mp4'.")
+def process_video(m, file_path, batch_size=1, num_workers=2, queue_size=8, drop_frames=False):
+    preprocess, infer = video_stages(m, m.size)
+    pipeline = VideoPipeline(preprocess, infer, batch_size=batch_size, num_workers=num_workers,
+                             queue_size=queue_size, drop_frames=drop_frames)
+    pipeline.run(file_path, 'torch_results.mp4')
 
 
 def main(args):
     """Main function"""
-    cfg = YAMLConfig(args.config, resume=args.resume)
-
-    if 'HGNetv2' in cfg.yaml_cfg:
-        cfg.yaml_cfg['HGNetv2']['pretrained'] = False
-
-    if args.resume:
-        checkpoint = torch.load(args.resume, map_location='cpu')
-        if 'ema' in checkpoint:
-            state = checkpoint['ema']['module']
-        else:
-            state = checkpoint['model']
-    else:
-        raise AttributeError('Only support resume to load model.state_dict by now.')
-
     # Load train mode state and convert to deploy mode
-    cfg.model.load_state_dict(state)
-
-    class Model(nn.Module):
-        def __init__(self):
-            super().__init__()
-            self.model = cfg.model.deploy()
-            self.postprocessor = cfg.postprocessor.deploy()
-
-        def forward(self, images, orig_target_sizes):
-            outputs = self.model(images)
-            outputs = self.postprocessor(outputs, orig_target_sizes)
-            return outputs
-
-    device = args.device
-    model = Model().to(device)
+    m = TorchBackend(args.config, args.resume, device=args.device, channels_last=args.channels_last)
 
     # Check if the input file is an image or a video
     file_path = args.input
     if os.path.splitext(file_path)[-1].lower() in ['.jpg', '.jpeg', '.png', '.bmp']:
         # Process as image
-        process_image(model, device, file_path)
+        process_image(m, file_path)
         print("Image processing complete.")
     else:
         # Process as video
-        process_video(model, device, file_path)
+        process_video(m, file_path, batch_size=args.batch_size, num_workers=args.workers,
+                      queue_size=args.queue_size, drop_frames=args.drop_frames)
 
 
 if __name__ == '__main__':
@@ -154,5 +47,10 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--resume', type=str, required=True)
     parser.add_argument('-i', '--input', type=str, required=True)
     parser.add_argument('-d', '--device', type=str, default='cpu')
+    parser.add_argument('--batch-size', type=int, default=1, help='frames per model call for video input')
+    parser.add_argument('--workers', type=int, default=2, help='preprocess threads for video input')
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--channels-last', action='store_true', help='NHWC backbone / encoder, faster on CPU')
+    parser.add_argument('--drop-frames', action='store_true', help='drop frames instead of stalling the decoder')
     args = parser.parse_args()
     main(args)
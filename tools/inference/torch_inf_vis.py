@@ -12,7 +12,10 @@ from PIL import Image, ImageDraw, ImageFont
 import sys
 import os
 import cv2  # Added for video processing
+import json
 import random
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
@@ -141,34 +144,129 @@ def process_video(model, file_path):
     out.release()
     print("Video processing complete. Result saved as 'results_video.mp4'.")
 
-def process_dataset(model, dataset_path, output_path, thrh=0.5):
-    os.makedirs(output_path, exist_ok=True)
-    image_paths = [os.path.join(dataset_path, f) for f in os.listdir(dataset_path) if f.endswith(('.jpg', '.png'))]
-    
-    transforms = T.Compose([
-        T.Resize((640, 640)),
-        T.ToTensor(),
-    ])
-    
-    print(f"Found {len(image_paths)} images in validation set...")
-    for idx, file_path in enumerate(image_paths):
-        im_pil = Image.open(file_path).convert('RGB')
-        w, h = im_pil.size
-        orig_size = torch.tensor([[w, h]]).cuda()
+class ImageFolder(torch.utils.data.Dataset):
+    def __init__(self, image_paths, size=640):
+        self.image_paths = image_paths
+        self.transforms = T.Compose([
+            T.Resize((size, size)),
+            T.ToTensor(),
+        ])
 
-        # 图像预处理
-        im_data = transforms(im_pil).unsqueeze(0).cuda()
-        output = model(im_data, orig_size)
-        labels, boxes, scores = output[0]['labels'], output[0]['boxes'], output[0]['scores']
-        
-        # 绘制结果
-        vis_image = draw(im_pil.copy(), labels, boxes, scores, thrh)
-        save_path = os.path.join(output_path, f"vis_{os.path.basename(file_path)}")
-        vis_image.save(save_path)
+    def __len__(self):
+        return len(self.image_paths)
 
-        if idx % 500 == 0:
-            print(f"Processed {idx}/{len(image_paths)} images...")
+    def __getitem__(self, idx):
+        im_pil = Image.open(self.image_paths[idx]).convert('RGB')
+        w, h = im_pil.size
+        return self.transforms(im_pil), torch.tensor([w, h]), idx
+
+
+def load_finished(pred_file):
+    """Read the predictions of a previous (possibly interrupted) run, dropping a truncated last line.
+    """
+    records = []
+    if not os.path.exists(pred_file):
+        return records
+    with open(pred_file, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    # rewrite so that new records are appended after the last complete one
+    with open(pred_file, 'w') as f:
+        f.writelines(json.dumps(r) + '\n' for r in records)
+    return records
+
+
+def save_vis(file_path, output_path, labels, boxes, scores, thrh):
+    im_pil = Image.open(file_path).convert('RGB')
+    vis_image = draw(im_pil, labels, boxes, scores, thrh)
+    vis_image.save(os.path.join(output_path, f"vis_{os.path.basename(file_path)}"))
+
+
+def write_coco_json(records, output_file):
+    images, annotations = [], []
+    for image_id, r in enumerate(sorted(records, key=lambda r: r['file_name'])):
+        images.append({'id': image_id, 'file_name': r['file_name'], 'width': r['width'], 'height': r['height']})
+        for label, box, score in zip(r['labels'], r['boxes'], r['scores']):
+            x1, y1, x2, y2 = box
+            annotations.append({'id': len(annotations), 'image_id': image_id, 'category_id': label,
+                                'bbox': [x1, y1, x2 - x1, y2 - y1], 'area': (x2 - x1) * (y2 - y1),
+                                'score': score, 'iscrowd': 0})
+    categories = [{'id': k, 'name': v} for k, v in label_map.items()]
+    with open(output_file, 'w') as f:
+        json.dump({'images': images, 'annotations': annotations, 'categories': categories}, f)
+
+
+@torch.no_grad()
+def process_dataset(model, dataset_path, output_path, thrh=0.5, batch_size=16, num_workers=8, num_writers=4, vis=True, resume=True):
+    """Batched inference over an image folder.
+
+    Images are decoded and resized by DataLoader workers, detections above `thrh` are appended
+    to `predictions.jsonl` by a single writer thread and visualisations are rendered by a pool of
+    `num_writers` threads, so the GPU never waits for disk. `predictions.jsonl` doubles as the
+    resume log, images already listed there are skipped. A COCO-format `predictions.json` is written at the end.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    image_paths = sorted(os.path.join(dataset_path, f) for f in os.listdir(dataset_path) if f.endswith(('.jpg', '.png')))
+    print(f"Found {len(image_paths)} images in validation set...")
 
+    pred_file = os.path.join(output_path, 'predictions.jsonl')
+    records = load_finished(pred_file) if resume else []
+    if not resume and os.path.exists(pred_file):
+        os.remove(pred_file)
+    finished = set(r['file_name'] for r in records)
+    todo = [p for p in image_paths if os.path.basename(p) not in finished]
+    if finished:
+        print(f"Resume: {len(finished)} images already processed, {len(todo)} left...")
+
+    loader = torch.utils.data.DataLoader(ImageFolder(todo), batch_size=batch_size, num_workers=num_workers,
+                                         pin_memory=True, prefetch_factor=4 if num_workers > 0 else None)
+    device = next(model.parameters()).device
+
+    def write_records(batch_records):
+        with open(pred_file, 'a') as f:
+            f.writelines(json.dumps(r) + '\n' for r in batch_records)
+            f.flush()
+
+    json_pool = ThreadPoolExecutor(max_workers=1)
+    vis_pool = ThreadPoolExecutor(max_workers=num_writers)
+    pending = collections.deque()
+
+    num_done = 0
+    for step, (im_data, orig_size, indices) in enumerate(loader):
+        output = model(im_data.to(device, non_blocking=True), orig_size.to(device, non_blocking=True))
+
+        batch_records = []
+        for i, out in zip(indices.tolist(), output):
+            keep = out['scores'] > thrh
+            labels, boxes, scores = out['labels'][keep].cpu(), out['boxes'][keep].cpu(), out['scores'][keep].cpu()
+            file_path = todo[i]
+            w, h = orig_size[len(batch_records)].tolist()
+            batch_records.append({'file_name': os.path.basename(file_path), 'width': w, 'height': h,
+                                  'labels': labels.tolist(), 'boxes': boxes.tolist(), 'scores': scores.tolist()})
+            if vis:
+                pending.append(vis_pool.submit(save_vis, file_path, output_path, labels, boxes, scores, thrh))
+
+        # predictions are logged only after the batch is complete, a crash never records half a batch
+        records.extend(batch_records)
+        pending.append(json_pool.submit(write_records, batch_records))
+
+        # bound the number of in-flight writes so that a slow disk applies backpressure
+        while len(pending) > 4 * (num_writers + 1) * batch_size:
+            pending.popleft().result()
+
+        num_done += len(batch_records)
+        if step % max(500 // batch_size, 1) == 0:
+            print(f"Processed {num_done}/{len(todo)} images...")
+
+    for f in pending:
+        f.result()
+    json_pool.shutdown()
+    vis_pool.shutdown()
+
+    write_coco_json(records, os.path.join(output_path, 'predictions.json'))
     print("Visualization complete. Results saved in:", output_path)
 
 
@@ -203,7 +301,8 @@ def main(args):
             return outputs
 
     model = Model()
-    process_dataset(model, args.dataset, args.output, thrh=0.5)
+    process_dataset(model, args.dataset, args.output, thrh=args.thrh, batch_size=args.batch_size,
+                    num_workers=args.workers, num_writers=args.writers, vis=not args.no_vis, resume=not args.no_resume)
     # file_path = args.input
     # if os.path.splitext(file_path)[-1].lower() in ['.jpg', '.jpeg', '.png', '.bmp']:
     #     process_image(model, file_path)
@@ -219,5 +318,11 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--resume', type=str, required=True)
     parser.add_argument('-d', '--dataset', type=str, default='./data/fiftyone/validation/data')
     parser.add_argument('-o', '--output', type=str, required=True, help="Path to save visualized results")
+    parser.add_argument('-b', '--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=8, help="dataloader workers for decoding / resizing")
+    parser.add_argument('--writers', type=int, default=4, help="threads writing visualizations")
+    parser.add_argument('--thrh', type=float, default=0.5)
+    parser.add_argument('--no-vis', action='store_true', help="only write predictions")
+    parser.add_argument('--no-resume', action='store_true', help="ignore predictions of a previous run")
     args = parser.parse_args()
     main(args)
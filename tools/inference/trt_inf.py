@@ -8,15 +8,15 @@ import collections
 from collections import OrderedDict
 
 import numpy as np
-from PIL import Image, ImageDraw
 
 import torch
-import torchvision.transforms as T
 
 import tensorrt as trt
-import cv2  # Added for video processing
 import os
 
+from runtime import load_image, preprocess_batch, postprocess, draw_detections, video_stages
+from video_pipeline import VideoPipeline
+
 class TimeProfiler(contextlib.ContextDecorator):
     def __init__(self):
         self.total = 0
@@ -114,100 +114,35 @@ class TRTInference(object):
         if self.backend == 'torch' and torch.cuda.is_available():
             torch.cuda.synchronize()
 
-def draw(images, labels, boxes, scores, thrh=0.4):
-    for i, im in enumerate(images):
-        draw = ImageDraw.Draw(im)
-        scr = scores[i]
-        lab = labels[i][scr > thrh]
-        box = boxes[i][scr > thrh]
-        scrs = scr[scr > thrh]
-
-        for j, b in enumerate(box):
-            draw.rectangle(list(b), outline='red')
-            draw.text(
-                (b[0], b[1]),
-                text=f"{lab[j].item()} {round(scrs[j].item(), 2)}",
-                fill='blue',
-            )
-
-    return images
-
-def process_image(m, file_path, device):
-    im_pil = Image.open(file_path).convert('RGB')
-    w, h = im_pil.size
-    orig_size = torch.tensor([w, h])[None].to(device)
-
-    transforms = T.Compose([
-        T.Resize((640, 640)),
-        T.ToTensor(),
-    ])
-    im_data = transforms(im_pil)[None]
-
-    blob = {
-        'images': im_data.to(device),
-        'orig_target_sizes': orig_size.to(device),
-    }
-
-    output = m(blob)
-    result_images = draw([im_pil], output['labels'], output['boxes'], output['scores'])
-    result_images[0].save('trt_result.jpg')
-    print("Image processing complete. Result saved as 'result.jpg'.")
-
-def process_video(m, file_path, device):
-    cap = cv2.VideoCapture(file_path)
-
-    # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    # Define the codec and create VideoWriter object
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter('trt_result.mp4', fourcc, fps, (orig_w, orig_h))
-
-    transforms = T.Compose([
-        T.Resize((640, 640)),
-        T.ToTensor(),
-    ])
-
-    frame_count = 0
-    print("Processing video frames...")
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # Convert frame to PIL image
-        frame_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-
-        w, h = frame_pil.size
-        orig_size = torch.tensor([w, h])[None].to(device)
-
-        im_data = transforms(frame_pil)[None]
-
+def engine_call(m, device):
+    """numpy in / numpy out wrapper of the engine, the calling convention of `runtime` backends.
+    """
+    def call(images, orig_sizes):
         blob = {
-            'images': im_data.to(device),
-            'orig_target_sizes': orig_size.to(device),
+            'images': torch.from_numpy(images).to(device),
+            'orig_target_sizes': torch.from_numpy(orig_sizes).to(device),
         }
-
         output = m(blob)
+        # output bindings are reused by the next call, copy them out
+        n = len(images)
+        return [output[k][:n].cpu().numpy() for k in ('labels', 'boxes', 'scores')]
+    return call
 
-        # Draw detections on the frame
-        result_images = draw([frame_pil], output['labels'], output['boxes'], output['scores'])
-
-        # Convert back to OpenCV image
-        frame = cv2.cvtColor(np.array(result_images[0]), cv2.COLOR_RGB2BGR)
+def process_image(m, file_path, device, thrh=0.4):
+    im_pil = load_image(file_path)
+    images, orig_sizes, metas = preprocess_batch([im_pil], 640)
+    result, = postprocess(*engine_call(m, device)(images, orig_sizes), metas, thrh=thrh)
 
-        # Write the frame
-        out.write(frame)
-        frame_count += 1
+    draw_detections(im_pil, *result).save('trt_result.jpg')
+    print("Image processing complete. Result saved as 'trt_result.jpg'.")
 
-        if frame_count % 10 == 0:
-            print(f"Processed {frame_count} frames...")
+def process_video(m, file_path, device, batch_size=1, num_workers=2, queue_size=8, drop_frames=False):
+    preprocess, infer = video_stages(engine_call(m, device), 640)
 
-    cap.release()
-    out.release()
-    print("Video processing complete. Result saved as 'result_video.mp4'.")
+    assert batch_size <= m.max_batch_size, 'batch_size exceeds the engine max_batch_size'
+    pipeline = VideoPipeline(preprocess, infer, batch_size=batch_size, num_workers=num_workers,
+                             queue_size=queue_size, drop_frames=drop_frames)
+    pipeline.run(file_path, 'trt_result.mp4')
 
 if __name__ == '__main__':
     import argparse
@@ -215,6 +150,10 @@ if __name__ == '__main__':
     parser.add_argument('-trt', '--trt', type=str, required=True)
     parser.add_argument('-i', '--input', type=str, required=True)
     parser.add_argument('-d', '--device', type=str, default='cuda:0')
+    parser.add_argument('--batch-size', type=int, default=1, help='frames per engine call for video input')
+    parser.add_argument('--workers', type=int, default=2, help='preprocess threads for video input')
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--drop-frames', action='store_true', help='drop frames instead of stalling the decoder')
 
     args = parser.parse_args()
 
@@ -226,4 +165,5 @@ if __name__ == '__main__':
         process_image(m, file_path, args.device)
     else:
         # Process as video
-        process_video(m, file_path, args.device)
+        process_video(m, file_path, args.device, batch_size=args.batch_size, num_workers=args.workers,
+                      queue_size=args.queue_size, drop_frames=args.drop_frames)
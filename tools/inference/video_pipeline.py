@@ -0,0 +1,258 @@
+"""
+DEIM: DETR with Improved Matching for Fast Convergence
+Copyright (c) 2024 The DEIM Authors. All Rights Reserved.
+
+Streaming video inference shared by torch_inf.py / onnx_inf.py / trt_inf.py / openvino_inf.py.
+
+    decode -> preprocess (N workers) -> infer (micro-batch) -> draw -> encode
+
+Stages run on threads connected by bounded queues (cv2, numpy, onnxruntime, torch and
+tensorrt release the GIL in their hot loops). Each backend only provides
+
+    preprocess(frame_bgr) -> (input: np.ndarray [3, H, W] float32, meta)
+    infer(inputs: np.ndarray [B, 3, H, W], metas) -> [(labels, boxes, scores), ...]
+
+with `boxes` already mapped back to xyxy in frame coordinates. `runtime.video_stages` builds both
+on `preprocess_batch` / `postprocess`, the same resize and letterbox as image inference.
+"""
+
+import time
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+__all__ = ['VideoPipeline', 'draw_frame', ]
+
+
+_STOP = object()
+
+
+def draw_frame(frame, labels, boxes, scores, thrh=0.4):
+    """Draw detections in place on a BGR frame.
+    """
+    keep = scores > thrh
+    for lab, box, scr in zip(labels[keep], boxes[keep], scores[keep]):
+        x1, y1, x2, y2 = [int(round(float(v))) for v in box]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 1)
+        cv2.putText(frame, f'{int(lab)} {float(scr):.2f}', (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 0, 0), 1)
+    return frame
+
+
+class _StageTimer(object):
+    def __init__(self, ):
+        self.lock = threading.Lock()
+        self.times = {}
+
+    def add(self, name, seconds, n=1):
+        with self.lock:
+            # per frame latency, a batch of n frames counts n times with its mean cost
+            self.times.setdefault(name, []).extend([seconds / n] * n)
+
+    def summary(self, ):
+        out = {}
+        for name, ts in self.times.items():
+            ts = np.array(ts) * 1000
+            out[name] = {'mean': ts.mean(), 'p50': np.percentile(ts, 50), 'p90': np.percentile(ts, 90), 'p99': np.percentile(ts, 99)}
+        return out
+
+
+class VideoPipeline(object):
+    """
+    Args:
+        preprocess: frame_bgr -> (input, meta)
+        infer: (inputs, metas) -> list of (labels, boxes, scores)
+        batch_size: max frames per model call, a partial batch is flushed after `batch_timeout` seconds
+        queue_size: capacity of every inter-stage queue
+        num_workers: preprocess threads
+        drop_frames: drop decoded frames instead of blocking the decoder when the pipeline is full
+            (for live sources), kept frames are still written in order
+    """
+    def __init__(self,
+                 preprocess,
+                 infer,
+                 batch_size=1,
+                 queue_size=8,
+                 num_workers=2,
+                 drop_frames=False,
+                 batch_timeout=0.005,
+                 thrh=0.4,
+                 print_freq=100):
+        self.preprocess = preprocess
+        self.infer = infer
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.num_workers = num_workers
+        self.drop_frames = drop_frames
+        self.batch_timeout = batch_timeout
+        self.thrh = thrh
+        self.print_freq = print_freq
+
+    def run(self, video_path, output_path):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (orig_w, orig_h))
+
+        self.timer = _StageTimer()
+        self.num_dropped = 0
+        self.num_written = 0
+        self.errors = []
+        self._abort = False
+
+        decode_q = queue.Queue(self.queue_size)
+        infer_q = queue.Queue(self.queue_size)
+        draw_q = queue.Queue(self.queue_size)
+        encode_q = queue.Queue(self.queue_size)
+
+        threads = [threading.Thread(target=self._guard, args=(self._decode, cap, decode_q), name='decode')]
+        threads += [threading.Thread(target=self._guard, args=(self._preprocess, decode_q, infer_q), name=f'preprocess{i}')
+                    for i in range(self.num_workers)]
+        threads += [
+            threading.Thread(target=self._guard, args=(self._infer, infer_q, draw_q), name='infer'),
+            threading.Thread(target=self._guard, args=(self._draw, draw_q, encode_q), name='draw'),
+        ]
+
+        print('Processing video frames...')
+        start = time.perf_counter()
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            self._guard(self._encode, encode_q, writer)
+            if not self.errors:
+                for t in threads:
+                    t.join()
+        finally:
+            cap.release()
+            writer.release()
+
+        if self.errors:
+            raise self.errors[0]
+
+        total = time.perf_counter() - start
+        print(f'Video processing complete. Result saved as {output_path!r}.')
+        self.report(total)
+        return self.timer.summary()
+
+    def report(self, total_time):
+        print('-' * 64)
+        print('{:<12}{:>12}{:>12}{:>12}{:>12}'.format('stage(ms)', 'mean', 'p50', 'p90', 'p99'))
+        for name, s in self.timer.summary().items():
+            print('{:<12}{:>12.2f}{:>12.2f}{:>12.2f}{:>12.2f}'.format(name, s['mean'], s['p50'], s['p90'], s['p99']))
+        print(f'frames: {self.num_written}, dropped: {self.num_dropped}, fps: {self.num_written / total_time:.2f}')
+
+    def _guard(self, fn, *args):
+        try:
+            fn(*args)
+        except BaseException as e:
+            self.errors.append(e)
+            self._abort = True
+
+    # every stage forwards the stop signal in `finally`, so a failing stage can not block the ones downstream
+
+    def _decode(self, cap, out_q):
+        idx = 0
+        try:
+            while cap.isOpened() and not self._abort:
+                t = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self.timer.add('decode', time.perf_counter() - t)
+
+                if self.drop_frames:
+                    try:
+                        out_q.put_nowait((idx, frame))
+                    except queue.Full:
+                        self.num_dropped += 1
+                        continue
+                else:
+                    out_q.put((idx, frame))
+                idx += 1
+        finally:
+            for _ in range(self.num_workers):
+                out_q.put(_STOP)
+
+    def _preprocess(self, in_q, out_q):
+        try:
+            while True:
+                item = in_q.get()
+                if item is _STOP:
+                    return
+                idx, frame = item
+                t = time.perf_counter()
+                data, meta = self.preprocess(frame)
+                self.timer.add('preprocess', time.perf_counter() - t)
+                out_q.put((idx, frame, data, meta))
+        finally:
+            out_q.put(_STOP)
+
+    def _infer(self, in_q, out_q):
+        num_stopped = 0
+        try:
+            while num_stopped < self.num_workers:
+                batch = []
+                item = in_q.get()
+                while True:
+                    if item is _STOP:
+                        num_stopped += 1
+                        if num_stopped == self.num_workers:
+                            break
+                    else:
+                        batch.append(item)
+                        if len(batch) == self.batch_size:
+                            break
+                    try:
+                        item = in_q.get(timeout=self.batch_timeout)
+                    except queue.Empty:
+                        break
+
+                if not batch:
+                    continue
+
+                t = time.perf_counter()
+                inputs = np.stack([b[2] for b in batch], axis=0)
+                results = self.infer(inputs, [b[3] for b in batch])
+                self.timer.add('infer', time.perf_counter() - t, n=len(batch))
+
+                for (idx, frame, _, _), result in zip(batch, results):
+                    out_q.put((idx, frame, result))
+        finally:
+            out_q.put(_STOP)
+
+    def _draw(self, in_q, out_q):
+        try:
+            while True:
+                item = in_q.get()
+                if item is _STOP:
+                    return
+                idx, frame, (labels, boxes, scores) = item
+                t = time.perf_counter()
+                draw_frame(frame, labels, boxes, scores, self.thrh)
+                self.timer.add('draw', time.perf_counter() - t)
+                out_q.put((idx, frame))
+        finally:
+            out_q.put(_STOP)
+
+    def _encode(self, in_q, writer):
+        # preprocess workers may finish out of order, restore frame order before writing
+        pending, next_idx = {}, 0
+        while True:
+            item = in_q.get()
+            if item is _STOP:
+                break
+            idx, frame = item
+            pending[idx] = frame
+            while next_idx in pending:
+                t = time.perf_counter()
+                writer.write(pending.pop(next_idx))
+                self.timer.add('encode', time.perf_counter() - t)
+                next_idx += 1
+                self.num_written += 1
+                if self.num_written % self.print_freq == 0:
+                    print(f'Processed {self.num_written} frames...')